@@ -0,0 +1 @@
+"""Benchmarks for measuring how dysco's operations scale, run with ``python -m benchmarks``."""
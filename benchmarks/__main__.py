@@ -0,0 +1,82 @@
+"""Run the benchmark suite, save the results as JSON, and optionally compare them to a baseline.
+
+Usage: ``python -m benchmarks [--quick] [--output PATH] [--compare PATH] [--filter NAME]``
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Dict, List
+
+import dysco
+from benchmarks import access, concurrency, memory, middleware  # noqa: F401 (registers them)
+from benchmarks.utilities import Options, Result, benchmarks, result_key
+from dysco import scope
+
+
+def compare(results: List[Result], baseline_path: str) -> None:
+    """Print each result next to the matching result from a previous run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    baseline_values: Dict = {result_key(result): result['value'] for result in baseline['results']}
+
+    print(f'\nComparison against {baseline_path} (version {baseline["version"]}):')
+    for result in results:
+        old_value = baseline_values.get(result_key(result))
+        if not old_value:
+            continue
+        ratio = result['value'] / old_value
+        # Higher is better for throughput, and lower is better for everything else.
+        improvement = ratio if result['unit'] == 'ops/s' else 1 / ratio
+        print(
+            f'{format_result(result)}: {old_value:.1f} -> {result["value"]:.1f} '
+            f'({improvement:.2f}x {"better" if improvement >= 1 else "worse"})'
+        )
+
+
+def format_result(result: Result) -> str:
+    parameters = ', '.join(f'{key}={value}' for key, value in result['parameters'].items())
+    return f'{result["benchmark"]}[{parameters}] {result["metric"]} ({result["unit"]})'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--compare', help='A results file from a previous run to compare against.')
+    parser.add_argument('--filter', help='Only run benchmarks whose names contain this string.')
+    parser.add_argument('--output', default='benchmark-results.json', help='Where to save results.')
+    parser.add_argument('--quick', action='store_true', help='Run fewer and shorter benchmarks.')
+    arguments = parser.parse_args()
+
+    options = Options(quick=arguments.quick)
+    results: List[Result] = []
+    for benchmark in benchmarks:
+        if arguments.filter and arguments.filter not in benchmark.__name__:
+            continue
+        for result in benchmark(options):
+            print(f'{format_result(result)}: {result["value"]:.1f}', flush=True)
+            results.append(result)
+
+    with open(arguments.output, 'w') as f:
+        json.dump(
+            {
+                'version': dysco.__version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'speedups': scope.find_scope is not scope.find_scope_python,
+                'timestamp': time.time(),
+                'quick': arguments.quick,
+                'results': results,
+            },
+            f,
+            indent=2,
+        )
+    print(f'\nSaved {len(results)} results to {arguments.output}.', file=sys.stderr)
+
+    if arguments.compare:
+        compare(results, arguments.compare)
+
+
+if __name__ == '__main__':
+    main()
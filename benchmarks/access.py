@@ -0,0 +1,305 @@
+"""Benchmarks for the latency of individual operations on a ``Dysco`` instance.
+
+Unless otherwise noted, the variable being accessed is defined in the outermost frame and the
+operation is performed ``depth`` frames further down the stack.
+"""
+
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+from benchmarks.utilities import (
+    Assignments,
+    Options,
+    Result,
+    benchmark,
+    call_at_depth,
+    latency_results,
+    time_operation,
+    values,
+)
+from dysco import Dysco
+
+Operation = Callable[[int], Optional[float]]
+
+
+def create_operations(dysco: Dysco) -> Dict[str, Operation]:
+    """Create each of the measured operations for a given instance."""
+
+    def get(number: int) -> None:
+        # Repeated reads from the same frame, which can be served from the lookup cache.
+        for _ in range(number):
+            dysco.value
+
+    def read() -> object:
+        return dysco.value
+
+    def get_from_new_frames(number: int) -> None:
+        # Every read comes from a fresh frame, so this includes the cost of a function call.
+        for _ in range(number):
+            read()
+
+    def get_from_variant(number: int) -> None:
+        # Creates the variant inline, like libraries that only need read-only access tend to.
+        for _ in range(number):
+            dysco(readonly=True).value
+
+    def contains(number: int) -> None:
+        for _ in range(number):
+            'value' in dysco
+
+    def contains_missing(number: int) -> None:
+        for _ in range(number):
+            'missing' in dysco
+
+    def check_missing() -> bool:
+        return 'missing' in dysco
+
+    def contains_missing_from_new_frames(number: int) -> None:
+        # Repeated misses from the same frame are cached, but misses from fresh frames walk.
+        for _ in range(number):
+            check_missing()
+
+    def get_missing(number: int) -> None:
+        for _ in range(number):
+            dysco.get('missing')
+
+    def getattr_missing(number: int) -> None:
+        # Misses raise and catch an `AttributeError` here, unlike with `get()`.
+        for _ in range(number):
+            getattr(dysco, 'missing', None)
+
+    def set(number: int) -> None:
+        # Assigns to the existing variable in the outermost scope.
+        for index in range(number):
+            dysco.value = index
+
+    def delete(number: int) -> float:
+        for index in range(number):
+            dysco[index] = index
+        start = time.perf_counter()
+        for index in range(number):
+            del dysco[index]
+        return time.perf_counter() - start
+
+    def iterate(number: int) -> None:
+        for _ in range(number):
+            for _ in dysco:
+                pass
+
+    return {
+        'get': get,
+        'get_from_new_frames': get_from_new_frames,
+        'get_from_variant': get_from_variant,
+        'contains': contains,
+        'contains_missing': contains_missing,
+        'contains_missing_from_new_frames': contains_missing_from_new_frames,
+        'get_missing': get_missing,
+        'getattr_missing': getattr_missing,
+        'set': set,
+        'del': delete,
+        'iter': iterate,
+    }
+
+
+@benchmark
+def stack_depth(options: Options) -> Iterator[Result]:
+    """Measure how each operation scales with the distance to the defining scope."""
+    for engine in ('frame', 'context'):
+        for depth in values(options, [1, 10, 50, 100], [1, 50]):
+            dysco = Dysco(engine=engine)
+            for operation_name, operation in create_operations(dysco).items():
+                seconds = call_at_depth(
+                    depth,
+                    lambda: time_operation(operation, options),
+                    {0: [(dysco, 'value', 0)]},
+                )
+                parameters = {'engine': engine, 'depth': depth, 'operation': operation_name}
+                yield from latency_results('stack_depth', parameters, seconds)
+
+
+@benchmark
+def explicit_scopes(options: Options) -> Iterator[Result]:
+    """Measure lookups from inside of a ``with dysco.scope()`` block that defines the variable."""
+    for engine in ('frame', 'context'):
+        for depth in values(options, [1, 10, 50, 100], [1, 50]):
+            dysco = Dysco(engine=engine)
+            operations = create_operations(dysco)
+            for operation_name in ('get_from_new_frames', 'contains_missing'):
+                with dysco.scope(value=0):
+                    seconds = call_at_depth(
+                        depth, lambda: time_operation(operations[operation_name], options)
+                    )
+                parameters = {'engine': engine, 'depth': depth, 'operation': operation_name}
+                yield from latency_results('explicit_scopes', parameters, seconds)
+
+
+@benchmark
+def boundaries(options: Options) -> Iterator[Result]:
+    """Measure misses from a handler beneath a deep stack with and without limits on the walk."""
+    handler_depth = 10
+    for depth in values(options, [50, 200], [200]):
+        for limit in ('none', 'boundary', 'max_depth'):
+            dysco = Dysco(max_depth=handler_depth if limit == 'max_depth' else None)
+            operation = create_operations(dysco)['contains_missing_from_new_frames']
+
+            def handle() -> float:
+                # This frame stands in for a request entry point beneath the framework's frames.
+                if limit == 'boundary':
+                    dysco.boundary()
+                return call_at_depth(handler_depth, lambda: time_operation(operation, options))
+
+            seconds = call_at_depth(depth, handle, {0: [(dysco, 'value', 0)]})
+            parameters = {
+                'depth': depth,
+                'limit': limit,
+                'operation': 'contains_missing_from_new_frames',
+            }
+            yield from latency_results('boundaries', parameters, seconds)
+
+
+@benchmark
+def intermediate_scopes(options: Options) -> Iterator[Result]:
+    """Measure lookups with a varying number of unrelated scopes between the reader and definer."""
+    depth = 100
+    for scope_count in values(options, [0, 10, 50, 100], [0, 50]):
+        dysco = Dysco()
+        assignments: Assignments = {0: [(dysco, 'value', 0)]}
+        for index in range(scope_count):
+            level = depth - index * depth // max(scope_count, 1)
+            assignments.setdefault(level, []).append((dysco, 'unrelated', index))
+
+        operations = create_operations(dysco)
+        for operation_name in ('get_from_new_frames', 'contains_missing'):
+            seconds = call_at_depth(
+                depth,
+                lambda: time_operation(operations[operation_name], options),
+                assignments,
+            )
+            parameters = {'scopes': scope_count, 'depth': depth, 'operation': operation_name}
+            yield from latency_results('intermediate_scopes', parameters, seconds)
+
+
+@benchmark
+def namespaces(options: Options) -> Iterator[Result]:
+    """Measure lookups when every frame also holds scopes for other ``Dysco`` instances."""
+    depth = 20
+    for namespace_count in values(options, [1, 4, 16], [1, 16]):
+        instances = [Dysco() for _ in range(namespace_count)]
+        dysco = instances[0]
+        assignments: Assignments = {
+            level: [(instance, 'other', level) for instance in instances[1:]]
+            for level in range(depth + 1)
+        }
+        assignments[0].append((dysco, 'value', 0))
+
+        operations = create_operations(dysco)
+        for operation_name in ('get_from_new_frames', 'set'):
+            seconds = call_at_depth(
+                depth,
+                lambda: time_operation(operations[operation_name], options),
+                assignments,
+            )
+            parameters = {
+                'namespaces': namespace_count,
+                'depth': depth,
+                'operation': operation_name,
+            }
+            yield from latency_results('namespaces', parameters, seconds)
+
+
+@benchmark
+def bulk_access(options: Options) -> Iterator[Result]:
+    """Compare reading and writing several variables one at a time to doing it in bulk."""
+    depth = 50
+    keys = [f'value_{index}' for index in range(10)]
+    for engine in ('frame', 'context'):
+        dysco = Dysco(engine=engine)
+
+        def read_individually() -> None:
+            for key in keys:
+                dysco[key]
+
+        def read_in_bulk() -> None:
+            dysco.get_many(keys)
+
+        def write_individually() -> None:
+            for key in keys:
+                dysco[key] = 1
+
+        def write_in_bulk() -> None:
+            dysco.set_many(dict.fromkeys(keys, 1))
+
+        operations = {
+            'get': read_individually,
+            'get_many': read_in_bulk,
+            'set': write_individually,
+            'set_many': write_in_bulk,
+        }
+        for operation_name, function in operations.items():
+
+            def operation(number: int) -> None:
+                # Every batch comes from a fresh frame, as it would in a request handler.
+                for _ in range(number):
+                    function()
+
+            seconds = call_at_depth(
+                depth,
+                lambda: time_operation(operation, options),
+                {0: [(dysco, key, 0) for key in keys]},
+            )
+            parameters = {
+                'engine': engine,
+                'depth': depth,
+                'keys': len(keys),
+                'operation': operation_name,
+            }
+            yield from latency_results('bulk_access', parameters, seconds)
+
+
+@benchmark
+def declared_keys(options: Options) -> Iterator[Result]:
+    """Compare attribute reads of a declared key with reads of an undeclared one."""
+    for depth in values(options, [1, 10, 50], [1, 50]):
+        dysco = Dysco()
+        dysco.declare('declared')
+
+        def get_declared(number: int) -> None:
+            for _ in range(number):
+                dysco.declared
+
+        operations = {'get': create_operations(dysco)['get'], 'get_declared': get_declared}
+        for operation_name, operation in operations.items():
+            seconds = call_at_depth(
+                depth,
+                lambda: time_operation(operation, options),
+                {0: [(dysco, 'value', 0), (dysco, 'declared', 0)]},
+            )
+            parameters = {'depth': depth, 'operation': operation_name}
+            yield from latency_results('declared_keys', parameters, seconds)
+
+
+@benchmark
+def generators(options: Options) -> Iterator[Result]:
+    """Measure per-item lookups in a generator that's created at the top and consumed deeper."""
+    for depth in values(options, [1, 10, 50, 100], [1, 50]):
+        for mode in ('plain', 'captured'):
+            dysco = Dysco()
+
+            def stage() -> Iterator[object]:
+                while True:
+                    yield dysco.value
+
+            create = dysco.generator(stage) if mode == 'captured' else stage
+
+            def measure() -> float:
+                dysco.value = 0
+                items = create()
+
+                def consume(number: int) -> None:
+                    for _ in range(number):
+                        next(items)
+
+                return call_at_depth(depth, lambda: time_operation(consume, options))
+
+            parameters = {'depth': depth, 'mode': mode, 'operation': 'next'}
+            yield from latency_results('generators', parameters, measure())
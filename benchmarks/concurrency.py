@@ -0,0 +1,139 @@
+"""Benchmarks for the throughput of reads spread across threads and asyncio tasks."""
+
+import asyncio
+import threading
+import time
+from typing import Iterator, List
+
+from benchmarks.utilities import Options, Result, benchmark, call_at_depth, result, values
+from dysco import Dysco
+from dysco.executors import ScopedThreadPoolExecutor
+
+
+@benchmark
+def threads(options: Options) -> Iterator[Result]:
+    """Measure the combined read throughput of several threads sharing one instance."""
+    reads_per_thread = 2_000 if options.quick else 20_000
+    depth = 20
+    for engine in ('frame', 'context'):
+        for thread_count in values(options, [1, 2, 4, 8, 16], [1, 4]):
+            dysco = Dysco(engine=engine)
+            barrier = threading.Barrier(thread_count + 1)
+
+            def read() -> None:
+                barrier.wait()
+                for _ in range(reads_per_thread):
+                    dysco.value
+                barrier.wait()
+
+            def run() -> None:
+                call_at_depth(depth, read, {0: [(dysco, 'value', 0)]})
+
+            workers: List[threading.Thread] = [
+                threading.Thread(target=run) for _ in range(thread_count)
+            ]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            start = time.perf_counter()
+            barrier.wait()
+            elapsed = time.perf_counter() - start
+            for worker in workers:
+                worker.join()
+
+            parameters = {'engine': engine, 'threads': thread_count, 'depth': depth}
+            throughput = thread_count * reads_per_thread / elapsed
+            yield result('threads', parameters, 'throughput', throughput, 'ops/s')
+
+
+@benchmark
+def scope_churn(options: Options) -> Iterator[Result]:
+    """Measure the combined throughput of threads that keep creating and dropping scopes.
+
+    Every iteration shadows a variable at each of a few levels of recursion and reads it back, and
+    every tenth one does so with a new instance, so the threads contend on the shared registry of
+    frame scopes and on creating namespaces. Without a GIL, the throughput should grow with them.
+    """
+    iterations = 1_000 if options.quick else 10_000
+    for thread_count in values(options, [1, 2, 4, 8, 16], [1, 4]):
+        shared_dysco = Dysco()
+        barrier = threading.Barrier(thread_count + 1)
+
+        def define(dysco: Dysco, depth: int, index: int) -> None:
+            dysco(shadow=True).value = index
+            if depth:
+                define(dysco, depth - 1, index)
+            else:
+                dysco.value
+
+        def churn() -> None:
+            barrier.wait()
+            for index in range(iterations):
+                define(Dysco() if index % 10 == 0 else shared_dysco, 5, index)
+            barrier.wait()
+
+        workers = [threading.Thread(target=churn) for _ in range(thread_count)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        barrier.wait()
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            worker.join()
+
+        throughput = thread_count * iterations / elapsed
+        yield result('scope_churn', {'threads': thread_count}, 'throughput', throughput, 'ops/s')
+
+
+@benchmark
+def tasks(options: Options) -> Iterator[Result]:
+    """Measure the combined read throughput of concurrent asyncio tasks."""
+    reads_per_task = 200 if options.quick else 1_000
+    for engine in ('frame', 'context'):
+        for task_count in values(options, [1, 10, 100, 1000], [1, 100]):
+            dysco = Dysco(engine=engine)
+
+            async def read() -> None:
+                for index in range(reads_per_task):
+                    dysco.value
+                    if index % 100 == 0:
+                        # Yield to the event loop so that the tasks interleave.
+                        await asyncio.sleep(0)
+
+            async def run() -> float:
+                start = time.perf_counter()
+                await asyncio.gather(*(read() for _ in range(task_count)))
+                return time.perf_counter() - start
+
+            # Tasks run in frames called from the event loop, so the value is defined in a frame
+            # outside of it to make it visible to both engines.
+            elapsed = call_at_depth(0, lambda: asyncio.run(run()), {0: [(dysco, 'value', 0)]})
+            parameters = {'engine': engine, 'tasks': task_count}
+            throughput = task_count * reads_per_task / elapsed
+            yield result('tasks', parameters, 'throughput', throughput, 'ops/s')
+
+
+@benchmark
+def fan_out(options: Options) -> Iterator[Result]:
+    """Measure the throughput of submitting work that reads the submitter's variables to a pool."""
+    task_count = 500 if options.quick else 5_000
+    for engine in ('frame', 'context'):
+        for depth in values(options, [1, 10, 100], [1, 100]):
+            dysco = Dysco(engine=engine)
+
+            def read() -> None:
+                dysco.value
+
+            def submit() -> float:
+                with ScopedThreadPoolExecutor(max_workers=4, dysco=dysco) as executor:
+                    start = time.perf_counter()
+                    futures = [executor.submit(read) for _ in range(task_count)]
+                    for future in futures:
+                        future.result()
+                    return time.perf_counter() - start
+
+            # The value is defined at the bottom so that capturing it walks every frame.
+            elapsed = call_at_depth(depth, submit, {0: [(dysco, 'value', 0)]})
+            parameters = {'engine': engine, 'depth': depth}
+            yield result('fan_out', parameters, 'throughput', task_count / elapsed, 'tasks/s')
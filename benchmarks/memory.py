@@ -0,0 +1,56 @@
+"""Benchmarks for the memory and time that it takes to create scopes."""
+
+import gc
+import time
+import tracemalloc
+from typing import Iterator
+
+from benchmarks.utilities import Options, Result, benchmark, result, values
+from dysco import Dysco
+
+
+@benchmark
+def scope_creation(options: Options) -> Iterator[Result]:
+    """Measure the cost of a recursive workload that sets variables at every level.
+
+    Each level assigns a variable for every one of ``instances`` separate ``Dysco`` instances, so
+    the cost per scope shows whether frames that hold scopes for several instances cost more.
+    """
+    for depth in values(options, [100, 500], [100]):
+        for instance_count in values(options, [1, 10], [1, 10]):
+            # Shadowing gives every level its own scopes instead of updating the outer ones.
+            dyscos = [Dysco()(shadow=True) for _ in range(instance_count)]
+
+            def recurse(level: int, assign: bool) -> int:
+                if assign:
+                    for dysco in dyscos:
+                        dysco.value = level
+                if level >= depth:
+                    # Measure here, while every scope is still alive.
+                    return tracemalloc.get_traced_memory()[0]
+                return recurse(level + 1, assign)
+
+            # Compare against the same recursion without assignments to isolate the scopes.
+            gc.collect()
+            tracemalloc.start()
+            try:
+                baseline = recurse(0, False) - tracemalloc.get_traced_memory()[0]
+                with_scopes = recurse(0, True) - tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            parameters = {'depth': depth, 'instances': instance_count}
+            scope_count = depth * instance_count
+            bytes_per_scope = (with_scopes - baseline) / scope_count
+            yield result('scope_creation', parameters, 'memory', bytes_per_scope, 'bytes/scope')
+
+            repeat = 3 if options.quick else 10
+            timings = []
+            for assign in (False, True):
+                best = float('inf')
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    recurse(0, assign)
+                    best = min(best, time.perf_counter() - start)
+                timings.append(best)
+            nanoseconds_per_scope = (timings[1] - timings[0]) / scope_count * 1e9
+            yield result('scope_creation', parameters, 'latency', nanoseconds_per_scope, 'ns/scope')
@@ -0,0 +1,112 @@
+"""Benchmarks for the per-request cost of the WSGI and ASGI middleware."""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from benchmarks.utilities import (
+    Options,
+    Result,
+    benchmark,
+    call_at_depth,
+    latency_results,
+    time_operation,
+    values,
+)
+from dysco import Dysco
+from dysco.middleware import ASGIMiddleware, WSGIMiddleware
+
+#: The number of variables that each handler reads per request.
+reads_per_request = 10
+
+#: The setups that run the application inside of the middleware.
+middleware_setups = ('middleware', 'assigning')
+
+
+def variables(request: Dict[str, Any]) -> Dict[str, Any]:
+    return {'request': request, 'user': 'user', 'trace_id': 'trace'}
+
+
+@benchmark
+def wsgi(options: Options) -> Iterator[Result]:
+    """Measure the latency of requests whose handler reads request variables from deep frames.
+
+    The requests are made by calling the application directly like a server would, and the
+    ``none`` setup reads nothing, which shows the overhead of the request loop itself. The
+    ``assigned`` setup has the outermost handler assign the variables instead of the middleware,
+    and the ``assigning`` setup uses the middleware, but also has the outermost handler assign a
+    variable of its own, which makes the reads walk the frames inside of the middleware's scope.
+    """
+    for depth in values(options, [1, 10, 50], [1, 50]):
+        for setup in ('none', 'assigned', 'middleware', 'assigning'):
+            dysco = Dysco()
+
+            def handler() -> bytes:
+                if setup != 'none':
+                    for _ in range(reads_per_request):
+                        dysco.user
+                return b''
+
+            def app(environ: Dict[str, Any], start_response: Callable) -> Any:
+                if setup == 'assigned':
+                    dysco.update(variables(environ))
+                elif setup == 'assigning':
+                    dysco.status = 200
+                start_response('200 OK', [])
+                return [call_at_depth(depth, handler)]
+
+            application = (
+                WSGIMiddleware(app, variables, dysco=dysco) if setup in middleware_setups else app
+            )
+
+            def serve(number: int) -> None:
+                for _ in range(number):
+                    response = application({'PATH_INFO': '/'}, lambda status, headers: None)
+                    for _ in response:
+                        pass
+
+            seconds = time_operation(serve, options)
+            yield from latency_results('wsgi', {'setup': setup, 'depth': depth}, seconds)
+
+
+@benchmark
+def asgi(options: Options) -> Iterator[Result]:
+    """Measure the latency of ASGI requests in the same way as the ``wsgi`` benchmark."""
+    for depth in values(options, [1, 10, 50], [1, 50]):
+        for setup in ('none', 'assigned', 'middleware', 'assigning'):
+            dysco = Dysco()
+
+            def handler() -> None:
+                if setup != 'none':
+                    for _ in range(reads_per_request):
+                        dysco.user
+
+            async def app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+                if setup == 'assigned':
+                    dysco.update(variables(scope))
+                elif setup == 'assigning':
+                    dysco.status = 200
+                call_at_depth(depth, handler)
+                await send({'type': 'http.response.body', 'body': b''})
+
+            async def receive() -> Dict[str, Any]:
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message: Dict[str, Any]) -> None:
+                pass
+
+            application = (
+                ASGIMiddleware(app, variables, dysco=dysco) if setup in middleware_setups else app
+            )
+
+            async def serve(number: int) -> float:
+                start = time.perf_counter()
+                for _ in range(number):
+                    await application({'type': 'http', 'path': '/'}, receive, send)
+                return time.perf_counter() - start
+
+            def run(number: int) -> Optional[float]:
+                return asyncio.run(serve(number))
+
+            seconds = time_operation(run, options)
+            yield from latency_results('asgi', {'setup': setup, 'depth': depth}, seconds)
@@ -0,0 +1,124 @@
+"""Shared helpers for timing dysco operations and recording the results."""
+
+import gc
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from dysco import Dysco
+
+T = TypeVar('T')
+
+Result = Dict[str, Any]
+Assignments = Dict[int, List[Tuple[Dysco, Hashable, Any]]]
+
+
+class Options(NamedTuple):
+    """The options that every benchmark is run with."""
+
+    quick: bool = False
+    repeat: int = 5
+    target_time: float = 0.05
+
+
+Benchmark = Callable[[Options], Iterator[Result]]
+
+#: Every registered benchmark, in the order that they were defined.
+benchmarks: List[Benchmark] = []
+
+
+def benchmark(function: Benchmark) -> Benchmark:
+    """Register a benchmark function so that it's included when running the suite."""
+    benchmarks.append(function)
+    return function
+
+
+def call_at_depth(
+    depth: int, function: Callable[[], T], assignments: Optional[Assignments] = None
+) -> T:
+    """Call ``function`` from ``depth`` nested frames.
+
+    Each of the ``assignments`` is made in the frame at the level that it's keyed by, with level
+    zero being the outermost frame. This makes it possible to place scopes at specific distances
+    from the code being measured.
+    """
+
+    assignments = assignments or {}
+
+    def recurse(level: int) -> T:
+        for dysco, key, value in assignments.get(level, ()):
+            dysco[key] = value
+        if level >= depth:
+            return function()
+        return recurse(level + 1)
+
+    return recurse(0)
+
+
+def latency_results(name: str, parameters: Dict[str, Any], seconds: float) -> Iterator[Result]:
+    yield result(name, parameters, 'latency', seconds * 1e9, 'ns')
+    yield result(name, parameters, 'throughput', 1 / seconds, 'ops/s')
+
+
+def result(name: str, parameters: Dict[str, Any], metric: str, value: float, unit: str) -> Result:
+    return {
+        'benchmark': name,
+        'parameters': parameters,
+        'metric': metric,
+        'value': value,
+        'unit': unit,
+    }
+
+
+def result_key(result: Result) -> Tuple[str, Tuple[Tuple[str, Any], ...], str]:
+    """Identify a result so that it can be matched up with the same result from another run."""
+    return result['benchmark'], tuple(sorted(result['parameters'].items())), result['metric']
+
+
+def time_operation(operation: Callable[[int], Optional[float]], options: Options) -> float:
+    """Return the best time in seconds that a single iteration of ``operation`` took.
+
+    The operation is called with the number of iterations that it should perform, which is
+    calibrated so that each timing run takes about ``options.target_time`` seconds. Operations that
+    need untimed setup can measure themselves and return the elapsed time in seconds instead of
+    ``None``. Garbage collection is disabled while timing to reduce noise.
+    """
+    number = 1
+    while True:
+        elapsed = time_iterations(operation, number)
+        if elapsed >= options.target_time / 10 or number >= 1 << 20:
+            break
+        number *= 10
+    number = max(1, int(number * options.target_time / max(elapsed, 1e-9)))
+
+    repeat = 2 if options.quick else options.repeat
+    return min(time_iterations(operation, number) for _ in range(repeat)) / number
+
+
+def time_iterations(operation: Callable[[int], Optional[float]], number: int) -> float:
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        elapsed = operation(number)
+        end = time.perf_counter()
+        return end - start if elapsed is None else elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def values(options: Options, full: Iterable[T], quick: Iterable[T]) -> List[T]:
+    """Choose between the full and the reduced set of parameter values."""
+    return list(quick if options.quick else full)
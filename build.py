@@ -0,0 +1,44 @@
+"""Build script that compiles the optional ``dysco._speedups`` extension module.
+
+Poetry calls ``build()`` when building wheels, and running this file directly compiles the
+extension in place for local development. A failed compilation is never fatal because ``dysco``
+falls back to its pure-Python implementation whenever the extension is missing.
+"""
+
+import sys
+
+from setuptools import Distribution, Extension
+from setuptools.command.build_ext import build_ext
+
+extensions = [Extension('dysco._speedups', sources=['dysco/_speedups.c'])]
+
+
+class OptionalBuildExt(build_ext):
+    """Build extensions if possible, but carry on without them if they can't be compiled."""
+
+    def run(self):
+        try:
+            super().run()
+        except Exception as exception:
+            self.warn(f'Skipping the dysco._speedups extension: {exception}')
+
+    def build_extension(self, extension):
+        try:
+            super().build_extension(extension)
+        except Exception as exception:
+            self.warn(f'Skipping the {extension.name} extension: {exception}')
+
+
+def build(setup_kwargs):
+    """Add the extension modules to the keyword arguments that poetry passes to ``setup()``."""
+    # The C API that the extension relies on was introduced in Python 3.9.
+    if sys.version_info >= (3, 9) and sys.implementation.name == 'cpython':
+        setup_kwargs.update(ext_modules=extensions, cmdclass={'build_ext': OptionalBuildExt})
+
+
+if __name__ == '__main__':
+    setup_kwargs = {'name': 'dysco', 'script_args': ['build_ext', '--inplace']}
+    build(setup_kwargs)
+    distribution = Distribution(setup_kwargs)
+    distribution.parse_command_line()
+    distribution.run_commands()
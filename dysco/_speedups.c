@@ -0,0 +1,514 @@
+/*
+ * Compiled versions of the hot scope lookup routines from ``dysco/scope.py``.
+ *
+ * Each function here mirrors a pure-Python function of the same name in ``dysco.scope`` and must
+ * keep exactly the same behavior. The module is optional: ``dysco.scope`` falls back to the
+ * pure-Python implementations whenever it can't be imported.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <frameobject.h>
+
+static PyObject *boundary_string = NULL;
+static PyObject *code_string = NULL;
+static PyObject *empty_string = NULL;
+static PyObject *f_locals_string = NULL;
+static PyObject *frame_scopes_key_string = NULL;
+static PyObject *scopes_string = NULL;
+static PyObject *thread_id_string = NULL;
+static PyObject *variables_string = NULL;
+
+/* Return a new reference to the object behind a weak reference, or NULL if it's dead. */
+static PyObject *
+dereference(PyObject *reference)
+{
+#if PY_VERSION_HEX >= 0x030D0000
+    PyObject *object = NULL;
+    if (PyWeakref_GetRef(reference, &object) < 0) {
+        PyErr_Clear();
+        return NULL;
+    }
+    return object;
+#else
+    PyObject *object = PyWeakref_GetObject(reference);
+    if (object == Py_None) {
+        return NULL;
+    }
+    Py_INCREF(object);
+    return object;
+#endif
+}
+
+/*
+ * Return 1 if a scope table is stored in ``frame``, 0 if not, or -1 on an error. A dead frame's table
+ * can still be registered while the frame's other locals are being finalized, so tables registered
+ * by other threads are checked against the frame's locals.
+ */
+static int
+is_owned_by(PyObject *frame_scopes, PyFrameObject *frame)
+{
+    PyObject *thread_id = PyObject_GetAttr(frame_scopes, thread_id_string);
+    if (thread_id == NULL) {
+        return -1;
+    }
+    unsigned long table_thread = PyLong_AsUnsignedLong(thread_id);
+    Py_DECREF(thread_id);
+    if (table_thread == (unsigned long)-1 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (table_thread == PyThread_get_thread_ident()) {
+        return 1;
+    }
+    PyObject *locals = PyObject_GetAttr((PyObject *)frame, f_locals_string);
+    if (locals == NULL) {
+        return -1;
+    }
+    PyObject *stored = PyObject_GetItem(locals, frame_scopes_key_string);
+    Py_DECREF(locals);
+    if (stored == NULL) {
+        if (PyErr_ExceptionMatches(PyExc_KeyError)) {
+            PyErr_Clear();
+            return 0;
+        }
+        return -1;
+    }
+    Py_DECREF(stored);
+    return stored == frame_scopes;
+}
+
+/*
+ * Return a new reference to the scope table registered for ``frame``, NULL if there isn't one, or
+ * NULL with an exception set if something went wrong. The ``registry`` is the tuple of shards from
+ * ``dysco.scope.Registry``, and the shard is picked in exactly the same way as there.
+ */
+static PyObject *
+lookup_frame_scopes(PyFrameObject *frame, PyObject *registry)
+{
+    Py_ssize_t shard_count = PyTuple_GET_SIZE(registry);
+    if (shard_count == 0) {
+        return NULL;
+    }
+    PyObject *shard = PyTuple_GET_ITEM(registry, ((uintptr_t)frame >> 4) % shard_count);
+    if (!PyDict_Check(shard)) {
+        PyErr_SetString(PyExc_TypeError, "registry shards must be dictionaries");
+        return NULL;
+    }
+    PyObject *frame_id = PyLong_FromVoidPtr(frame);
+    if (frame_id == NULL) {
+        return NULL;
+    }
+    /* Other threads can remove the entry at any time, so hold a strong reference to it. */
+#if PY_VERSION_HEX >= 0x030D0000
+    PyObject *reference = NULL;
+    int found = PyDict_GetItemRef(shard, frame_id, &reference);
+    Py_DECREF(frame_id);
+    if (found <= 0) {
+        return NULL;
+    }
+#else
+    PyObject *reference = PyDict_GetItemWithError(shard, frame_id);
+    Py_DECREF(frame_id);
+    if (reference == NULL) {
+        return NULL;
+    }
+    Py_INCREF(reference);
+#endif
+    PyObject *frame_scopes = PyWeakref_Check(reference) ? dereference(reference) : NULL;
+    Py_DECREF(reference);
+    if (frame_scopes == NULL) {
+        return NULL;
+    }
+
+    /* Frame IDs can be reused, so the table must belong to a frame running the same code. */
+    PyObject *table_code = PyObject_GetAttr(frame_scopes, code_string);
+    if (table_code == NULL) {
+        Py_DECREF(frame_scopes);
+        return NULL;
+    }
+    PyCodeObject *frame_code = PyFrame_GetCode(frame);
+    int matches = table_code == (PyObject *)frame_code;
+    Py_DECREF(table_code);
+    Py_DECREF(frame_code);
+    if (matches) {
+        matches = is_owned_by(frame_scopes, frame);
+    }
+    if (matches <= 0) {
+        Py_DECREF(frame_scopes);
+        return NULL;
+    }
+    return frame_scopes;
+}
+
+/* Return a new reference to the scope for ``namespace`` in ``frame``, or NULL. */
+static PyObject *
+lookup_scope(PyFrameObject *frame, PyObject *namespace, PyObject *registry)
+{
+    PyObject *frame_scopes = lookup_frame_scopes(frame, registry);
+    if (frame_scopes == NULL) {
+        return NULL;
+    }
+    PyObject *scopes = PyObject_GetAttr(frame_scopes, scopes_string);
+    Py_DECREF(frame_scopes);
+    if (scopes == NULL) {
+        return NULL;
+    }
+    PyObject *scope = PyObject_GetItem(scopes, namespace);
+    Py_DECREF(scopes);
+    if (scope == NULL && PyErr_ExceptionMatches(PyExc_KeyError)) {
+        PyErr_Clear();
+    }
+    return scope;
+}
+
+/* Return 1 if a scope is a boundary that walks must stop at, 0 if not, or -1 on an error. */
+static int
+is_boundary(PyObject *scope)
+{
+    PyObject *boundary = PyObject_GetAttr(scope, boundary_string);
+    if (boundary == NULL) {
+        return -1;
+    }
+    int result = PyObject_IsTrue(boundary);
+    Py_DECREF(boundary);
+    return result;
+}
+
+/* Convert an optional limit on the number of frames to walk past into -1 for no limit. */
+static int
+parse_limit(PyObject *limit_object, Py_ssize_t *limit)
+{
+    *limit = -1;
+    if (limit_object == NULL || limit_object == Py_None) {
+        return 0;
+    }
+    *limit = PyLong_AsSsize_t(limit_object);
+    if (*limit == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (*limit < 0) {
+        /* A negative limit excludes every frame, which an empty walk already handles. */
+        *limit = -2;
+    }
+    return 0;
+}
+
+/* Return whether a walk that has moved ``distance`` frames is still within ``limit``. */
+static inline int
+within_limit(Py_ssize_t distance, Py_ssize_t limit)
+{
+    return limit == -1 || (limit >= 0 && distance <= limit);
+}
+
+static int
+check_frame(PyObject *frame)
+{
+    if (frame != Py_None && !PyFrame_Check(frame)) {
+        PyErr_SetString(PyExc_TypeError, "frame must be a frame object or None");
+        return -1;
+    }
+    return 0;
+}
+
+PyDoc_STRVAR(find_existing_scope_doc,
+             "find_existing_scope(registry, frame, namespace='')\n"
+             "--\n\n"
+             "Find the scope for a namespace in a frame's scope table, or return None.");
+
+static PyObject *
+find_existing_scope(PyObject *module, PyObject *args)
+{
+    PyObject *frame, *registry;
+    PyObject *namespace = empty_string;
+    if (!PyArg_ParseTuple(args, "O!O!|O", &PyTuple_Type, &registry, &PyFrame_Type, &frame,
+                          &namespace)) {
+        return NULL;
+    }
+    PyObject *scope = lookup_scope((PyFrameObject *)frame, namespace, registry);
+    if (scope == NULL) {
+        if (PyErr_Occurred()) {
+            return NULL;
+        }
+        Py_RETURN_NONE;
+    }
+    return scope;
+}
+
+PyDoc_STRVAR(find_frame_scopes_doc,
+             "find_frame_scopes(registry, frame)\n"
+             "--\n\n"
+             "Find the scope table for a frame in the registry, or return None.");
+
+static PyObject *
+find_frame_scopes(PyObject *module, PyObject *args)
+{
+    PyObject *frame, *registry;
+    if (!PyArg_ParseTuple(args, "O!O!", &PyTuple_Type, &registry, &PyFrame_Type, &frame)) {
+        return NULL;
+    }
+    PyObject *frame_scopes = lookup_frame_scopes((PyFrameObject *)frame, registry);
+    if (frame_scopes == NULL) {
+        if (PyErr_Occurred()) {
+            return NULL;
+        }
+        Py_RETURN_NONE;
+    }
+    return frame_scopes;
+}
+
+/*
+ * Walk up from ``frame`` and return a new reference to the first scope in ``namespace`` that
+ * defines ``key``, stopping after a boundary scope or after moving past ``limit`` frames. The
+ * number of frames walked is stored in ``distance`` and the number of scopes checked in
+ * ``scope_count``. NULL is returned if no scope defines the key, and NULL with an exception set if
+ * something went wrong.
+ */
+static PyObject *
+walk(PyFrameObject *frame, PyObject *key, PyObject *namespace, PyObject *registry,
+     Py_ssize_t limit, Py_ssize_t *distance, Py_ssize_t *scope_count)
+{
+    *distance = 0;
+    *scope_count = 0;
+    Py_XINCREF(frame);
+    while (frame != NULL && within_limit(*distance, limit)) {
+        PyObject *scope = lookup_scope(frame, namespace, registry);
+        if (scope != NULL) {
+            *scope_count += 1;
+            PyObject *variables = PyObject_GetAttr(scope, variables_string);
+            if (variables == NULL) {
+                Py_DECREF(scope);
+                Py_DECREF(frame);
+                return NULL;
+            }
+            int contains = PySequence_Contains(variables, key);
+            Py_DECREF(variables);
+            if (contains != 0) {
+                Py_DECREF(frame);
+                if (contains < 0) {
+                    Py_DECREF(scope);
+                    return NULL;
+                }
+                return scope;
+            }
+            int boundary = is_boundary(scope);
+            Py_DECREF(scope);
+            if (boundary != 0) {
+                Py_DECREF(frame);
+                *distance += 1;
+                return NULL;
+            }
+        }
+        else if (PyErr_Occurred()) {
+            Py_DECREF(frame);
+            return NULL;
+        }
+
+        PyFrameObject *back = PyFrame_GetBack(frame);
+        Py_DECREF(frame);
+        frame = back;
+        *distance += 1;
+    }
+    Py_XDECREF(frame);
+    return NULL;
+}
+
+/* Parse the arguments shared by ``find_scope()`` and ``locate_scope()``. */
+static int
+parse_walk_arguments(PyObject *args, PyObject **registry, PyFrameObject **frame, PyObject **key,
+                     PyObject **namespace, Py_ssize_t *limit)
+{
+    PyObject *frame_object, *limit_object = NULL;
+    *namespace = empty_string;
+    if (!PyArg_ParseTuple(args, "O!OO|OO", &PyTuple_Type, registry, &frame_object, key,
+                          namespace, &limit_object)) {
+        return -1;
+    }
+    if (check_frame(frame_object) < 0 || parse_limit(limit_object, limit) < 0) {
+        return -1;
+    }
+    *frame = frame_object == Py_None ? NULL : (PyFrameObject *)frame_object;
+    return 0;
+}
+
+PyDoc_STRVAR(find_scope_doc,
+             "find_scope(registry, frame, key, namespace='')\n"
+             "--\n\n"
+             "Walk up from a frame and return the first scope in the namespace that defines the\n"
+             "key, or return None if no such scope exists.");
+
+static PyObject *
+find_scope(PyObject *module, PyObject *args)
+{
+    PyObject *registry, *key, *namespace;
+    PyFrameObject *frame;
+    Py_ssize_t limit, distance, scope_count;
+    if (parse_walk_arguments(args, &registry, &frame, &key, &namespace, &limit) < 0) {
+        return NULL;
+    }
+    PyObject *scope = walk(frame, key, namespace, registry, limit, &distance, &scope_count);
+    if (scope == NULL) {
+        if (PyErr_Occurred()) {
+            return NULL;
+        }
+        Py_RETURN_NONE;
+    }
+    return scope;
+}
+
+PyDoc_STRVAR(locate_scope_doc,
+             "locate_scope(registry, frame, key, namespace='', limit=None)\n"
+             "--\n\n"
+             "Return the same scope as find_scope() along with the number of frames walked and\n"
+             "the number of scopes checked, walking past at most limit frames if one is given.");
+
+static PyObject *
+locate_scope(PyObject *module, PyObject *args)
+{
+    PyObject *registry, *key, *namespace;
+    PyFrameObject *frame;
+    Py_ssize_t limit, distance, scope_count;
+    if (parse_walk_arguments(args, &registry, &frame, &key, &namespace, &limit) < 0) {
+        return NULL;
+    }
+    PyObject *scope = walk(frame, key, namespace, registry, limit, &distance, &scope_count);
+    if (scope == NULL) {
+        if (PyErr_Occurred()) {
+            return NULL;
+        }
+        return Py_BuildValue("Onn", Py_None, distance, scope_count);
+    }
+    return Py_BuildValue("Nnn", scope, distance, scope_count);
+}
+
+PyDoc_STRVAR(locate_scopes_doc,
+             "locate_scopes(registry, frame, keys, namespace='', limit=None)\n"
+             "--\n\n"
+             "Find the innermost scope that defines each of the keys in a single walk, and return\n"
+             "a dictionary of the scopes that were found along with the numbers of frames walked\n"
+             "and scopes checked.");
+
+static PyObject *
+locate_scopes(PyObject *module, PyObject *args)
+{
+    PyObject *registry, *keys, *frame_object, *limit_object = NULL;
+    PyObject *namespace = empty_string;
+    Py_ssize_t limit;
+    if (!PyArg_ParseTuple(args, "O!OO|OO", &PyTuple_Type, &registry, &frame_object, &keys,
+                          &namespace, &limit_object)) {
+        return NULL;
+    }
+    if (check_frame(frame_object) < 0 || parse_limit(limit_object, &limit) < 0) {
+        return NULL;
+    }
+
+    PyObject *remaining_keys = PySet_New(keys);
+    if (remaining_keys == NULL) {
+        return NULL;
+    }
+    PyObject *scopes = PyDict_New();
+    if (scopes == NULL) {
+        Py_DECREF(remaining_keys);
+        return NULL;
+    }
+
+    Py_ssize_t distance = 0, scope_count = 0;
+    PyFrameObject *frame = frame_object == Py_None ? NULL : (PyFrameObject *)frame_object;
+    Py_XINCREF(frame);
+    while (frame != NULL && PySet_GET_SIZE(remaining_keys) > 0 && within_limit(distance, limit)) {
+        PyObject *scope = lookup_scope(frame, namespace, registry);
+        if (scope != NULL) {
+            scope_count += 1;
+            PyObject *variables = PyObject_GetAttr(scope, variables_string);
+            /* Iterate over a copy because keys are removed from the set as they're found. */
+            PyObject *pending_keys = variables ? PySequence_List(remaining_keys) : NULL;
+            int failed = pending_keys == NULL;
+            for (Py_ssize_t index = 0; !failed && index < PyList_GET_SIZE(pending_keys);
+                 index++) {
+                PyObject *key = PyList_GET_ITEM(pending_keys, index);
+                int contains = PySequence_Contains(variables, key);
+                if (contains > 0) {
+                    failed = PyDict_SetItem(scopes, key, scope) < 0 ||
+                             PySet_Discard(remaining_keys, key) < 0;
+                }
+                else if (contains < 0) {
+                    failed = 1;
+                }
+            }
+            Py_XDECREF(pending_keys);
+            Py_XDECREF(variables);
+            int boundary = failed ? 0 : is_boundary(scope);
+            Py_DECREF(scope);
+            if (failed || boundary < 0) {
+                goto error;
+            }
+            if (PySet_GET_SIZE(remaining_keys) == 0) {
+                break;
+            }
+            if (boundary) {
+                distance += 1;
+                break;
+            }
+        }
+        else if (PyErr_Occurred()) {
+            goto error;
+        }
+
+        PyFrameObject *back = PyFrame_GetBack(frame);
+        Py_DECREF(frame);
+        frame = back;
+        distance += 1;
+    }
+
+    Py_XDECREF(frame);
+    Py_DECREF(remaining_keys);
+    return Py_BuildValue("Nnn", scopes, distance, scope_count);
+
+error:
+    Py_XDECREF(frame);
+    Py_DECREF(remaining_keys);
+    Py_DECREF(scopes);
+    return NULL;
+}
+
+static PyMethodDef speedups_methods[] = {
+    {"find_existing_scope", find_existing_scope, METH_VARARGS, find_existing_scope_doc},
+    {"find_frame_scopes", find_frame_scopes, METH_VARARGS, find_frame_scopes_doc},
+    {"find_scope", find_scope, METH_VARARGS, find_scope_doc},
+    {"locate_scope", locate_scope, METH_VARARGS, locate_scope_doc},
+    {"locate_scopes", locate_scopes, METH_VARARGS, locate_scopes_doc},
+    {NULL, NULL, 0, NULL},
+};
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "dysco._speedups",
+    "Compiled accelerators for the hot scope lookup routines in dysco.scope.",
+    -1,
+    speedups_methods,
+};
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    boundary_string = PyUnicode_InternFromString("boundary");
+    code_string = PyUnicode_InternFromString("code");
+    empty_string = PyUnicode_InternFromString("");
+    f_locals_string = PyUnicode_InternFromString("f_locals");
+    frame_scopes_key_string = PyUnicode_InternFromString("<dysco.scopes>");
+    scopes_string = PyUnicode_InternFromString("scopes");
+    thread_id_string = PyUnicode_InternFromString("thread_id");
+    variables_string = PyUnicode_InternFromString("variables");
+    if (boundary_string == NULL || code_string == NULL || empty_string == NULL ||
+        f_locals_string == NULL || frame_scopes_key_string == NULL || scopes_string == NULL ||
+        thread_id_string == NULL || variables_string == NULL) {
+        return NULL;
+    }
+    PyObject *module = PyModule_Create(&speedups_module);
+#ifdef Py_GIL_DISABLED
+    /* Nothing here relies on the GIL, so don't make free-threaded builds enable it on import. */
+    if (module != NULL && PyUnstable_Module_SetGIL(module, Py_MOD_GIL_NOT_USED) < 0) {
+        Py_DECREF(module);
+        return NULL;
+    }
+#endif
+    return module;
+}
@@ -0,0 +1,208 @@
+"""Houses the ``contextvars``-based engine that tracks scopes without inspecting any frames.
+
+Each namespace stores the innermost of a chain of immutable ``ContextScope`` instances in a
+``ContextVar``. Writes replace scopes instead of mutating them, which means that asyncio tasks and
+functions run with ``contextvars.copy_context().run()`` see the chain as it was when their context
+was copied, and nothing that they write can leak back into the context that they were started from.
+"""
+
+from contextvars import ContextVar
+from typing import Any, Dict, Hashable, Iterator, List, Mapping, Optional, Tuple
+
+from dysco import stats
+from dysco.persistent import PersistentMap, empty, missing
+
+
+class ContextScope:
+    """An immutable scope in a chain of scopes that is stored in a context variable.
+
+    Every scope holds the variables that were defined at its own level, as well as a flattened view
+    of everything that's visible from it so that lookups never need to walk up the chain. Both are
+    persistent maps, so the flattened view shares its structure with the parent's view and can be
+    handed out as a snapshot as-is.
+    """
+
+    __slots__ = ('parent', 'variables', 'visible')
+
+    def __init__(
+        self,
+        variables: PersistentMap = empty,
+        parent: Optional['ContextScope'] = None,
+        visible: Optional[PersistentMap] = None,
+    ) -> None:
+        self.parent = parent
+        self.variables = variables
+        if visible is None:
+            visible = variables if parent is None else parent.visible.update(variables)
+        self.visible: PersistentMap = visible
+
+    def reparent(self, parent: Optional['ContextScope']) -> 'ContextScope':
+        return ContextScope(self.variables, parent)
+
+    def with_variable(self, key: Hashable, value: Any) -> 'ContextScope':
+        # The scope's own variables take precedence, so the view can be updated in place.
+        return ContextScope(
+            self.variables.set(key, value), self.parent, self.visible.set(key, value)
+        )
+
+    def with_variables(self, variables: Mapping[Hashable, Any]) -> 'ContextScope':
+        return ContextScope(
+            self.variables.update(variables), self.parent, self.visible.update(variables)
+        )
+
+    def without_variable(self, key: Hashable) -> 'ContextScope':
+        # Removing the key might uncover a value from an outer scope.
+        value = self.parent.visible.lookup(key) if self.parent else missing
+        visible = self.visible.delete(key) if value is missing else self.visible.set(key, value)
+        return ContextScope(self.variables.delete(key), self.parent, visible)
+
+
+def create_context_variable(namespace: str) -> 'ContextVar[Optional[ContextScope]]':
+    return ContextVar(f'dysco.{namespace}', default=None)
+
+
+def delete_variable(
+    context_variable: 'ContextVar[Optional[ContextScope]]', key: Hashable, readonly: bool
+) -> bool:
+    """Delete ``key`` from its innermost defining scope, returning whether any scope defined it."""
+    head = context_variable.get()
+    scope, path = find_defining_scope(head, key)
+    if scope is None:
+        return False
+    if readonly and scope is not head:
+        raise KeyError(f'The key "{key}" is defined in a higher scope, but is read-only.')
+    context_variable.set(rebuild(scope.without_variable(key), path))
+    return True
+
+
+def find_defining_scope(
+    head: Optional[ContextScope], key: Hashable
+) -> Tuple[Optional[ContextScope], List[ContextScope]]:
+    """Find the innermost scope that defines ``key`` along with the scopes inside of it."""
+    path: List[ContextScope] = []
+    scope = head
+    while scope is not None:
+        if key in scope.variables:
+            return scope, path
+        path.append(scope)
+        scope = scope.parent
+    return None, path
+
+
+def iterate_items(
+    context_variable: 'ContextVar[Optional[ContextScope]]',
+) -> Iterator[Tuple[Hashable, Any]]:
+    scope = context_variable.get()
+    while scope is not None:
+        yield from scope.variables.items()
+        scope = scope.parent
+
+
+def pop_scope(context_variable: 'ContextVar[Optional[ContextScope]]') -> None:
+    # The parent is read back from the current head rather than restored from a token, so that any
+    # writes made to outer scopes while the inner scope was active are preserved.
+    head = context_variable.get()
+    context_variable.set(head.parent if head else None)
+    if stats.enabled:
+        stats.current.record_scopes(destroyed=1)
+
+
+def push_scope(
+    context_variable: 'ContextVar[Optional[ContextScope]]', variables: PersistentMap = empty
+) -> None:
+    context_variable.set(ContextScope(variables, context_variable.get()))
+    if stats.enabled:
+        stats.current.record_scopes(created=1)
+
+
+def restore(
+    context_variable: 'ContextVar[Optional[ContextScope]]', snapshot: PersistentMap
+) -> None:
+    """Define every variable from a snapshot in the innermost scope."""
+    head = context_variable.get()
+    if head is None or (head.parent is None and not head.variables):
+        context_variable.set(ContextScope(snapshot))
+    else:
+        context_variable.set(head.with_variables(snapshot))
+
+
+def snapshot(context_variable: 'ContextVar[Optional[ContextScope]]') -> PersistentMap:
+    head = context_variable.get()
+    return empty if head is None else head.visible
+
+
+def rebuild(scope: ContextScope, path: List[ContextScope]) -> ContextScope:
+    """Replace a scope in a chain by rebuilding each of the scopes inside of it on top of it."""
+    for inner_scope in reversed(path):
+        scope = inner_scope.reparent(scope)
+    return scope
+
+
+def set_variable(
+    context_variable: 'ContextVar[Optional[ContextScope]]',
+    key: Hashable,
+    value: Any,
+    readonly: bool,
+    shadow: bool,
+) -> None:
+    head = context_variable.get()
+    if head is None:
+        context_variable.set(ContextScope(empty.set(key, value)))
+        return
+
+    if not shadow:
+        scope, path = find_defining_scope(head, key)
+        if scope is not None:
+            if readonly and scope is not head:
+                raise KeyError(f'The key "{key}" is defined in a higher scope, but is read-only.')
+            context_variable.set(rebuild(scope.with_variable(key, value), path))
+            return
+
+    context_variable.set(head.with_variable(key, value))
+
+
+def set_variables(
+    context_variable: 'ContextVar[Optional[ContextScope]]',
+    variables: Mapping[Hashable, Any],
+    readonly: bool,
+    shadow: bool,
+) -> None:
+    """Assign several variables with the same rules as ``set_variable()`` and one walk of the chain.
+
+    Nothing is assigned if any of the variables can't be, and the chain is only rebuilt once.
+    """
+    head = context_variable.get()
+    if not variables:
+        return
+    if head is None:
+        context_variable.set(ContextScope(empty.update(variables)))
+        return
+
+    # Group the variables by the index in the chain of the scope that they'll be assigned in.
+    chain: List[ContextScope] = []
+    updates: Dict[int, Dict[Hashable, Any]] = {}
+    remaining_variables = dict(variables)
+    scope: Optional[ContextScope] = head
+    while scope is not None and remaining_variables and not shadow:
+        defined_keys = [key for key in remaining_variables if key in scope.variables]
+        if defined_keys:
+            if readonly and scope is not head:
+                raise KeyError(
+                    f'The key "{defined_keys[0]}" is defined in a higher scope, but is read-only.'
+                )
+            updates[len(chain)] = {key: remaining_variables.pop(key) for key in defined_keys}
+        chain.append(scope)
+        scope = scope.parent
+    if remaining_variables:
+        updates.setdefault(0, {}).update(remaining_variables)
+    chain = chain or [head]
+
+    # Rebuild the chain from the outermost scope that changed inwards.
+    outermost_index = max(updates)
+    parent = chain[outermost_index].parent
+    for index in range(outermost_index, -1, -1):
+        scope_variables = chain[index].variables
+        if index in updates:
+            scope_variables = scope_variables.update(updates[index])
+        parent = ContextScope(scope_variables, parent)
+    context_variable.set(parent)
@@ -1,26 +1,140 @@
 """Houses the implementation of the main ``Dysco`` class and project API."""
+
 import functools
 import inspect
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pickle import PickleError
-from threading import Lock
-from typing import Any, Callable, Hashable, Iterator, Optional, Tuple, Union
+from time import perf_counter_ns
+from types import FrameType
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Dict,
+    Generator,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+    overload,
+)
+
+from dysco import context
+from dysco import scope as scope_module
+from dysco import stats
+from dysco.context import ContextScope
+from dysco.lazy import LazyValue, resolve
+from dysco.persistent import PersistentMap, empty
+from dysco.scope import ExplicitScope, Scope, iterate_scopes
+
+#: The available engines for tracking scopes, see the ``engine`` argument of ``Dysco``.
+engines = ('frame', 'context')
+
+#: A sentinel that the internal lookups return when a key isn't defined in any scope.
+missing = object()
+
+#: The operations whose hits and misses are recorded when ``dysco.stats`` is enabled.
+lookup_operations = frozenset(('contains', 'del', 'get'))
 
-from dysco.scope import Scope, find_parent_scope
+#: The operations that access several keys, which are profiled under a key of ``'*'``.
+bulk_operations = frozenset(('get_many', 'set_many'))
 
 
 class Dysco:
-    def __init__(self, *, readonly: bool = False, shadow: bool = False, stacklevel: int = 1):
+    """Dynamically scoped variables that can be accessed as either attributes or items.
+
+    The ``engine`` determines how scopes are tracked. The default ``'frame'`` engine ties scopes to
+    the call frames that they're created in, while the ``'context'`` engine keeps a chain of scopes
+    in a ``contextvars.ContextVar``. The latter never inspects frames and carries variables across
+    asyncio tasks and copied contexts, but new scopes are only opened by functions that are wrapped
+    with the instance as a decorator. Functions that ``loop.run_in_executor()`` runs in other
+    threads don't get a copy of the context, so they only see the variables if they're wrapped with
+    ``bind()``, run with ``contextvars.copy_context().run``, or run in a
+    ``ScopedThreadPoolExecutor``.
+
+    With either engine, ``with dysco.scope(...)`` explicitly opens a new scope for the duration of a
+    block. Lookups from inside of the block resolve against the explicit scope directly, so their
+    cost doesn't depend on how deeply the code inside of the block calls.
+
+    Lookups with the frame engine walk up the stack until they find the key, so a key that isn't
+    defined anywhere walks every frame. The ``max_depth`` option caps the number of frames above the
+    calling frame that are walked, and ``boundary()`` stops walks at a specific scope instead. Any
+    scopes beyond either one are invisible to the instance.
+    """
+
+    def __init__(
+        self,
+        *,
+        readonly: bool = False,
+        shadow: bool = False,
+        stacklevel: int = 1,
+        engine: str = 'frame',
+        max_depth: Optional[int] = None,
+    ):
         if readonly and shadow:
             raise ValueError(
                 'Only one of the "readonly" and "shadow" options can be used at the same time.'
             )
+        if engine not in engines:
+            raise ValueError(f'The "engine" option must be one of {", ".join(engines)}.')
+        if max_depth is not None and (engine != 'frame' or max_depth < 0):
+            raise ValueError(
+                'The "max_depth" option must be a non-negative number, and it can only be used '
+                'with the frame engine.'
+            )
 
-        self.__namespace = hex(id(self))
+        self.__namespace = scope_module.create_namespace()
+        self.__engine = engine
+        self.__context_variable = (
+            context.create_context_variable(self.__namespace) if engine == 'context' else None
+        )
+        # The frame engine keeps the chain of explicitly opened scopes in a context variable too.
+        # The context engine never sets it, but creating it anyway saves checking it for `None`.
+        self.__explicit_scopes: 'ContextVar[Optional[ExplicitScope]]' = ContextVar(
+            f'dysco.{self.__namespace}.explicit', default=None
+        )
 
+        # The subclass that holds the properties of the keys declared with `declare()`, if any.
+        self.__declared_class: Optional[type] = None
+        self.__max_depth = max_depth
         self.__readonly = readonly
         self.__shadow = shadow
         self.__stacklevel = stacklevel
-        self.__stacklevel_lock = Lock()
+        # The variants that calling the instance has created. Each variant caches its own variants
+        # rather than sharing this dictionary, which would create reference cycles.
+        self.__variants: Dict[Tuple[bool, bool, int, Optional[int]], Dysco] = {}
+
+    @overload
+    def __call__(
+        self,
+        function: Callable,
+        *,
+        readonly: Optional[bool] = None,
+        shadow: Optional[bool] = None,
+        stacklevel: Optional[int] = None,
+        max_depth: Optional[int] = None,
+    ) -> Callable:
+        pass
+
+    @overload
+    def __call__(
+        self,
+        function: None = None,
+        *,
+        readonly: Optional[bool] = None,
+        shadow: Optional[bool] = None,
+        stacklevel: Optional[int] = None,
+        max_depth: Optional[int] = None,
+    ) -> 'Dysco':
+        pass
 
     def __call__(
         self,
@@ -29,6 +143,7 @@ class Dysco:
         readonly: Optional[bool] = None,
         shadow: Optional[bool] = None,
         stacklevel: Optional[int] = None,
+        max_depth: Optional[int] = None,
     ) -> Union[Callable, 'Dysco']:
         if readonly and shadow:
             raise ValueError(
@@ -37,7 +152,32 @@ class Dysco:
 
         # Handle behaving like a decorator.
         if function:
-            if inspect.iscoroutinefunction(function):
+            context_variable = self.__context_variable
+            if context_variable is not None:
+                # Frames can't delimit the function's scope here, so push and pop one explicitly.
+                if inspect.iscoroutinefunction(function):
+
+                    @functools.wraps(function)
+                    async def wrapper(*args, **kwargs):
+                        context.push_scope(context_variable)
+                        try:
+                            return await function(self, *args, **kwargs)
+                        finally:
+                            context.pop_scope(context_variable)
+
+                else:
+
+                    @functools.wraps(function)
+                    def wrapper(*args, **kwargs):
+                        context.push_scope(context_variable)
+                        try:
+                            return function(self, *args, **kwargs)
+                        finally:
+                            context.pop_scope(context_variable)
+
+            # The function's own frame delimits its scope, which is only created if it assigns a
+            # variable, so these wrappers don't need to do anything on entry.
+            elif inspect.iscoroutinefunction(function):
 
                 @functools.wraps(function)
                 async def wrapper(*args, **kwargs):
@@ -61,112 +201,104 @@ class Dysco:
             readonly = self.__readonly if readonly is None else readonly
             shadow = self.__shadow if shadow is None else shadow
         stacklevel = self.__stacklevel if stacklevel is None else stacklevel
-        dysco = Dysco(readonly=readonly, stacklevel=stacklevel)
+        max_depth = self.__max_depth if max_depth is None else max_depth
 
-        # Override the instance's namespace to be the same as ours.
+        # Variants are immutable, so the same one can be returned every time that it's requested.
+        options = (readonly, shadow, stacklevel, max_depth)
+        dysco = self.__variants.get(options)
+        if dysco is not None:
+            return dysco
+        dysco = Dysco(
+            readonly=readonly,
+            shadow=shadow,
+            stacklevel=stacklevel,
+            engine=self.__engine,
+            max_depth=max_depth,
+        )
+
+        # Override the instance's namespace and scope storage to be the same as ours.
         dysco.__namespace = self.__namespace
+        dysco.__context_variable = self.__context_variable
+        dysco.__explicit_scopes = self.__explicit_scopes
 
-        return dysco
+        # Threads that race here create interchangeable variants, so it doesn't matter which wins.
+        return self.__variants.setdefault(options, dysco)
 
     def __contains__(self, key: Hashable) -> bool:
-        try:
-            current_frame = inspect.currentframe()
-            self.__stacklevel_lock.acquire()
-            self.__stacklevel += 1
-            self[key]
-            return True
-        except KeyError:
-            return False
-        finally:
-            self.__stacklevel -= 1
-            self.__stacklevel_lock.release()
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            return self.__measure('contains', self.__get, key, frame) is not missing
+        return self.__get(key, frame) is not missing
 
     def __delattr__(self, attribute: str):
         if attribute.startswith('_Dysco_'):
             return super().__delattr__(attribute)
 
+        frame = sys._getframe(self.__stacklevel)
         try:
-            current_frame = inspect.currentframe()
-            self.__stacklevel_lock.acquire()
-            self.__stacklevel += 1
-            del self[attribute]
+            if stats.enabled:
+                result = self.__measure('del', self.__delete, attribute, frame)
+            else:
+                result = self.__delete(attribute, frame)
         except KeyError as key_error:
             raise AttributeError(key_error.args[0].replace('key', 'attribute', 1))
-        finally:
-            self.__stacklevel -= 1
-            self.__stacklevel_lock.release()
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
+        if result is missing:
+            raise AttributeError(f'The attribute {attribute} was not found in any scope.')
 
     def __delitem__(self, key: Hashable):
-        stack = inspect.stack()
-        current_frame = stack[0].frame
-        stack = stack[self.__stacklevel :]
-        try:
-            initial_scope = Scope(stack[0].frame, namespace=self.__namespace)
-            scope = initial_scope
-            while scope:
-                if key in scope.variables:
-                    if self.__readonly and scope is not initial_scope:
-                        raise KeyError(
-                            f'The key "{key}" is defined in a higher scope, but is read-only.'
-                        )
-                    else:
-                        del scope.variables[key]
-                    return
-                scope, stack = find_parent_scope(scope, stack)
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            result = self.__measure('del', self.__delete, key, frame)
+        else:
+            result = self.__delete(key, frame)
+        if result is missing:
             raise KeyError(f'The key "{key}" was not found in any scope.')
-        finally:
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
 
     def __getattr__(self, attribute: str) -> Any:
         if attribute.startswith('_Dysco_'):
             return super().__getattribute__(attribute)
 
-        try:
-            current_frame = inspect.currentframe()
-            self.__stacklevel_lock.acquire()
-            self.__stacklevel += 1
-            return self[attribute]
-        except KeyError:
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            value = self.__measure('get', self.__get, attribute, frame)
+        else:
+            value = self.__get(attribute, frame)
+        if value is missing:
             raise AttributeError(f'The attribute {attribute} was not found in any scope.')
-        finally:
-            self.__stacklevel -= 1
-            self.__stacklevel_lock.release()
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
+        if type(value) is LazyValue:
+            return value.get()
+        return value
 
     def __getitem__(self, key: Hashable) -> Any:
-        stack = inspect.stack()
-        current_frame = stack[0].frame
-        stack = stack[self.__stacklevel :]
-        try:
-            scope = Scope(stack[0].frame, namespace=self.__namespace)
-            while scope:
-                if key in scope.variables:
-                    return scope.variables[key]
-                scope, stack = find_parent_scope(scope, stack)
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            value = self.__measure('get', self.__get, key, frame)
+        else:
+            value = self.__get(key, frame)
+        if value is missing:
             raise KeyError(f'The key "{key}" was not found in any scope.')
-        finally:
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
+        if type(value) is LazyValue:
+            return value.get()
+        return value
 
     def __iter__(self) -> Iterator[Tuple[Hashable, Any]]:
-        stack = inspect.stack()
-        current_frame = stack[0].frame
-        stack = stack[self.__stacklevel :]
+        # The recorded time includes any time that the consumer spends between items.
+        start = perf_counter_ns() if stats.enabled else None
         try:
-            scope = Scope(stack[0].frame, namespace=self.__namespace)
-            while scope:
-                for key_value_pair in scope.variables.items():
-                    yield key_value_pair
-                scope, stack = find_parent_scope(scope, stack)
+            items: Iterable[Tuple[Hashable, Any]]
+            if self.__context_variable is not None:
+                items = context.iterate_items(self.__context_variable)
+            else:
+                frame = sys._getframe(self.__stacklevel)
+                scopes = iterate_scopes(
+                    frame, self.__namespace, self.__explicit_scopes.get(), self.__max_depth
+                )
+                items = (item for scope in scopes for item in scope.variables.items())
+            for key, value in items:
+                yield key, value.get() if type(value) is LazyValue else value
         finally:
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
+            if start is not None:
+                stats.current.record_operation('iter', None, perf_counter_ns() - start)
 
     def __reduce__(self):
         raise PickleError('Dysco cannot be pickled.')
@@ -176,37 +308,590 @@ class Dysco:
             super().__setattr__(attribute, value)
             return
 
+        frame = sys._getframe(self.__stacklevel)
         try:
-            current_frame = inspect.currentframe()
-            self.__stacklevel_lock.acquire()
-            self.__stacklevel += 1
-            self[attribute] = value
+            if stats.enabled:
+                self.__measure('set', self.__set, attribute, value, frame)
+            else:
+                self.__set(attribute, value, frame)
         except KeyError as key_error:
             raise AttributeError(key_error.args[0].replace('key', 'attribute', 1))
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            self.__measure('set', self.__set, key, value, frame)
+        else:
+            self.__set(key, value, frame)
+
+    def bind(self, function: Callable, snapshot: Optional[PersistentMap] = None) -> Callable:
+        """Wrap a function so that it runs with the variables that are visible from the caller.
+
+        The visible variables are captured once as a snapshot when ``bind()`` is called, and every
+        call to the returned function installs them as a new root scope before calling the original
+        function. This is meant for handing work to other threads, like with ``executor.submit()``,
+        where the scopes of the submitting code wouldn't be visible otherwise. Installing the
+        snapshot is constant time, so fanning out many calls only costs one walk up the stack.
+
+        A ``snapshot`` that was captured elsewhere, possibly in another process, can be passed to
+        install it instead of the caller's variables. Generator functions are wrapped in the same
+        way as by ``generator()``, except that every generator sees the same snapshot.
+        """
+        if snapshot is None:
+            snapshot = self.__snapshot(sys._getframe(self.__stacklevel))
+        if inspect.isgeneratorfunction(function) or inspect.isasyncgenfunction(function):
+            return self.__wrap_generator_function(function, snapshot)
+        context_variable = self.__context_variable
+        if context_variable is not None:
+            if inspect.iscoroutinefunction(function):
+
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    context.push_scope(context_variable, snapshot)
+                    try:
+                        return await function(*args, **kwargs)
+                    finally:
+                        context.pop_scope(context_variable)
+
+            else:
+
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    context.push_scope(context_variable, snapshot)
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        context.pop_scope(context_variable)
+
+        # The wrapper's own frame holds the scope, so it goes away when the call returns.
+        elif inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                self.__install(snapshot, sys._getframe())
+                return await function(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                self.__install(snapshot, sys._getframe())
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    def boundary(self) -> None:
+        """Stop lookups from walking past the calling scope.
+
+        The scopes of the frames that called the calling frame become invisible for as long as the
+        calling scope exists, which makes lookups of undefined keys stop here instead of walking the
+        rest of the stack. This is meant for entry points like request handlers that run beneath
+        deep framework stacks. Boundaries only apply to the frame engine, because lookups with the
+        context engine never walk the stack.
+        """
+        if self.__context_variable is not None:
+            raise ValueError('Boundaries can only be used with the frame engine.')
+        frame = sys._getframe(self.__stacklevel)
+        scope = Scope(frame, namespace=self.__namespace)
+        scope.boundary = True
+        # Lookups that were cached or skipped through the frame could otherwise still see past it.
+        self.__invalidate(frame, self.__explicit_scopes.get())
+
+    def declare(self, *keys: str) -> None:
+        """Declare keys that are read often enough to warrant their own attributes.
+
+        Reading a declared key as an attribute goes through a property that's generated for it,
+        which skips the failed instance attribute lookup that precedes every call to
+        ``__getattr__()``. Lookups behave exactly the same otherwise, and misses still fall back to
+        ``__getattr__()``, so declaring keys pays off for ones that are usually defined. The
+        properties are defined on a subclass that the instance switches to the first time that it
+        declares a key, so they don't affect any other instances, including its own variants.
+        Newer interpreters make the failed lookup cheap on their own, so the gain is largest on
+        older ones.
+        """
+        for key in keys:
+            if not key.isidentifier() or key.startswith(('_Dysco_', '__')):
+                raise ValueError(f'The key "{key}" isn\'t a valid attribute name.')
+            declared_class = self.__declared_class
+            if declared_class is not None and key in vars(declared_class):
+                continue
+            if hasattr(type(self), key):
+                raise ValueError(f'The key "{key}" would hide the Dysco.{key} attribute.')
+            if declared_class is None:
+                base = type(self)
+                declared_class = type(base.__name__, (base,), {'__module__': base.__module__})
+                # Assigning the attribute directly would define a variable named `__class__`.
+                object.__setattr__(self, '__class__', declared_class)
+                self.__declared_class = declared_class
+            setattr(declared_class, key, self.__create_property(key))
+
+    def generator(self, function: Callable) -> Callable:
+        """Wrap a generator function so that its generators see the scopes that created them.
+
+        A generator's frame is resumed by whichever code consumes it, so lookups from inside of it
+        normally resolve against the consumer's scopes and walk a different stack every time. The
+        generators of the wrapped function instead capture the variables that are visible where
+        they're created, and every resume resolves against those and any variables that the
+        generator defines itself. That keeps per-item lookups in streaming pipelines correct, and
+        their cost doesn't depend on how deeply the generator is consumed.
+
+        Like with ``bind()``, the variables are captured as a snapshot, so later assignments from
+        the creating scopes aren't visible to the generator and assignments from inside of it never
+        leak out. Both generator functions and async generator functions can be wrapped.
+        """
+        if not inspect.isgeneratorfunction(function) and not inspect.isasyncgenfunction(function):
+            raise TypeError(
+                'Only generator functions and async generator functions can be wrapped.'
+            )
+        return self.__wrap_generator_function(function)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Look up a variable, returning ``default`` instead of raising if it isn't defined.
+
+        This is the cheapest way to check for a variable that's usually missing, because misses
+        don't raise and catch an exception like ``getattr()`` with a default would.
+        """
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            value = self.__measure('get', self.__get, key, frame)
+        else:
+            value = self.__get(key, frame)
+        if value is missing:
+            return default
+        if type(value) is LazyValue:
+            return value.get()
+        return value
+
+    def get_many(self, keys: Iterable[Hashable], default: Any = missing) -> Dict[Hashable, Any]:
+        """Look up several variables at once and return a dictionary that maps keys to values.
+
+        All of the keys are resolved with a single walk up the stack instead of one walk per key.
+        A ``KeyError`` is raised if any of the keys isn't defined in a scope, unless a ``default``
+        is given to use as the value of those keys instead.
+        """
+        keys = list(keys)
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            values = self.__measure('get_many', self.__get_many, keys, frame)
+        else:
+            values = self.__get_many(keys, frame)
+        for index, value in enumerate(values):
+            if value is missing:
+                if default is missing:
+                    raise KeyError(f'The key "{keys[index]}" was not found in any scope.')
+                values[index] = default
+            elif type(value) is LazyValue:
+                values[index] = value.get()
+        return dict(zip(keys, values))
+
+    def lazy(
+        self,
+        key: Hashable,
+        factory: Callable[[], Any],
+        teardown: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        """Assign a variable whose value is only computed by calling ``factory`` when it's read.
+
+        The variable is assigned following the same ``readonly`` and ``shadow`` rules as any other
+        assignment, and the factory is called at most once for the scope that it's assigned in, no
+        matter how many inner scopes or threads read it. Checking whether the variable exists
+        doesn't call the factory, and neither does binding a function, which shares the same value.
+        Capturing a snapshot computes the value though, so that snapshots only ever hold values.
+        The factory can't read the variable that it computes, which raises a ``RuntimeError``.
+
+        If a ``teardown`` callback is given, then it's called with the value once the variable is
+        gone, like when its scope is destroyed or when it's reassigned or deleted. It isn't called
+        if the value was never computed. The callback runs when the garbage collector frees the
+        value, which happens right away with CPython's reference counting, but can be delayed by
+        reference cycles or on other implementations like PyPy.
+        """
+        frame = sys._getframe(self.__stacklevel)
+        value = LazyValue(factory, teardown)
+        if stats.enabled:
+            self.__measure('set', self.__set, key, value, frame)
+        else:
+            self.__set(key, value, frame)
+
+    def restore(self, snapshot: PersistentMap) -> None:
+        """Define every variable from a snapshot in the calling scope.
+
+        This is constant time when the calling scope is empty, which makes it cheap to hand a
+        snapshot to a worker thread and restore it there before doing any other work.
+        """
+        if self.__context_variable is not None:
+            context.restore(self.__context_variable, snapshot)
+            return
+
+        frame = sys._getframe(self.__stacklevel)
+        head = self.__explicit_scopes.get()
+        scope = self.__find_initial_scope(frame, head)
+        scope.variables = scope.variables.update(snapshot) if scope.variables else snapshot
+        if isinstance(scope, Scope):
+            self.__invalidate(frame, head)
+
+    def scope(self, *args: Any, **kwargs: Any) -> ContextManager[None]:
+        """Open a new scope for the duration of a ``with`` block.
+
+        The scope's initial variables can be passed in the same ways as to ``dict``. Variables that
+        are assigned directly inside of the block are also defined in the scope, and all of them go
+        away when the block exits. Lookups from inside of the block resolve against the scope
+        without inspecting the frames inside of it as long as none of those frames define any new
+        variables in their own scopes.
+        """
+        variables = empty.update(dict(*args, **kwargs))
+        if self.__context_variable is not None:
+            return self.__open_context_scope(self.__context_variable, variables)
+        return self.__open_explicit_scope(sys._getframe(self.__stacklevel), variables)
+
+    def set_many(self, variables: Mapping[Hashable, Any]) -> None:
+        """Assign several variables at once with a single walk up the stack.
+
+        Each variable follows the same ``readonly`` and ``shadow`` rules as a single assignment,
+        and nothing is assigned if any of them would raise an error.
+        """
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            self.__measure('set_many', self.__set_many, variables, frame)
+        else:
+            self.__set_many(variables, frame)
+
+    def snapshot(self) -> PersistentMap:
+        """Capture an immutable mapping of every variable that's visible from the calling scope.
+
+        Shadowed variables are resolved in the same way as regular lookups. The snapshot shares its
+        structure with the scopes, so capturing it never copies their variables, and it's constant
+        time with the context engine because every scope already tracks its visible variables.
+        Variables assigned with ``lazy()`` are computed and captured as their values.
+        """
+        return resolve(self.__snapshot(sys._getframe(self.__stacklevel)))
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        """Assign variables from a mapping, key/value pairs, or keyword arguments like ``dict``."""
+        frame = sys._getframe(self.__stacklevel)
+        if stats.enabled:
+            self.__measure('set_many', self.__set_many, dict(*args, **kwargs), frame)
+        else:
+            self.__set_many(dict(*args, **kwargs), frame)
+
+    # The methods below implement the actual scope resolution. Each of them takes the frame that the
+    # access originated from explicitly rather than inspecting the stack itself, which lets the
+    # public methods share them without any mutable per-instance state or locking.
+
+    @staticmethod
+    def __create_property(key: str) -> property:
+        """Create a property that reads ``key`` in the same way as ``__getattr__()`` does.
+
+        Only reads need a property, because ``__setattr__()`` and ``__delattr__()`` are called for
+        every attribute regardless of any descriptors on the class.
+        """
+
+        def get(dysco: Dysco) -> Any:
+            # Property functions are called directly from the accessing frame, like `__getattr__()`.
+            frame = sys._getframe(dysco.__stacklevel)
+            if stats.enabled:
+                value = dysco.__measure('get', dysco.__get, key, frame)
+            else:
+                value = dysco.__get(key, frame)
+            if value is missing:
+                raise AttributeError(f'The attribute {key} was not found in any scope.')
+            if type(value) is LazyValue:
+                return value.get()
+            return value
+
+        return property(get, doc=f'The dynamically scoped variable {key!r}.')
+
+    def __delegate(self, generator: Generator, snapshot: PersistentMap) -> Generator:
+        """Drive ``generator`` with the variables from ``snapshot`` installed on every resume."""
+        variable, head = self.__prepare_resumes(snapshot, sys._getframe())
+        send: Callable[[Any], Any] = generator.send
+        value = None
+        while True:
+            # Swap in the generator's own chain of scopes, and save it again with its writes.
+            token = variable.set(head)
+            try:
+                item = send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                head = variable.get()
+                variable.reset(token)
+            try:
+                value = yield item
+                send = generator.send
+            except GeneratorExit:
+                token = variable.set(head)
+                try:
+                    generator.close()
+                finally:
+                    variable.reset(token)
+                raise
+            except BaseException as error:
+                send, value = generator.throw, error
+
+    async def __delegate_async(
+        self, generator: AsyncGenerator, snapshot: PersistentMap
+    ) -> AsyncGenerator:
+        """Drive ``generator`` like ``__delegate()`` does, but asynchronously."""
+        variable, head = self.__prepare_resumes(snapshot, sys._getframe())
+        send: Callable[[Any], Awaitable[Any]] = generator.asend
+        value = None
+        while True:
+            token = variable.set(head)
+            try:
+                item = await send(value)
+            except StopAsyncIteration:
+                return
+            finally:
+                head = variable.get()
+                variable.reset(token)
+            try:
+                value = yield item
+                send = generator.asend
+            except GeneratorExit:
+                token = variable.set(head)
+                try:
+                    await generator.aclose()
+                finally:
+                    variable.reset(token)
+                raise
+            except BaseException as error:
+                send, value = generator.athrow, error
+
+    def __delete(self, key: Hashable, frame: FrameType) -> Any:
+        if self.__context_variable is not None:
+            if not context.delete_variable(self.__context_variable, key, self.__readonly):
+                return missing
+            return None
+        head = self.__explicit_scopes.get()
+        initial_scope = self.__find_initial_scope(frame, head)
+        for scope in iterate_scopes(frame, self.__namespace, head, self.__max_depth):
+            if key in scope.variables:
+                if self.__readonly and scope is not initial_scope:
+                    raise KeyError(
+                        f'The key "{key}" is defined in a higher scope, but is read-only.'
+                    )
+                scope.variables = scope.variables.delete(key)
+                if isinstance(scope, Scope):
+                    scope_module.bump_version(self.__namespace)
+                return None
+        return missing
+
+    def __find_initial_scope(
+        self, frame: FrameType, head: Optional[ExplicitScope] = None
+    ) -> Union[Scope, ExplicitScope]:
+        """Find the scope that new variables are defined in when assigned from ``frame``."""
+        while head is not None and not scope_module.is_visible(frame, head):
+            head = head.parent
+        if head is not None and head.anchor is frame:
+            return head
+        return Scope(frame, namespace=self.__namespace)
+
+    def __get(self, key: Hashable, frame: FrameType) -> Any:
+        if self.__context_variable is not None:
+            head = self.__context_variable.get()
+            return missing if head is None else head.visible.get(key, missing)
+
+        # Look these up on the module so that they follow any backend switch from `use_speedups()`.
+        explicit_head = self.__explicit_scopes.get()
+        scope: Optional[Union[Scope, ExplicitScope]]
+        if explicit_head is None:
+            scope = scope_module.find_cached_scope(frame, key, self.__namespace, self.__max_depth)
+        else:
+            scope = scope_module.find_block_scope(
+                frame, key, self.__namespace, explicit_head, self.__max_depth
+            )
+        return missing if scope is None else scope.variables[key]
+
+    def __get_many(self, keys: List[Hashable], frame: FrameType) -> List[Any]:
+        if self.__context_variable is not None:
+            head = self.__context_variable.get()
+            if head is None:
+                return [missing] * len(keys)
+            return [head.visible.get(key, missing) for key in keys]
+
+        explicit_head = self.__explicit_scopes.get()
+        scopes: Mapping[Hashable, Union[Scope, ExplicitScope]]
+        if explicit_head is None:
+            scopes = scope_module.find_cached_scopes(
+                frame, keys, self.__namespace, self.__max_depth
+            )
+        else:
+            scopes = scope_module.find_block_scopes(
+                frame, keys, self.__namespace, explicit_head, self.__max_depth
+            )
+        return [scopes[key].variables[key] if key in scopes else missing for key in keys]
+
+    def __install(self, snapshot: PersistentMap, frame: FrameType) -> None:
+        """Define the variables from a snapshot in a new root scope for a frame that was entered."""
+        scope = Scope(frame, namespace=self.__namespace)
+        scope.boundary = True
+        scope.variables = snapshot
+        # Nothing can have cached a lookup through a brand new frame, but lookups from inside of an
+        # explicit scope skip the frames inside of it unless it's marked as changed.
+        scope_module.mark_changed(frame, self.__explicit_scopes.get())
+
+    def __invalidate(self, frame: FrameType, head: Optional[ExplicitScope]) -> None:
+        """Invalidate the lookups that could have missed a frame scope that ``frame`` changed."""
+        scope_module.bump_version(self.__namespace)
+        scope_module.mark_changed(frame, head)
+
+    def __measure(self, operation: str, method: Callable[..., Any], *args: Any) -> Any:
+        """Call one of the methods above and record the call with ``dysco.stats``."""
+        profiling = stats.profiling
+        if profiling:
+            stats.last_walk.frame_count = 0
+        start = perf_counter_ns()
+        hit: Optional[bool] = None
+        try:
+            result = method(*args)
+            if operation in lookup_operations:
+                hit = result is not missing
+            return result
+        except KeyError:
+            if operation in lookup_operations:
+                hit = False
+            raise
         finally:
-            self.__stacklevel -= 1
-            self.__stacklevel_lock.release()
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
-
-    def __setitem__(self, key: str, value: Any) -> None:
-        stack = inspect.stack()
-        current_frame = stack[0].frame
-        stack = stack[self.__stacklevel :]
+            duration = perf_counter_ns() - start
+            stats.current.record_operation(operation, hit, duration)
+            if profiling:
+                # Every method takes the key first and the calling frame last.
+                frame = args[-1]
+                key = '*' if operation in bulk_operations else args[0]
+                code = frame.f_code
+                stats.call_site_profile.record(
+                    code.co_filename,
+                    frame.f_lineno,
+                    code.co_name,
+                    operation,
+                    key,
+                    duration,
+                    stats.last_walk.frame_count,
+                )
+
+    @contextmanager
+    def __open_context_scope(
+        self, context_variable: 'ContextVar[Optional[ContextScope]]', variables: PersistentMap
+    ) -> Iterator[None]:
+        context.push_scope(context_variable, variables)
+        try:
+            yield
+        finally:
+            context.pop_scope(context_variable)
+
+    @contextmanager
+    def __open_explicit_scope(self, anchor: FrameType, variables: PersistentMap) -> Iterator[None]:
+        head = self.__explicit_scopes.get()
+        scope = ExplicitScope(anchor, self.__namespace, variables, head)
+        token = self.__explicit_scopes.set(scope)
+        if stats.enabled:
+            stats.current.record_scopes(created=1)
         try:
-            initial_scope = Scope(stack[0].frame, namespace=self.__namespace)
-            scope = initial_scope
-            while scope and not self.__shadow:
+            yield
+        finally:
+            scope.close()
+            try:
+                self.__explicit_scopes.reset(token)
+            except ValueError:
+                # A generator that's closed from another context than the one that it opened the
+                # scope in can only remove the scope from the current context, if it's there.
+                if self.__explicit_scopes.get() is scope:
+                    self.__explicit_scopes.set(head)
+            if stats.enabled:
+                stats.current.record_scopes(destroyed=1)
+
+    def __prepare_resumes(
+        self, snapshot: PersistentMap, frame: FrameType
+    ) -> Tuple[ContextVar, Optional[Union[ContextScope, ExplicitScope]]]:
+        """Return the context variable to swap on each resume of a delegated generator.
+
+        With the context engine, the generator's chain of scopes starts from a root scope holding
+        the snapshot. With the frame engine, the snapshot is installed in the delegating frame
+        instead, which is always the frame that the generator's frame returns to. Its chain of
+        explicit scopes starts out empty so that the consumer's explicit scopes stay invisible.
+        """
+        if self.__context_variable is not None:
+            return self.__context_variable, ContextScope(snapshot)
+        self.__install(snapshot, frame)
+        return self.__explicit_scopes, None  # type: ignore
+
+    def __set(self, key: Hashable, value: Any, frame: FrameType) -> None:
+        if self.__context_variable is not None:
+            context.set_variable(
+                self.__context_variable, key, value, self.__readonly, self.__shadow
+            )
+            return
+        head = self.__explicit_scopes.get()
+        initial_scope = self.__find_initial_scope(frame, head)
+        if not self.__shadow:
+            for scope in iterate_scopes(frame, self.__namespace, head, self.__max_depth):
                 if key in scope.variables:
                     if scope is initial_scope or not self.__readonly:
-                        scope.variables[key] = value
-                    else:
-                        raise KeyError(
-                            f'The key "{key}" is defined in a higher scope, but is read-only.'
-                        )
-                    return
-                scope, stack = find_parent_scope(scope, stack)
-            initial_scope.variables[key] = value
-        finally:
-            # Delete the current frame to avoid reference cycles.
-            del current_frame
+                        scope.variables = scope.variables.set(key, value)
+                        return
+                    raise KeyError(
+                        f'The key "{key}" is defined in a higher scope, but is read-only.'
+                    )
+        added = key not in initial_scope.variables
+        initial_scope.variables = initial_scope.variables.set(key, value)
+        # Explicit scopes are always checked before any cached lookups, so they never invalidate.
+        if added and isinstance(initial_scope, Scope):
+            self.__invalidate(frame, head)
+
+    def __set_many(self, variables: Mapping[Hashable, Any], frame: FrameType) -> None:
+        if self.__context_variable is not None:
+            context.set_variables(
+                self.__context_variable, variables, self.__readonly, self.__shadow
+            )
+            return
+        head = self.__explicit_scopes.get()
+        initial_scope = self.__find_initial_scope(frame, head)
+        defining_scopes = (
+            {}
+            if self.__shadow
+            else scope_module.find_defining_scopes(
+                frame, variables, self.__namespace, head, self.__max_depth
+            )
+        )
+
+        # Group the variables by scope first so that nothing is assigned if any of them can't be.
+        updates: Dict[Union[Scope, ExplicitScope], Dict[Hashable, Any]] = {}
+        for key, value in variables.items():
+            scope = defining_scopes.get(key, initial_scope)
+            if self.__readonly and scope is not initial_scope:
+                raise KeyError(f'The key "{key}" is defined in a higher scope, but is read-only.')
+            updates.setdefault(scope, {})[key] = value
+
+        added = any(key not in initial_scope.variables for key in updates.get(initial_scope, ()))
+        for scope, scope_variables in updates.items():
+            scope.variables = scope.variables.update(scope_variables)
+        if added and isinstance(initial_scope, Scope):
+            self.__invalidate(frame, head)
+
+    def __snapshot(self, frame: FrameType) -> PersistentMap:
+        if self.__context_variable is not None:
+            return context.snapshot(self.__context_variable)
+        return scope_module.snapshot(
+            frame, self.__namespace, self.__explicit_scopes.get(), self.__max_depth
+        )
+
+    def __wrap_generator_function(
+        self, function: Callable, snapshot: Optional[PersistentMap] = None
+    ) -> Callable:
+        """Wrap a generator function for ``bind()`` or ``generator()``.
+
+        The snapshot is captured from the caller of the wrapper when it isn't given, which has to
+        happen eagerly because the body of a generator only starts running on its first resume.
+        """
+        delegate = (
+            self.__delegate_async if inspect.isasyncgenfunction(function) else self.__delegate
+        )
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return delegate(
+                function(*args, **kwargs),
+                self.__snapshot(sys._getframe(1)) if snapshot is None else snapshot,
+            )
+
+        return wrapper
@@ -0,0 +1,152 @@
+"""Houses executors that carry dynamically scoped variables over to their workers."""
+
+import importlib
+import multiprocessing
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple, TypeVar, Union
+
+from dysco import g
+from dysco.dysco import Dysco
+from dysco.persistent import PersistentMap, empty
+
+T = TypeVar('T')
+
+#: The module and attribute name that a ``Dysco`` instance can be imported from.
+Reference = Tuple[str, str]
+
+#: The variables that changed since a base snapshot, and the keys that were removed from it.
+Delta = Tuple[Dict[Hashable, Any], Tuple[Hashable, ...]]
+
+#: The base snapshots that were sent to this worker process when it started, keyed by reference.
+worker_snapshots: Dict[Reference, PersistentMap] = {}
+
+
+def diff(base: PersistentMap, snapshot: PersistentMap) -> Delta:
+    """Find the entries of ``snapshot`` whose values aren't the same objects as in ``base``."""
+    if snapshot is base:
+        return {}, ()
+    missing = object()
+    changed = {key: value for key, value in snapshot.items() if base.get(key, missing) is not value}
+    removed = tuple(key for key in base if key not in snapshot)
+    return changed, removed
+
+
+def find_reference(dysco: Dysco) -> Reference:
+    """Find a module-level variable that holds ``dysco`` so that other processes can import it."""
+    for module_name, module in list(sys.modules.items()):
+        for name, value in list(getattr(module, '__dict__', {}).items()):
+            if value is dysco:
+                return module_name, name
+    raise ValueError(
+        'Only Dysco instances that are assigned to module-level variables can be sent to other '
+        'processes, because each process needs to import its own copy of the instance.'
+    )
+
+
+def initialize_worker(
+    snapshots: Dict[Reference, PersistentMap],
+    initializer: Optional[Callable[..., Any]],
+    initargs: Tuple[Any, ...],
+) -> None:
+    worker_snapshots.update(snapshots)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def resolve(reference: Reference) -> Dysco:
+    module_name, name = reference
+    return getattr(importlib.import_module(module_name), name)
+
+
+class ScopedCall:
+    """A picklable function call that installs the variables from snapshots before running.
+
+    The snapshots are stored as deltas against the base snapshots in ``worker_snapshots``, so the
+    pickled size of each call only grows with the number of variables that changed since the worker
+    was started rather than with the number of visible variables.
+    """
+
+    __slots__ = ('deltas', 'function')
+
+    def __init__(self, function: Callable[..., Any], deltas: Tuple[Tuple[Reference, Delta], ...]):
+        self.function = function
+        self.deltas = deltas
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        function = self.function
+        for reference, (changed, removed) in self.deltas:
+            snapshot = worker_snapshots.get(reference, empty)
+            if changed:
+                snapshot = snapshot.update(changed)
+            for key in removed:
+                snapshot = snapshot.delete(key)
+            function = resolve(reference).bind(function, snapshot)
+        return function(*args, **kwargs)
+
+    def __reduce__(self):
+        return (ScopedCall, (self.function, self.deltas))
+
+
+class ScopedProcessPoolExecutor(ProcessPoolExecutor):
+    """A process pool that runs each submitted function with the variables visible at submission.
+
+    Each of the ``dysco`` instances, which defaults to ``g``, must be assigned to a module-level
+    variable so that the worker processes can import it. The variables that are visible when the
+    pool is created are sent to each worker once, and every submitted function only carries the
+    variables whose values have been replaced since then. Large read-only values can therefore be
+    shared with every task without copying them per task by defining them before creating the pool.
+
+    The variables are installed as the outermost scope in the worker, so they need to be picklable,
+    and any assignments made in a worker aren't visible to the submitting process. Workers are
+    started with the ``'spawn'`` method unless another ``mp_context`` is given, because forked
+    workers would inherit whichever scopes were active in the submitting thread when they started.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        mp_context: Any = None,
+        initializer: Optional[Callable[..., Any]] = None,
+        initargs: Tuple[Any, ...] = (),
+        *,
+        dysco: Union[Dysco, Iterable[Dysco]] = g,
+        **kwargs: Any,
+    ):
+        dyscos = (dysco,) if isinstance(dysco, Dysco) else tuple(dysco)
+        # None of the executors' methods define any variables, so they see the caller's scopes.
+        self.references = tuple((dysco, find_reference(dysco)) for dysco in dyscos)
+        self.snapshots = {reference: dysco.snapshot() for dysco, reference in self.references}
+        super().__init__(
+            max_workers,
+            mp_context or multiprocessing.get_context('spawn'),
+            initialize_worker,
+            (self.snapshots, initializer, initargs),
+            **kwargs,
+        )
+
+    def submit(self, __fn: Callable[..., T], *args: Any, **kwargs: Any) -> 'Future[T]':
+        deltas = tuple(
+            (reference, diff(self.snapshots[reference], dysco.snapshot()))
+            for dysco, reference in self.references
+        )
+        return super().submit(ScopedCall(__fn, deltas), *args, **kwargs)
+
+
+class ScopedThreadPoolExecutor(ThreadPoolExecutor):
+    """A thread pool that runs each submitted function with the variables visible at submission.
+
+    Every function passed to ``submit()`` or ``map()`` is wrapped with ``Dysco.bind()`` for each of
+    the ``dysco`` instances, which defaults to ``g``. The variables are captured once per submitted
+    function rather than being looked up again in the worker, and any assignments made in a worker
+    stay in that worker's scope. All of the other arguments are passed to ``ThreadPoolExecutor``.
+    """
+
+    def __init__(self, *args: Any, dysco: Union[Dysco, Iterable[Dysco]] = g, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.dyscos = (dysco,) if isinstance(dysco, Dysco) else tuple(dysco)
+
+    def submit(self, __fn: Callable[..., T], *args: Any, **kwargs: Any) -> 'Future[T]':
+        for dysco in self.dyscos:
+            __fn = dysco.bind(__fn)
+        return super().submit(__fn, *args, **kwargs)
@@ -0,0 +1,75 @@
+"""Houses the placeholders that stand in for lazily computed variables in scopes."""
+
+import threading
+from typing import Any, Callable, Optional
+
+from dysco.persistent import PersistentMap
+
+#: A sentinel for values that haven't been computed yet.
+unset = object()
+
+#: The number of placeholders that currently exist, which lets ``resolve()`` skip looking for them
+#: when there aren't any. It's only updated while holding ``placeholder_lock``.
+placeholder_count = 0
+placeholder_lock = threading.Lock()
+
+
+class LazyValue:
+    """A variable's value that's computed by ``factory`` the first time that it's read.
+
+    The placeholder itself is stored in the defining scope and memoizes the result, so the factory
+    runs at most once per definition no matter which scopes or threads read it, and any functions
+    bound to those scopes share the result too. The ``teardown`` callback receives the computed
+    value once nothing refers to the placeholder anymore, which normally happens when its scope is
+    destroyed. It isn't called at all if the value was never computed.
+    """
+
+    __slots__ = ('factory', 'lock', 'owner', 'teardown', 'value')
+
+    def __del__(self) -> None:
+        global placeholder_count
+        # The module's globals may already have been cleared when this runs at interpreter exit.
+        if placeholder_lock is not None:
+            with placeholder_lock:
+                placeholder_count -= 1
+        if self.teardown is not None and self.value is not unset:
+            self.teardown(self.value)
+
+    def __init__(self, factory: Callable[[], Any], teardown: Optional[Callable[[Any], Any]] = None):
+        global placeholder_count
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.owner: Optional[int] = None
+        self.teardown = teardown
+        self.value = unset
+        with placeholder_lock:
+            placeholder_count += 1
+
+    def __repr__(self) -> str:
+        state = 'unset' if self.value is unset else repr(self.value)
+        return f'LazyValue({state})'
+
+    def get(self) -> Any:
+        value = self.value
+        if value is unset:
+            # Waiting for the lock would never end if the factory reads the value it's computing.
+            if self.owner == threading.get_ident():
+                raise RuntimeError('The factory of a lazy value read the value that it computes.')
+            with self.lock:
+                # Another thread might have computed the value while this one was waiting.
+                if self.value is unset:
+                    self.owner = threading.get_ident()
+                    try:
+                        self.value = self.factory()
+                    finally:
+                        self.owner = None
+                value = self.value
+        return value
+
+
+def resolve(variables: PersistentMap) -> PersistentMap:
+    """Replace any placeholders in ``variables`` with their values, computing them if necessary."""
+    if not placeholder_count:
+        return variables
+    values = {key: value.get() for key, value in variables.items() if type(value) is LazyValue}
+    return variables.update(values) if values else variables
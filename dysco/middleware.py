@@ -0,0 +1,137 @@
+"""Houses WSGI and ASGI middleware that open a scope with request-derived variables per request."""
+
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Generator, Iterable, Mapping
+
+from dysco import g
+from dysco.dysco import Dysco
+
+#: Computes the variables of a request's scope from a WSGI environ or an ASGI connection scope.
+VariablesFactory = Callable[[Dict[str, Any]], Mapping[Any, Any]]
+
+
+def default_variables(request: Dict[str, Any]) -> Mapping[Any, Any]:
+    return {'request': request}
+
+
+class ScopedResponse:
+    """A WSGI response iterable that produces the application's response inside of a scope.
+
+    Servers only iterate over the response after the application has returned, and the scope that
+    was open while calling the application is closed by then. The response therefore opens the
+    scope again in a copy of the context that it was created in, and keeps it open until the body
+    is exhausted or closed, so that any variables that the body assigns stay visible to it. The
+    application's iterable is closed from inside of the scope at the same time.
+    """
+
+    __slots__ = ('context', 'dysco', 'iterable', 'iterator', 'started', 'variables')
+
+    def __init__(self, iterable: Iterable[bytes], dysco: Dysco, variables: Mapping[Any, Any]):
+        self.context = contextvars.copy_context()
+        self.dysco = dysco
+        self.iterable = iterable
+        self.iterator = self.__iterate()
+        self.started = False
+        self.variables = variables
+
+    def __iter__(self) -> 'ScopedResponse':
+        return self
+
+    def __next__(self) -> bytes:
+        self.started = True
+        return self.context.run(next, self.iterator)
+
+    def close(self) -> None:
+        if self.started:
+            self.context.run(self.iterator.close)
+        else:
+            self.context.run(self.__close)
+
+    def __close(self) -> None:
+        close = getattr(self.iterable, 'close', None)
+        if close is not None:
+            with self.dysco.scope(self.variables):
+                close()
+
+    def __iterate(self) -> Generator[bytes, None, None]:
+        # This frame stays on the stack below the application's code whenever it runs, which makes
+        # it the anchor of the explicit scope with the frame engine.
+        with self.dysco.scope(self.variables):
+            try:
+                for chunk in self.iterable:
+                    yield chunk
+            finally:
+                close = getattr(self.iterable, 'close', None)
+                if close is not None:
+                    close()
+
+
+class ASGIMiddleware:
+    """Runs an ASGI application inside of a scope holding variables derived from each connection.
+
+    The ``variables`` factory is called with the connection scope of every HTTP or WebSocket
+    connection, and its result is defined in an explicit scope of ``dysco``, which defaults to
+    ``g``, for as long as the application handles the connection. It defaults to defining the
+    connection scope as ``request``. Lifespan events are passed through without opening a scope.
+
+    Reads of these variables from anywhere inside of the application resolve against the explicit
+    scope directly rather than walking the application's frames, until the application defines
+    variables of the same instance in any of its own frames. After that, reads walk the frames
+    inside of the scope like any other lookup, but connections that are handled concurrently don't
+    affect each other. Tasks started by the application inherit the scope along with the rest of
+    their context, and reads from them always walk their frames.
+    """
+
+    def __init__(
+        self,
+        app: Callable[..., Awaitable[None]],
+        variables: VariablesFactory = default_variables,
+        *,
+        dysco: Dysco = g,
+    ):
+        self.app = app
+        self.dysco = dysco
+        self.variables = variables
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            await self.app(scope, receive, send)
+            return
+        with self.dysco.scope(self.variables(scope)):
+            await self.app(scope, receive, send)
+
+
+class WSGIMiddleware:
+    """Runs a WSGI application inside of a scope holding variables derived from each request.
+
+    The ``variables`` factory is called with the environ of every request, and its result is
+    defined in an explicit scope of ``dysco``, which defaults to ``g``, while the application is
+    called. It defaults to defining the environ as ``request``. The scope is opened again while the
+    server iterates over and closes the response, unless the response is a list or a tuple that
+    doesn't run any more application code.
+
+    Reads of these variables from anywhere inside of the application resolve against the explicit
+    scope directly rather than walking the application's frames, until the application defines
+    variables of the same instance in any of its own frames. After that, reads walk the frames
+    inside of the scope like any other lookup, but requests that are handled concurrently don't
+    affect each other.
+    """
+
+    def __init__(
+        self,
+        app: Callable[..., Iterable[bytes]],
+        variables: VariablesFactory = default_variables,
+        *,
+        dysco: Dysco = g,
+    ):
+        self.app = app
+        self.dysco = dysco
+        self.variables = variables
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        variables = self.variables(environ)
+        with self.dysco.scope(variables):
+            response = self.app(environ, start_response)
+        if isinstance(response, (list, tuple)):
+            return response
+        return ScopedResponse(response, self.dysco, variables)
@@ -0,0 +1,363 @@
+"""Houses ``PersistentMap``, the immutable mapping that scopes store their variables in.
+
+Updating a ``PersistentMap`` returns a new map and leaves the original untouched, so references to
+a map can be handed out as frozen snapshots for free. Small maps are backed by a plain ``dict``
+that's copied on write, which keeps reads as fast as possible for the handful of variables that a
+typical scope holds. Larger maps switch to a hash array mapped trie (HAMT) in which updates only
+copy the path from the root to the changed entry and share everything else with the original.
+"""
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+#: The maximum number of entries that are stored in a plain ``dict`` before switching to a trie.
+small_map_size = 8
+
+# Each level of the trie consumes this many bits of the key hashes.
+bits_per_level = 5
+level_mask = (1 << bits_per_level) - 1
+hash_mask = (1 << 64) - 1
+
+# A sentinel for missing values that can't collide with anything stored in a map.
+missing = object()
+
+
+def count_bits(number: int) -> int:
+    return bin(number).count('1')
+
+
+# Counts the bits that are set in a number, natively where ``int.bit_count()`` is available.
+popcount: Callable[[int], int] = getattr(int, 'bit_count', count_bits)
+
+
+# A leaf in the trie is a tuple of the key's hash, the key, and the value.
+Leaf = Tuple[int, Hashable, Any]
+Node = Union['BitmapNode', 'CollisionNode']
+
+
+def create_node(shift: int, first: Leaf, second: Leaf) -> Node:
+    """Create the smallest node that holds two leaves with different keys."""
+    if first[0] == second[0]:
+        return CollisionNode(first[0], (first, second))
+
+    first_bit = 1 << ((first[0] >> shift) & level_mask)
+    second_bit = 1 << ((second[0] >> shift) & level_mask)
+    if first_bit == second_bit:
+        return BitmapNode(first_bit, (create_node(shift + bits_per_level, first, second),))
+    if first_bit < second_bit:
+        return BitmapNode(first_bit | second_bit, (first, second))
+    return BitmapNode(first_bit | second_bit, (second, first))
+
+
+class BitmapNode:
+    """A trie node with up to 32 children, which are either leaves or other nodes."""
+
+    __slots__ = ('bitmap', 'children')
+
+    def __init__(self, bitmap: int, children: Tuple[Union[Leaf, Node], ...]):
+        self.bitmap = bitmap
+        self.children = children
+
+    def get(self, shift: int, key_hash: int, key: Hashable) -> Any:
+        bit = 1 << ((key_hash >> shift) & level_mask)
+        if not self.bitmap & bit:
+            return missing
+        child = self.children[popcount(self.bitmap & (bit - 1))]
+        if isinstance(child, tuple):
+            if child[1] is key or (child[0] == key_hash and child[1] == key):
+                return child[2]
+            return missing
+        return child.get(shift + bits_per_level, key_hash, key)
+
+    def set(self, shift: int, leaf: Leaf) -> Tuple[Node, bool]:
+        """Return the node with the leaf added, and whether it added a new key."""
+        bit = 1 << ((leaf[0] >> shift) & level_mask)
+        index = popcount(self.bitmap & (bit - 1))
+        children = self.children
+        if not self.bitmap & bit:
+            new_children = children[:index] + (leaf,) + children[index:]
+            return BitmapNode(self.bitmap | bit, new_children), True
+
+        child = children[index]
+        added = False
+        if isinstance(child, tuple):
+            if child[1] is leaf[1] or (child[0] == leaf[0] and child[1] == leaf[1]):
+                if child[2] is leaf[2]:
+                    return self, False
+                new_child: Union[Leaf, Node] = leaf
+            else:
+                new_child, added = create_node(shift + bits_per_level, child, leaf), True
+        else:
+            new_child, added = child.set(shift + bits_per_level, leaf)
+            if new_child is child:
+                return self, False
+        return (
+            BitmapNode(self.bitmap, children[:index] + (new_child,) + children[index + 1 :]),
+            added,
+        )
+
+    def delete(self, shift: int, key_hash: int, key: Hashable) -> Optional[Union[Leaf, Node]]:
+        """Return the node without the key, a lone leaf that's left, or ``None`` if it's empty.
+
+        The node itself is returned unchanged if it doesn't contain the key.
+        """
+        bit = 1 << ((key_hash >> shift) & level_mask)
+        if not self.bitmap & bit:
+            return self
+        index = popcount(self.bitmap & (bit - 1))
+        children = self.children
+        child = children[index]
+        if isinstance(child, tuple):
+            if not (child[1] is key or (child[0] == key_hash and child[1] == key)):
+                return self
+            new_child: Optional[Union[Leaf, Node]] = None
+        else:
+            new_child = child.delete(shift + bits_per_level, key_hash, key)
+            if new_child is child:
+                return self
+
+        if new_child is None:
+            if len(children) == 1:
+                return None
+            remaining = children[:index] + children[index + 1 :]
+            if len(remaining) == 1 and isinstance(remaining[0], tuple):
+                # Collapse the node so that lone leaves move back up towards the root.
+                return remaining[0]
+            return BitmapNode(self.bitmap & ~bit, remaining)
+        if isinstance(new_child, tuple) and len(children) == 1:
+            return new_child
+        return BitmapNode(self.bitmap, children[:index] + (new_child,) + children[index + 1 :])
+
+    def leaves(self) -> Iterator[Leaf]:
+        for child in self.children:
+            if isinstance(child, tuple):
+                yield child
+            else:
+                yield from child.leaves()
+
+
+class CollisionNode:
+    """A trie node that holds leaves whose keys all share the exact same hash."""
+
+    __slots__ = ('key_hash', 'children')
+
+    def __init__(self, key_hash: int, children: Tuple[Leaf, ...]):
+        self.key_hash = key_hash
+        self.children = children
+
+    def find(self, key: Hashable) -> int:
+        for index, child in enumerate(self.children):
+            if child[1] is key or child[1] == key:
+                return index
+        return -1
+
+    def get(self, shift: int, key_hash: int, key: Hashable) -> Any:
+        if key_hash != self.key_hash:
+            return missing
+        index = self.find(key)
+        return missing if index < 0 else self.children[index][2]
+
+    def set(self, shift: int, leaf: Leaf) -> Tuple[Node, bool]:
+        if leaf[0] != self.key_hash:
+            # Nest this node one level down so that the new leaf can sit alongside it.
+            bit = 1 << ((self.key_hash >> shift) & level_mask)
+            return BitmapNode(bit, (self,)).set(shift, leaf)
+        index = self.find(leaf[1])
+        if index < 0:
+            return CollisionNode(self.key_hash, self.children + (leaf,)), True
+        if self.children[index][2] is leaf[2]:
+            return self, False
+        children = self.children[:index] + (leaf,) + self.children[index + 1 :]
+        return CollisionNode(self.key_hash, children), False
+
+    def delete(self, shift: int, key_hash: int, key: Hashable) -> Optional[Union[Leaf, Node]]:
+        index = self.find(key) if key_hash == self.key_hash else -1
+        if index < 0:
+            return self
+        children = self.children[:index] + self.children[index + 1 :]
+        if len(children) == 1:
+            return children[0]
+        return CollisionNode(self.key_hash, children)
+
+    def leaves(self) -> Iterator[Leaf]:
+        return iter(self.children)
+
+
+class PersistentMap(Mapping):
+    """An immutable mapping with cheap updates that share structure with the original map.
+
+    >>> variables = PersistentMap({'user': 'alice'})
+    >>> updated = variables.set('tenant', 'intoli')
+    >>> dict(variables), dict(updated)
+    ({'user': 'alice'}, {'user': 'alice', 'tenant': 'intoli'})
+    """
+
+    __slots__ = ('small', 'root', 'size')
+
+    def __init__(self, items: Optional[Union[Mapping, Iterable[Tuple[Hashable, Any]]]] = None):
+        # Exactly one of these is used: `small` for maps with only a few entries and `root` for
+        # larger ones. Neither is ever mutated once the map has been constructed.
+        self.small: Optional[Dict[Hashable, Any]] = {}
+        self.root: Optional[Union[Leaf, Node]] = None
+        self.size = 0
+        if items:
+            variables = dict(items)
+            if len(variables) <= small_map_size:
+                self.small = variables
+                self.size = len(variables)
+            else:
+                self.small = None
+                self.root, self.size = build_trie(variables.items())
+
+    def __contains__(self, key: object) -> bool:
+        if self.small is not None:
+            return key in self.small
+        return self.lookup(key) is not missing
+
+    def __getitem__(self, key: Hashable) -> Any:
+        if self.small is not None:
+            return self.small[key]
+        value = self.lookup(key)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[Hashable]:
+        if self.small is not None:
+            return iter(self.small)
+        return (leaf[1] for leaf in iterate_leaves(self.root))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __reduce__(self):
+        return (PersistentMap, (dict(self.items()),))
+
+    def __repr__(self) -> str:
+        return f'PersistentMap({dict(self.items())!r})'
+
+    def delete(self, key: Hashable) -> 'PersistentMap':
+        """Return a new map without ``key``, raising a ``KeyError`` if it isn't present."""
+        if self.small is not None:
+            small = dict(self.small)
+            del small[key]
+            return self.from_small(small)
+
+        key_hash = hash(key) & hash_mask
+        root = self.root
+        if isinstance(root, tuple):
+            if not (root[1] is key or root[1] == key):
+                raise KeyError(key)
+            new_root: Optional[Union[Leaf, Node]] = None
+        else:
+            new_root = root.delete(0, key_hash, key)  # type: ignore
+            if new_root is root:
+                raise KeyError(key)
+        return self.from_root(new_root, self.size - 1)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if self.small is not None:
+            return self.small.get(key, default)
+        value = self.lookup(key)
+        return default if value is missing else value
+
+    def lookup(self, key: Hashable) -> Any:
+        """Return the value for ``key``, or the module's ``missing`` sentinel if there isn't one."""
+        if self.small is not None:
+            return self.small.get(key, missing)
+        root = self.root
+        if root is None:
+            return missing
+        key_hash = hash(key) & hash_mask
+        if isinstance(root, tuple):
+            if root[1] is key or (root[0] == key_hash and root[1] == key):
+                return root[2]
+            return missing
+        return root.get(0, key_hash, key)  # type: ignore
+
+    def set(self, key: Hashable, value: Any) -> 'PersistentMap':
+        """Return a new map in which ``key`` is associated with ``value``."""
+        if self.small is not None:
+            if len(self.small) < small_map_size or key in self.small:
+                small = dict(self.small)
+                small[key] = value
+                return self.from_small(small)
+            items = list(self.small.items())
+            items.append((key, value))
+            root, size = build_trie(items)
+            return self.from_root(root, size)
+
+        root, added = set_leaf(self.root, (hash(key) & hash_mask, key, value))
+        if root is self.root:
+            return self
+        return self.from_root(root, self.size + added)
+
+    def update(
+        self, items: Union[Mapping, Iterable[Tuple[Hashable, Any]]] = (), **kwargs: Any
+    ) -> 'PersistentMap':
+        """Return a new map with the entries from ``items`` and ``kwargs`` added to this one."""
+        if isinstance(items, Mapping):
+            items = items.items()
+        updated = self
+        for key, value in items:
+            updated = updated.set(key, value)
+        for key, value in kwargs.items():
+            updated = updated.set(key, value)
+        return updated
+
+    @staticmethod
+    def from_root(root: Optional[Union[Leaf, Node]], size: int) -> 'PersistentMap':
+        persistent_map = PersistentMap()
+        if root is not None:
+            persistent_map.small = None
+            persistent_map.root = root
+            persistent_map.size = size
+        return persistent_map
+
+    @staticmethod
+    def from_small(small: Dict[Hashable, Any]) -> 'PersistentMap':
+        persistent_map = PersistentMap()
+        persistent_map.small = small
+        persistent_map.size = len(small)
+        return persistent_map
+
+
+def build_trie(items: Iterable[Tuple[Hashable, Any]]) -> Tuple[Optional[Union[Leaf, Node]], int]:
+    root: Optional[Union[Leaf, Node]] = None
+    size = 0
+    for key, value in items:
+        root, added = set_leaf(root, (hash(key) & hash_mask, key, value))
+        size += added
+    return root, size
+
+
+def iterate_leaves(root: Optional[Union[Leaf, Node]]) -> Iterator[Leaf]:
+    if root is None:
+        return iter(())
+    if isinstance(root, tuple):
+        return iter((root,))  # type: ignore
+    return root.leaves()  # type: ignore
+
+
+def set_leaf(root: Optional[Union[Leaf, Node]], leaf: Leaf) -> Tuple[Union[Leaf, Node], bool]:
+    if root is None:
+        return leaf, True
+    if isinstance(root, tuple):
+        if root[1] is leaf[1] or (root[0] == leaf[0] and root[1] == leaf[1]):  # type: ignore
+            return (root, False) if root[2] is leaf[2] else (leaf, False)  # type: ignore
+        return create_node(0, root, leaf), True  # type: ignore
+    return root.set(0, leaf)  # type: ignore
+
+
+#: An empty map that can be shared by everything that needs one.
+empty = PersistentMap()
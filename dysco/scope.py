@@ -1,73 +1,678 @@
+import threading
 import weakref
-from inspect import FrameInfo
+from functools import partial
+from inspect import CO_ASYNC_GENERATOR, CO_COROUTINE, CO_GENERATOR, CO_ITERABLE_COROUTINE
+from itertools import count
+from threading import get_ident
 from types import FrameType
-from typing import TYPE_CHECKING, Any, Dict, Hashable, List, Optional, Set
-from weakref import WeakValueDictionary
+from typing import Dict, Hashable, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
 
-Stack = List[FrameInfo]
+from dysco import stats
+from dysco.persistent import PersistentMap, empty
 
-if TYPE_CHECKING:
-    ScopesByName = WeakValueDictionary[str, 'Scope']
-else:
-    ScopesByName = WeakValueDictionary
+try:
+    from dysco import _speedups  # type: ignore
+except ImportError:  # pragma: no cover
+    _speedups = None  # type: ignore
 
+#: A cached lookup: the namespace's version, the scope that was found, and its distance if known.
+CacheEntry = Tuple[int, Optional['Scope'], Optional[int]]
 
-scopes_by_name: ScopesByName = WeakValueDictionary()
-name_sets_by_frame_id: Dict[int, Set[str]] = {}
+#: The key that each frame's scope table is stored under in ``frame.f_locals``. The angle brackets
+#: guarantee that it can never collide with a real variable name.
+FRAME_SCOPES_KEY = '<dysco.scopes>'
 
+#: The current version of each namespace. A new version is assigned whenever a key is added to or
+#: removed from one of the namespace's scopes, because those are the only changes that can alter
+#: which scope a key resolves to. Versions are never reused, see ``bump_version()``.
+versions: Dict[str, int] = {}
 
-def construct_name(frame: FrameType, namespace: str = '') -> str:
-    hex_id: str = hex(id(frame.f_locals))
-    return f'<dysco.{hex_id}.{namespace}>'
+#: Each thread assigns versions from its own block of ``version_block_size`` consecutive numbers,
+#: and only takes ``version_block_lock`` to claim the next block once its current one runs out.
+version_block_counter = count(1)
+version_block_lock = threading.Lock()
+version_block_size = 1 << 16
+thread_versions = threading.local()
 
+#: Namespaces are numbered rather than derived from object IDs so that they're never reused.
+namespace_counter = count(1)
 
-def destructor(frame_id: int, name: str):
-    name_set = name_sets_by_frame_id[frame_id]
-    name_set.remove(name)
+#: The number of frames that an uncached lookup needs to walk before the frame it started from gets
+#: a cache. Creating a cache costs roughly as much as walking this many frames, so shorter lookups
+#: are left alone unless the frame already has a scope table for other reasons.
+cache_distance = 8
+
+#: The number of entries that a frame's cache can hold before lookups of keys that aren't defined
+#: in any scope stop being cached, so that probing for many distinct keys can't grow it unboundedly.
+max_cached_misses = 256
+
+#: The position of the anchors of closed explicit scopes, which hides them from every lookup.
+closed_position: Tuple[int, Optional[FrameType]] = (0, None)
+
+# Generator and coroutine frames can be resumed from anywhere, so lookups from them can't be cached.
+resumable_flags = CO_GENERATOR | CO_ASYNC_GENERATOR | CO_COROUTINE | CO_ITERABLE_COROUTINE
+
+#: The IDs of the live scope tables that belong to generator or coroutine frames. These frames can
+#: define variables before being resumed inside of an explicit scope, so the frames inside of the
+#: block can't be skipped entirely while there are any, see ``find_block_scope()``. Adding and
+#: discarding IDs are atomic, so creating and destroying tables never needs to take a lock.
+resumable_table_ids: Set[int] = set()
+
+
+def bump_version(namespace: str) -> None:
+    """Invalidate every cached lookup in a namespace."""
+    try:
+        version = next(thread_versions.block)
+    except (AttributeError, StopIteration):
+        with version_block_lock:
+            start = next(version_block_counter) * version_block_size
+        thread_versions.block = iter(range(start, start + version_block_size))
+        version = next(thread_versions.block)
+    # The key is copied to a plain string so that the entry doesn't keep a ``Namespace`` alive.
+    versions[str(namespace)] = version
+
+
+def create_namespace() -> 'Namespace':
+    return Namespace(f'{next(namespace_counter):x}')
+
+
+def find_block_scope(
+    frame: Optional[FrameType],
+    key: Hashable,
+    namespace: str,
+    head: Optional['ExplicitScope'],
+    limit: Optional[int] = None,
+) -> Optional[Union['Scope', 'ExplicitScope']]:
+    """Find the innermost scope that defines ``key`` when explicit scopes are open.
+
+    The frames inside of a block are skipped until ``mark_changed()`` marks its scope, except for
+    generator and coroutine frames, which might have been resumed inside of it.
+    """
+    distance = 0
+    while head is not None:
+        anchor = head.anchor
+        position = head.anchor_position
+        # This repeats the quick check of `is_anchored()`, which passes for almost every lookup.
+        if position[0] == get_ident() and anchor.f_back is position[1] or is_anchored(frame, head):
+            changed = head.changed
+        elif anchor.f_code.co_flags & CO_COROUTINE and position is not closed_position:
+            # The scope was inherited from a coroutine on another stack, see `is_visible()`.
+            changed = True
+        else:
+            head = head.parent
+            continue
+        if changed or resumable_table_ids or limit is not None:
+            while frame is not None and frame is not anchor:
+                if limit is not None and distance > limit:
+                    return None
+                if changed or frame.f_code.co_flags & resumable_flags:
+                    scope = find_existing_scope(frame, namespace)
+                    if scope:
+                        if key in scope.variables:
+                            return scope
+                        if scope.boundary:
+                            return None
+                frame = frame.f_back
+                distance += 1
+            if limit is not None and distance > limit:
+                return None
+        if key in head.variables:
+            return head
+        frame = anchor
+        head = head.parent
+    if frame is None:
+        return None
+    return find_cached_scope(frame, key, namespace, None if limit is None else limit - distance)
+
+
+def find_block_scopes(
+    frame: Optional[FrameType],
+    keys: Iterable[Hashable],
+    namespace: str,
+    head: Optional['ExplicitScope'],
+    limit: Optional[int] = None,
+) -> Dict[Hashable, Union['Scope', 'ExplicitScope']]:
+    """Find the scopes that define each of ``keys`` in the same way as ``find_block_scope()``."""
+    remaining_keys = set(keys)
+    scopes: Dict[Hashable, Union[Scope, ExplicitScope]] = {}
+    distance = 0
+    while head is not None:
+        anchor = head.anchor
+        position = head.anchor_position
+        if position[0] == get_ident() and anchor.f_back is position[1] or is_anchored(frame, head):
+            changed = head.changed
+        elif anchor.f_code.co_flags & CO_COROUTINE and position is not closed_position:
+            changed = True
+        else:
+            head = head.parent
+            continue
+        if changed or resumable_table_ids or limit is not None:
+            while frame is not None and frame is not anchor:
+                if limit is not None and distance > limit:
+                    return scopes
+                if changed or frame.f_code.co_flags & resumable_flags:
+                    scope = find_existing_scope(frame, namespace)
+                    if scope:
+                        variables = scope.variables
+                        for key in [key for key in remaining_keys if key in variables]:
+                            scopes[key] = scope
+                            remaining_keys.remove(key)
+                        if scope.boundary or not remaining_keys:
+                            return scopes
+                frame = frame.f_back
+                distance += 1
+            if limit is not None and distance > limit:
+                return scopes
+        for key in [key for key in remaining_keys if key in head.variables]:
+            scopes[key] = head
+            remaining_keys.remove(key)
+        if not remaining_keys:
+            return scopes
+        frame = anchor
+        head = head.parent
+    if frame is not None:
+        scopes.update(
+            find_cached_scopes(
+                frame, remaining_keys, namespace, None if limit is None else limit - distance
+            )
+        )
+    return scopes
+
+
+def find_cached_scope(
+    frame: FrameType, key: Hashable, namespace: str = '', limit: Optional[int] = None
+) -> Optional['Scope']:
+    """Find the same scope as ``locate_scope()``, but memoize the result on the frame.
+
+    Entries stay valid until the namespace's version changes, and misses are cached as ``None``
+    unless the lookup was limited, because the key could still be defined beyond the limit.
+    """
+    # The version needs to be read before the lookup so that concurrent writes invalidate it.
+    version = versions.get(namespace, 0)
+    frame_scopes = find_frame_scopes(frame)
+    cache_key = (namespace, key)
+    if frame_scopes and frame_scopes.cache:
+        entry = frame_scopes.cache.get(cache_key)
+        if entry and entry[0] == version:
+            scope, scope_distance = entry[1], entry[2]
+            if scope is None or limit is None:
+                return scope
+            # The cached scope is the innermost one, so none are in reach if it's beyond the limit.
+            if scope_distance is not None:
+                return scope if scope_distance <= limit else None
+
+    scope, distance, scope_count = locate_scope(frame, key, namespace, limit)
+    if stats.enabled:
+        stats.current.record_walk(distance, scope_count)
+    if (scope or limit is None) and not frame.f_code.co_flags & resumable_flags:
+        if not frame_scopes and distance >= cache_distance:
+            frame_scopes = FrameScopes(frame)
+        if frame_scopes:
+            cache = frame_scopes.get_cache()
+            if scope or len(cache) < max_cached_misses:
+                cache[cache_key] = (version, scope, distance)
+    return scope
+
+
+def find_cached_scopes(
+    frame: FrameType, keys: Iterable[Hashable], namespace: str = '', limit: Optional[int] = None
+) -> Dict[Hashable, 'Scope']:
+    """Find the scopes that define each of ``keys`` with at most one walk up the stack.
+
+    The results are memoized like by ``find_cached_scope()``, but without their distances.
+    """
+    version = versions.get(namespace, 0)
+    frame_scopes = find_frame_scopes(frame)
+    scopes: Dict[Hashable, Scope] = {}
+    uncached_keys: List[Hashable] = []
+    for key in keys:
+        entry = (
+            frame_scopes.cache.get((namespace, key))
+            if frame_scopes and frame_scopes.cache
+            else None
+        )
+        if entry and entry[0] == version:
+            scope, scope_distance = entry[1], entry[2]
+            if scope is None or limit is None:
+                if scope is not None:
+                    scopes[key] = scope
+                continue
+            if scope_distance is not None:
+                if scope_distance <= limit:
+                    scopes[key] = scope
+                continue
+        uncached_keys.append(key)
+    if not uncached_keys:
+        return scopes
+
+    located_scopes, distance, scope_count = locate_scopes(frame, uncached_keys, namespace, limit)
+    if stats.enabled:
+        stats.current.record_walk(distance, scope_count)
+    if (located_scopes or limit is None) and not frame.f_code.co_flags & resumable_flags:
+        if not frame_scopes and distance >= cache_distance:
+            frame_scopes = FrameScopes(frame)
+        if frame_scopes:
+            cache = frame_scopes.get_cache()
+            for key in uncached_keys:
+                scope = located_scopes.get(key)
+                if scope or (limit is None and len(cache) < max_cached_misses):
+                    cache[(namespace, key)] = (version, scope, None)
+    scopes.update(located_scopes)
+    return scopes
+
+
+def find_defining_scopes(
+    frame: Optional[FrameType],
+    keys: Iterable[Hashable],
+    namespace: str = '',
+    head: Optional['ExplicitScope'] = None,
+    limit: Optional[int] = None,
+) -> Mapping[Hashable, Union['Scope', 'ExplicitScope']]:
+    """Find the innermost scope that defines each of ``keys`` with a single walk up the stack.
+
+    This is equivalent to ``locate_scopes()``, but it also takes explicit scopes into account.
+    """
+    if head is None:
+        return locate_scopes(frame, keys, namespace, limit)[0]
+
+    remaining_keys = set(keys)
+    scopes: Dict[Hashable, Union[Scope, ExplicitScope]] = {}
+    for scope in iterate_scopes(frame, namespace, head, limit):
+        if not remaining_keys:
+            break
+        variables = scope.variables
+        for key in [key for key in remaining_keys if key in variables]:
+            scopes[key] = scope
+            remaining_keys.remove(key)
+    return scopes
 
 
 def find_existing_scope(frame: FrameType, namespace: str = '') -> Optional['Scope']:
-    name_set = name_sets_by_frame_id.get(id(frame.f_locals), set())
-    for name in name_set:
-        candidate_scope = scopes_by_name.get(name)
-        if candidate_scope:
-            frame_scope = frame.f_locals.get(candidate_scope.name)
-            if candidate_scope is frame_scope and namespace == candidate_scope.namespace:
-                return candidate_scope
+    frame_scopes = find_frame_scopes(frame)
+    if frame_scopes:
+        return frame_scopes.scopes.get(namespace)
+    return None
+
+
+def find_frame_scopes(frame: FrameType) -> Optional['FrameScopes']:
+    """Find the scope table for a frame without materializing the frame's local variables."""
+    frame_id = id(frame)
+    shards = frame_scopes_by_frame_id.shards
+    reference = shards[(frame_id >> 4) % len(shards)].get(frame_id)
+    if reference:
+        frame_scopes = reference()
+        # Frame IDs can be reused once a frame is gone, so make sure that the table still belongs
+        # to a frame running the same code before trusting it. A dead frame's table can also still
+        # be registered while the frame's other locals are being finalized, which can run code in
+        # other threads, so tables from other threads are checked against the frame's locals.
+        if (
+            frame_scopes
+            and frame_scopes.code is frame.f_code
+            and (
+                frame_scopes.thread_id == get_ident()
+                or frame.f_locals.get(FRAME_SCOPES_KEY) is frame_scopes
+            )
+        ):
+            return frame_scopes
     return None
 
 
-def find_parent_scope(scope: 'Scope', stack: Stack):
-    for i, frame_info in enumerate(stack):
-        parent_scope = find_existing_scope(frame_info.frame, scope.namespace)
-        if parent_scope and parent_scope is not scope:
-            return parent_scope, stack[i + 1 :]
-    return None, []
+def find_parent_scope(
+    scope: 'Scope', frame: Optional[FrameType]
+) -> Tuple[Optional['Scope'], Optional[FrameType]]:
+    """Walk up the call stack from ``frame`` until a scope other than ``scope`` is found.
 
+    The returned frame is the one to resume the walk from to find the scope after that one.
+    """
+    while frame is not None:
+        parent_scope = find_existing_scope(frame, scope.namespace)
+        if parent_scope:
+            if parent_scope is not scope:
+                return parent_scope, frame.f_back
+            if scope.boundary:
+                break
+        frame = frame.f_back
+    return None, None
 
-class Scope:
-    def __init__(self, frame: FrameType, namespace: str = ''):
-        # Block calling `__init__()` more than once on a given instance.
-        if getattr(self, 'initialized', False):
+
+def find_scope(frame: Optional[FrameType], key: Hashable, namespace: str = '') -> Optional['Scope']:
+    """Return the innermost scope visible from ``frame`` that defines ``key``, if there is one."""
+    return locate_scope(frame, key, namespace)[0]
+
+
+def iterate_scopes(
+    frame: Optional[FrameType],
+    namespace: str = '',
+    head: Optional['ExplicitScope'] = None,
+    limit: Optional[int] = None,
+) -> Iterator[Union['Scope', 'ExplicitScope']]:
+    """Lazily yield the scopes that are visible from ``frame``, starting with the innermost one.
+
+    Explicit scopes are yielded just before the scopes of the frames that opened them.
+    """
+    distance = 0
+    while head is not None:
+        if is_visible(frame, head):
+            while frame is not None and frame is not head.anchor:
+                if limit is not None and distance > limit:
+                    return
+                scope = find_existing_scope(frame, namespace)
+                if scope:
+                    yield scope
+                    if scope.boundary:
+                        return
+                frame = frame.f_back
+                distance += 1
+            if limit is not None and distance > limit:
+                return
+            yield head
+            frame = head.anchor
+        head = head.parent
+    while frame is not None and (limit is None or distance <= limit):
+        scope = find_existing_scope(frame, namespace)
+        if scope:
+            yield scope
+            if scope.boundary:
+                return
+        frame = frame.f_back
+        distance += 1
+
+
+def is_anchored(frame: Optional[FrameType], head: 'ExplicitScope') -> bool:
+    """Return whether the frame that opened an explicit scope is on the stack of ``frame``.
+
+    Where the anchor was last found is remembered, so only moved anchors walk the stack.
+    """
+    anchor = head.anchor
+    position = head.anchor_position
+    back = anchor.f_back
+    if position[0] == get_ident() and back is position[1]:
+        return True
+    # Suspended generators and the bottom frames of other threads have nothing below them.
+    if back is None or position is closed_position:
+        return False
+    while frame is not None:
+        if frame is anchor:
+            # Replace both at once, so that other threads never see them mismatched.
+            head.anchor_position = (get_ident(), back)
+            return True
+        frame = frame.f_back
+    return False
+
+
+def is_visible(frame: Optional[FrameType], head: 'ExplicitScope') -> bool:
+    """Return whether an explicit scope is visible from ``frame``.
+
+    The scopes that coroutines open are also visible to tasks that inherit them with the context.
+    """
+    if is_anchored(frame, head):
+        return True
+    return head.anchor_position is not closed_position and bool(
+        head.anchor.f_code.co_flags & CO_COROUTINE
+    )
+
+
+def locate_scope(
+    frame: Optional[FrameType], key: Hashable, namespace: str = '', limit: Optional[int] = None
+) -> Tuple[Optional['Scope'], int, int]:
+    """Find the same scope as ``find_scope()`` and the numbers of frames and scopes walked.
+
+    Only the frames up to ``limit`` frames above ``frame`` are walked if a limit is given.
+    """
+    distance = 0
+    scope_count = 0
+    while frame is not None and (limit is None or distance <= limit):
+        scope = find_existing_scope(frame, namespace)
+        if scope:
+            scope_count += 1
+            if key in scope.variables:
+                return scope, distance, scope_count
+            if scope.boundary:
+                return None, distance + 1, scope_count
+        frame = frame.f_back
+        distance += 1
+    return None, distance, scope_count
+
+
+def locate_scopes(
+    frame: Optional[FrameType],
+    keys: Iterable[Hashable],
+    namespace: str = '',
+    limit: Optional[int] = None,
+) -> Tuple[Dict[Hashable, 'Scope'], int, int]:
+    """Find the innermost scope that defines each of ``keys`` in a single walk up the stack.
+
+    The numbers of frames and scopes walked are returned alongside the scopes.
+    """
+    remaining_keys = set(keys)
+    scopes: Dict[Hashable, Scope] = {}
+    distance = 0
+    scope_count = 0
+    while frame is not None and remaining_keys and (limit is None or distance <= limit):
+        scope = find_existing_scope(frame, namespace)
+        if scope:
+            scope_count += 1
+            variables = scope.variables
+            for key in [key for key in remaining_keys if key in variables]:
+                scopes[key] = scope
+                remaining_keys.remove(key)
+            if not remaining_keys:
+                break
+            if scope.boundary:
+                distance += 1
+                break
+        frame = frame.f_back
+        distance += 1
+    return scopes, distance, scope_count
+
+
+def mark_changed(frame: FrameType, head: Optional['ExplicitScope']) -> None:
+    """Mark the innermost explicit scope whose block lookups skip ``frame`` as changed."""
+    while head is not None:
+        if head.anchor is not frame and is_visible(frame, head):
+            head.changed = True
             return
-        self.initialized = True
+        head = head.parent
+
+
+def snapshot(
+    frame: Optional[FrameType],
+    namespace: str = '',
+    head: Optional['ExplicitScope'] = None,
+    limit: Optional[int] = None,
+) -> PersistentMap:
+    """Flatten the variables that are visible from ``frame`` into a single persistent map.
+
+    The outermost scope's map is used as the base without copying it, and the maps of any inner
+    scopes are merged into it so that they shadow its variables.
+    """
+    levels = [scope.variables for scope in iterate_scopes(frame, namespace, head, limit)]
+    if not levels:
+        return empty
+    visible = levels.pop()
+    for variables in reversed(levels):
+        visible = visible.update(variables)
+    return visible
+
 
-        self.name = construct_name(frame, namespace)
+class ExplicitScope:
+    """A scope that was opened explicitly by ``Dysco.scope()`` instead of implicitly by a frame.
+
+    Explicit scopes form a chain through their ``parent`` attributes in a context variable.
+    """
+
+    __slots__ = ('anchor', 'anchor_position', 'changed', 'namespace', 'parent', 'variables')
+
+    def __init__(
+        self,
+        anchor: FrameType,
+        namespace: str = '',
+        variables: PersistentMap = empty,
+        parent: Optional['ExplicitScope'] = None,
+    ):
+        self.anchor = anchor
+        # The thread that the anchor is running on, and the frame that it returns to.
+        self.anchor_position: Tuple[int, Optional[FrameType]] = (get_ident(), anchor.f_back)
+        self.changed = False
         self.namespace = namespace
-        self.variables: Dict[Hashable, Any] = {}
+        self.parent = parent
+        self.variables = variables
+
+    def close(self) -> None:
+        """Hide the scope from any contexts that it's still left in after its block exits."""
+        self.anchor_position = closed_position
+
+
+class FrameScopes:
+    """The scopes and the lookup cache of a single frame, which live in the frame's locals."""
+
+    __slots__ = ('__weakref__', 'cache', 'code', 'frame_id', 'resumable', 'scopes', 'thread_id')
+
+    def __del__(self) -> None:
+        # This saves allocating a weak reference callback per table.
+        frame_scopes_by_frame_id.unregister(self.frame_id, self)
+        if self.resumable:
+            resumable_table_ids.discard(id(self))
+        if stats.enabled:
+            stats.current.record_scopes(destroyed=len(self.scopes))
+
+    def __init__(self, frame: FrameType):
+        self.cache: Optional[Dict[Tuple[str, Hashable], CacheEntry]] = None
+        self.code = frame.f_code
+        self.frame_id = id(frame)
+        self.resumable = bool(frame.f_code.co_flags & resumable_flags)
+        self.scopes: Dict[str, Scope] = {}
+        self.thread_id = get_ident()
+        if self.resumable:
+            # The frame's ID could be reused before this table is destroyed, but the table's can't.
+            resumable_table_ids.add(id(self))
+
+        frame_scopes_by_frame_id.register(self.frame_id, self)
+        frame.f_locals[FRAME_SCOPES_KEY] = self
+
+    def get_cache(self) -> Dict[Tuple[str, Hashable], 'CacheEntry']:
+        if self.cache is None:
+            self.cache = {}
+        return self.cache
+
+
+class Namespace(str):
+    """The name of a namespace, which removes the namespace's version once it's no longer in use."""
+
+    __slots__ = ()
+
+    def __del__(self) -> None:
+        # See `LazyValue.__del__()` in `dysco.lazy`.
+        if versions is not None:
+            versions.pop(self, None)
+
 
-        scopes_by_name[self.name] = self
-        frame.f_locals[self.name] = self
-        name_set = name_sets_by_frame_id.get(id(frame.f_locals), set())
-        name_set.add(self.name)
-        name_sets_by_frame_id[id(frame.f_locals)] = name_set
-        weakref.finalize(self, destructor, id(frame.f_locals), self.name)
+class Registry:
+    """Maps ``id(frame)`` to a weak reference to the ``FrameScopes`` table of the frame.
+
+    Only writes lock, and only the shard of the frame, so that it scales on free-threaded builds.
+    """
+
+    __slots__ = ('locks', 'shards')
+
+    def __contains__(self, frame_id: int) -> bool:
+        # Frames are 16-byte aligned, and `dysco._speedups` has to pick shards in the same way.
+        return frame_id in self.shards[(frame_id >> 4) % len(self.shards)]
+
+    def __init__(self, shard_count: int = 64):
+        self.locks = tuple(threading.Lock() for _ in range(shard_count))
+        self.shards: Tuple[Dict[int, 'weakref.ReferenceType[FrameScopes]'], ...] = tuple(
+            {} for _ in range(shard_count)
+        )
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def register(self, frame_id: int, frame_scopes: FrameScopes) -> None:
+        # The reference is created before locking, because allocating it can trigger the garbage
+        # collector and the finalizers of other tables, which unregister them from the same shard.
+        reference = weakref.ref(frame_scopes)
+        index = (frame_id >> 4) % len(self.shards)
+        with self.locks[index]:
+            self.shards[index][frame_id] = reference
+
+    def unregister(self, frame_id: int, frame_scopes: FrameScopes) -> None:
+        """Remove the entry for a table unless it has already been replaced by a newer frame's."""
+        index = (frame_id >> 4) % len(self.shards)
+        shard = self.shards[index]
+        with self.locks[index]:
+            reference = shard.get(frame_id)
+            if reference is not None:
+                registered_frame_scopes = reference()
+                if registered_frame_scopes is frame_scopes or registered_frame_scopes is None:
+                    del shard[frame_id]
+
+
+class Scope:
+    """The variables that a single namespace defines in a single frame.
+
+    Constructing a scope for a frame and namespace that already have one returns the existing one.
+    """
+
+    __slots__ = ('boundary', 'namespace', 'variables')
+
+    boundary: bool
+    namespace: str
+    variables: PersistentMap
 
     def __new__(cls, frame: FrameType, namespace: str = ''):
-        # Attempt to find an existing scope for this frame.
-        existing_scope = find_existing_scope(frame, namespace)
-        if existing_scope:
-            return existing_scope
+        frame_scopes = find_frame_scopes(frame)
+        if frame_scopes:
+            existing_scope = frame_scopes.scopes.get(namespace)
+            if existing_scope:
+                return existing_scope
+        else:
+            frame_scopes = FrameScopes(frame)
+
+        scope = super().__new__(cls)
+        scope.boundary = False
+        scope.namespace = namespace
+        # Variables are replaced rather than mutated, so references to them double as snapshots.
+        scope.variables = empty
+        frame_scopes.scopes[namespace] = scope
+        if stats.enabled:
+            stats.current.record_scopes(created=1)
+        return scope
+
+
+#: The registry of every frame's scope table.
+frame_scopes_by_frame_id = Registry()
+
+# Keep references to the pure-Python implementations so that they can be restored after switching.
+find_existing_scope_python = find_existing_scope
+find_frame_scopes_python = find_frame_scopes
+find_scope_python = find_scope
+locate_scope_python = locate_scope
+locate_scopes_python = locate_scopes
+
+
+def use_speedups(enabled: bool = True) -> bool:
+    """Choose between the compiled and the pure-Python implementations of the lookup routines.
+
+    The compiled implementations from ``dysco._speedups`` are used by default whenever they're
+    available, and this returns whether they're in use after the switch.
+    """
+    global find_existing_scope, find_frame_scopes, find_scope, locate_scope, locate_scopes
+    if enabled and _speedups:
+        shards = frame_scopes_by_frame_id.shards
+        find_existing_scope = partial(_speedups.find_existing_scope, shards)
+        find_frame_scopes = partial(_speedups.find_frame_scopes, shards)
+        find_scope = partial(_speedups.find_scope, shards)
+        locate_scope = partial(_speedups.locate_scope, shards)
+        locate_scopes = partial(_speedups.locate_scopes, shards)
+        return True
+
+    find_existing_scope = find_existing_scope_python
+    find_frame_scopes = find_frame_scopes_python
+    find_scope = find_scope_python
+    locate_scope = locate_scope_python
+    locate_scopes = locate_scopes_python
+    return False
+
 
-        # Otherwise initialize a new scope.
-        return super().__new__(cls)
+use_speedups()
@@ -0,0 +1,217 @@
+"""Houses the opt-in instrumentation that counts and times ``Dysco`` operations.
+
+Nothing is recorded until ``enable()`` is called, and disabled instrumentation only costs a single
+flag check per operation. Enabled instrumentation adds two clock reads and a few counter updates to
+each operation, and no allocations beyond the first call of each kind. The counters are updated
+without any locking, so counts recorded from several threads at once may be slightly undercounted.
+
+``snapshot()`` returns the recorded values as plain dictionaries that can be exported to a metrics
+pipeline, and ``reset()`` starts over from zero.
+
+Passing ``profile=True`` to ``enable()`` additionally attributes the cost of each operation to the
+line of code that performed it, and ``report()`` or ``pstats.Stats(stats.call_site_profile)`` show
+the most expensive call sites.
+"""
+
+import marshal
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+#: Whether operations are currently being recorded, see ``enable()`` and ``disable()``.
+enabled = False
+
+#: Whether the cost of operations is also being attributed to call sites, see ``enable()``.
+profiling = False
+
+#: Holds the number of frames walked by the most recent uncached lookup in each thread while
+#: profiling, so that the walk can be attributed to the call site that triggered it.
+last_walk = threading.local()
+
+#: The number of buckets in each histogram, which is enough for any count that fits in 64 bits.
+histogram_size = 65
+
+
+def bucket(value: int) -> int:
+    """Return the inclusive upper bound of the power of two histogram bucket for ``value``."""
+    return (1 << value.bit_length()) - 1
+
+
+def histogram(counts: List[int]) -> Dict[int, int]:
+    """Map the upper bound of each non-empty bucket to its count."""
+    return {(1 << index) - 1: count for index, count in enumerate(counts) if count}
+
+
+class Stats:
+    """The counters, histograms, and timings that have been recorded since the last reset.
+
+    Operations are recorded by name, and their hits and misses are only counted for lookups where
+    there's a distinction. Walks are only recorded for lookups that had to inspect the stack rather
+    than being answered from a cache, and their histograms map the inclusive upper bound of each
+    power of two bucket to the number of walks that fell into it.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def record_operation(self, operation: str, hit: Optional[bool], duration: int) -> None:
+        # Calls, hits, misses, and the cumulative duration in nanoseconds.
+        counts = self.operations.get(operation)
+        if counts is None:
+            counts = self.operations[operation] = [0, 0, 0, 0]
+        counts[0] += 1
+        if hit is not None:
+            counts[1 if hit else 2] += 1
+        counts[3] += duration
+
+    def record_scopes(self, created: int = 0, destroyed: int = 0) -> None:
+        self.scopes_created += created
+        self.scopes_destroyed += destroyed
+
+    def record_walk(self, frame_count: int, scope_count: int) -> None:
+        # The histograms are indexed by bit length, which is the bucket number for `bucket()`.
+        self.frames_walked[frame_count.bit_length()] += 1
+        self.scopes_traversed[scope_count.bit_length()] += 1
+        if profiling:
+            last_walk.frame_count = frame_count
+
+    def reset(self) -> None:
+        self.operations: Dict[str, List[int]] = {}
+        self.frames_walked: List[int] = [0] * histogram_size
+        self.scopes_traversed: List[int] = [0] * histogram_size
+        self.scopes_created = 0
+        self.scopes_destroyed = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'operations': {
+                operation: {'calls': calls, 'hits': hits, 'misses': misses, 'time_ns': duration}
+                for operation, (calls, hits, misses, duration) in sorted(self.operations.items())
+            },
+            'frames_walked': histogram(self.frames_walked),
+            'scopes_traversed': histogram(self.scopes_traversed),
+            'scopes_created': self.scopes_created,
+            'scopes_destroyed': self.scopes_destroyed,
+        }
+
+
+class CallSiteProfile:
+    """A bounded table that attributes the cost of operations to the lines that performed them.
+
+    Entries are keyed by the file, line number, and function of the call site along with the
+    operation and the key that it accessed. Once the table holds ``size`` entries, any operations
+    from new call sites are aggregated into a single overflow entry so that memory stays bounded.
+
+    The profile can be passed to ``pstats.Stats()`` directly or saved with ``dump_stats()``, in
+    which case each entry appears as a function named after its operation and key.
+    """
+
+    #: The key of the entry that collects operations from call sites that didn't fit in the table.
+    overflow_key = ('~', 0, '<other call sites>', '*', '*')
+
+    def __init__(self, size: int = 1000):
+        self.size = size
+        # Maps call sites to their calls, total nanoseconds, total frames walked, and most frames.
+        self.entries: Dict[Tuple[str, int, str, str, Hashable], List[int]] = {}
+        self.stats: Dict[Tuple[str, int, str], Tuple[int, int, float, float, Dict]] = {}
+
+    def create_stats(self) -> None:
+        """Fill in ``stats`` in the format of ``cProfile.Profile.stats`` for use with ``pstats``."""
+        self.stats = {}
+        for (filename, line_number, function, operation, key), entry in self.entries.items():
+            calls, duration = entry[0], entry[1] / 1e9
+            name = f'{function} [dysco {operation} {key!r}]'
+            self.stats[(filename, line_number, name)] = (calls, calls, duration, duration, {})
+
+    def dump_stats(self, path: str) -> None:
+        """Save the profile in the same format as ``cProfile``."""
+        self.create_stats()
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats, f)
+
+    def record(
+        self,
+        filename: str,
+        line_number: int,
+        function: str,
+        operation: str,
+        key: Hashable,
+        duration: int,
+        frame_count: int,
+    ) -> None:
+        entry_key = (filename, line_number, function, operation, key)
+        entry = self.entries.get(entry_key)
+        if entry is None:
+            if len(self.entries) >= self.size:
+                entry_key = self.overflow_key
+                entry = self.entries.get(entry_key)
+            if entry is None:
+                entry = self.entries[entry_key] = [0, 0, 0, 0]
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] += frame_count
+        if frame_count > entry[3]:
+            entry[3] = frame_count
+
+    def report(self, limit: Optional[int] = 20) -> str:
+        """Format the call sites with the highest total cost as a table."""
+        lines = [
+            f'{"calls":>9} {"total ms":>10} {"ns/call":>9} {"frames":>7} {"max":>5}  call site',
+        ]
+        entries = sorted(self.entries.items(), key=lambda item: item[1][1], reverse=True)
+        for (filename, line_number, function, operation, key), entry in entries[:limit]:
+            calls, duration, frame_count, max_frame_count = entry
+            lines.append(
+                f'{calls:>9} {duration / 1e6:>10.3f} {duration / calls:>9.0f} '
+                f'{frame_count / calls:>7.1f} {max_frame_count:>5}  '
+                f'{filename}:{line_number}({function}) {operation} {key!r}'
+            )
+        return '\n'.join(lines)
+
+
+#: The call site profile that's recorded to while profiling. It's never replaced either.
+call_site_profile = CallSiteProfile()
+
+#: The stats that are being recorded to. The instance is never replaced, so it's safe to hold on to.
+current = Stats()
+
+
+def disable() -> None:
+    """Stop recording operations and profiling, leaving the values recorded so far in place."""
+    global enabled, profiling
+    enabled = False
+    profiling = False
+
+
+def enable(profile: bool = False, profile_size: Optional[int] = None) -> None:
+    """Start recording operations, and optionally attribute their cost to call sites.
+
+    The call site profile holds at most ``profile_size`` entries, or its current size of 1000 by
+    default. Profiling adds roughly another microsecond to each operation, so it's intended for
+    finding hot spots rather than for leaving on permanently.
+    """
+    global enabled, profiling
+    enabled = True
+    profiling = profile
+    if profile_size is not None:
+        call_site_profile.size = profile_size
+
+
+def report(limit: Optional[int] = 20) -> str:
+    """Format the most expensive call sites that have been profiled since the last reset."""
+    return call_site_profile.report(limit)
+
+
+def reset() -> None:
+    """Discard everything that has been recorded so far, including any call site profile."""
+    current.reset()
+    call_site_profile.entries.clear()
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return a copy of everything that has been recorded since the last reset.
+
+    The result maps ``'operations'`` to the calls, hits, misses, and cumulative time in nanoseconds
+    of each operation, ``'frames_walked'`` and ``'scopes_traversed'`` to histograms of the stack
+    walks done by uncached lookups, and ``'scopes_created'`` and ``'scopes_destroyed'`` to counts.
+    """
+    return current.snapshot()
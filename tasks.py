@@ -11,6 +11,26 @@ import dysco
 root_directory = os.path.dirname(os.path.realpath(__file__))
 
 
+@task(
+    help={
+        'output': 'The JSON file to save the results to.',
+        'compare': 'A results file from a previous run to compare the new results against.',
+        'quick': 'Run a reduced set of shorter benchmarks.',
+        'filter': 'Only run benchmarks whose names contain this string.',
+    }
+)
+def bench(c, output='benchmark-results.json', compare=None, quick=False, filter=None):
+    """Run the benchmark suite."""
+    command = f'python -m benchmarks --output {output}'
+    if compare:
+        command += f' --compare {compare}'
+    if quick:
+        command += ' --quick'
+    if filter:
+        command += f' --filter {filter}'
+    c.run(command, pty=True)
+
+
 @task()
 def build(c):
     """Build the package using poetry."""
@@ -41,13 +61,13 @@ def lint(c, all=True, black=False, flake8=False, isort=False, mypy=False):
     """Run miscellaneous linting tasks."""
     all = all and not black and not flake8 and not isort and not mypy
     if all or black:
-        c.run('black --check --diff dysco tests')
+        c.run('black --check --diff benchmarks dysco tests')
     if all or isort:
         c.run('isort --verbose --check-only --diff --recursive src tests')
     if all or flake8:
-        c.run('flake8 dysco tests')
+        c.run('flake8 benchmarks dysco tests')
     if all or mypy:
-        c.run('mypy --ignore-missing-imports dysco tests')
+        c.run('mypy --ignore-missing-imports benchmarks dysco tests')
 
 
 @task(help={'coverage': 'Generate a coverage report.'})
@@ -0,0 +1,16 @@
+import pytest
+
+from dysco import scope
+
+backends = ['python', 'c']
+
+
+@pytest.fixture(autouse=True, params=backends)
+def backend(request):
+    """Run every test against both the pure-Python and the compiled lookup routines."""
+    if request.param == 'c' and not scope.use_speedups(True):
+        pytest.skip('The dysco._speedups extension is not available.')
+    if request.param == 'python':
+        scope.use_speedups(False)
+    yield request.param
+    scope.use_speedups(True)
@@ -0,0 +1,255 @@
+import asyncio
+import contextvars
+import gc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from dysco import Dysco
+from dysco.executors import ScopedThreadPoolExecutor
+
+
+def test_binding_functions_to_the_calling_scope():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    def read():
+        assert dysco.value == 1
+        dysco.worker_value = 2
+        return dysco.worker_value
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(dysco.bind(read)).result() == 2
+        # The worker's scope is removed again once the bound function returns.
+        assert executor.submit(lambda: 'value' in dysco).result() is False
+
+    assert dysco.bind(read)() == 2
+    assert 'worker_value' not in dysco
+
+    async def read_later():
+        await asyncio.sleep(0)
+        return dysco.value
+
+    assert asyncio.run(dysco.bind(read_later)()) == 1
+
+
+def test_decorated_functions_open_new_scopes():
+    dysco = Dysco(engine='context')
+    dysco.outer = 1
+
+    @dysco
+    def check_access(dysco):
+        assert dysco.outer == 1
+        dysco.outer = 2
+        dysco.inner = 3
+        assert dysco.inner == 3
+
+    check_access()
+    assert dysco.outer == 2
+    assert 'inner' not in dysco
+
+
+def test_deleting_in_readonly_mode():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    @dysco(readonly=True)
+    def delete_in_inner_scope(dysco):
+        del dysco['value']
+
+    with pytest.raises(KeyError):
+        delete_in_inner_scope()
+    del dysco.value
+    assert 'value' not in dysco
+    with pytest.raises(AttributeError, match='was not found'):
+        del dysco.value
+
+
+def test_explicit_scopes():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    with dysco.scope(value=2, other=3):
+        assert dysco.get_many(['value', 'other']) == {'value': 2, 'other': 3}
+        dysco.other = 4
+        dysco.new = 5
+        assert dict(dysco.snapshot()) == {'value': 2, 'other': 4, 'new': 5}
+    assert dict(dysco) == {'value': 1}
+
+
+def test_generators_see_the_scopes_that_created_them():
+    dysco = Dysco(engine='context')
+
+    @dysco.generator
+    def stage():
+        dysco.own = 0
+        while True:
+            dysco.own += 1
+            yield dysco.value, dysco.own
+
+    @dysco
+    def create(dysco):
+        dysco.value = 'creator'
+        return stage()
+
+    @dysco
+    def consume(dysco, generator):
+        dysco.value = 'consumer'
+        items = [next(generator)]
+        dysco.own = 'consumer'
+        items.append(next(generator))
+        return items, dysco.own
+
+    assert consume(create()) == ([('creator', 1), ('creator', 2)], 'consumer')
+    assert 'own' not in dysco
+
+
+def test_invalid_engines_are_rejected():
+    with pytest.raises(ValueError):
+        Dysco(engine='something else')
+
+
+def test_iteration_order():
+    dysco = Dysco(engine='context')
+    dysco.outer = 1
+
+    @dysco
+    def check_iteration(dysco):
+        dysco.inner = 2
+        assert list(dysco) == [('inner', 2), ('outer', 1)]
+
+    check_iteration()
+
+
+def test_lazy_values_are_torn_down_with_their_scope():
+    dysco = Dysco(engine='context')
+    torn_down = []
+
+    @dysco
+    def define(dysco):
+        dysco.lazy('value', lambda: 'value', torn_down.append)
+        dysco.lazy('unused', lambda: 'unused', torn_down.append)
+        assert read() == 'value'
+        assert torn_down == []
+
+    @dysco
+    def read(dysco):
+        return dysco.value
+
+    define()
+    gc.collect()
+    assert torn_down == ['value']
+    assert 'value' not in dysco
+
+
+def test_readonly_option():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    @dysco(readonly=True)
+    def check_access(dysco):
+        dysco.inner_value = 2
+        with pytest.raises(AttributeError):
+            dysco.value = 3
+
+    check_access()
+    assert dysco.value == 1
+    assert 'inner_value' not in dysco
+
+
+def test_snapshots_share_the_visible_variables():
+    dysco = Dysco(engine='context')
+    dysco.outer = 1
+
+    @dysco
+    def capture(dysco):
+        dysco.inner = 2
+        snapshot = dysco.snapshot()
+        assert snapshot is dysco.snapshot()
+        return snapshot
+
+    snapshot = capture()
+    assert dict(snapshot) == {'inner': 2, 'outer': 1}
+
+    other_dysco = Dysco(engine='context')
+    other_dysco.restore(snapshot)
+    assert other_dysco.inner == 2
+
+
+def test_setting_many_values():
+    dysco = Dysco(engine='context')
+    dysco.update(outer=1, other=2)
+
+    @dysco
+    def write(dysco):
+        dysco.inner = 3
+        dysco.set_many({'outer': 4, 'inner': 5, 'new': 6})
+        assert dysco.get_many(['outer', 'other', 'inner', 'new']) == {
+            'outer': 4,
+            'other': 2,
+            'inner': 5,
+            'new': 6,
+        }
+        with pytest.raises(KeyError):
+            dysco(readonly=True).set_many({'newer': 7, 'other': 8})
+        assert 'newer' not in dysco
+
+    write()
+    assert dict(dysco) == {'outer': 4, 'other': 2}
+
+
+def test_shadow_option():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    @dysco(shadow=True)
+    def check_access(dysco):
+        dysco.value = 2
+        assert dysco.value == 2
+
+    check_access()
+    assert dysco.value == 1
+
+
+@pytest.mark.asyncio
+async def test_values_propagate_into_tasks():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    async def read_and_write():
+        assert dysco.value == 1
+        dysco.value = 2
+        dysco.task_value = 3
+        return dysco.value
+
+    assert await asyncio.create_task(read_and_write()) == 2
+    assert dysco.value == 1
+    assert 'task_value' not in dysco
+
+
+@pytest.mark.asyncio
+async def test_values_only_propagate_into_executor_callbacks_that_are_bound():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    def read():
+        return dysco.get('value')
+
+    loop = asyncio.get_running_loop()
+    # Unlike tasks, callbacks that run in executor threads don't get a copy of the context.
+    assert await loop.run_in_executor(None, read) is None
+    assert await loop.run_in_executor(None, dysco.bind(read)) == 1
+    assert await loop.run_in_executor(None, contextvars.copy_context().run, read) == 1
+    with ScopedThreadPoolExecutor(max_workers=1, dysco=dysco) as executor:
+        assert await loop.run_in_executor(executor, read) == 1
+
+
+def test_values_propagate_into_copied_contexts():
+    dysco = Dysco(engine='context')
+    dysco.value = 1
+
+    def read():
+        return dysco.value
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(contextvars.copy_context().run, read).result() == 1
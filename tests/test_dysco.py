@@ -1,9 +1,18 @@
+import asyncio
+import contextvars
+import gc
 import pickle
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from sys import version_info
 
 import pytest
 
-from dysco import Dysco, g
+import dysco.scope
+from dysco import Dysco, g, stats
 
 skip_asyncio = version_info[0] <= 3 and version_info[1] <= 5
 
@@ -24,6 +33,111 @@ async def test_async_functions():
     assert g.value == 2
 
 
+@pytest.mark.asyncio
+async def test_async_generators_see_the_scopes_that_created_them():
+    dysco = Dysco()
+
+    @dysco.generator
+    async def stage():
+        for _ in range(2):
+            await asyncio.sleep(0)
+            received = yield dysco.value
+            dysco.received = received
+
+    def create():
+        dysco.value = 'creator'
+        return stage()
+
+    generator = create()
+
+    async def consume():
+        dysco.value = 'consumer'
+        return [await generator.__anext__(), await generator.asend(1)]
+
+    assert await consume() == ['creator', 'creator']
+    await generator.aclose()
+    assert 'received' not in dysco
+
+
+def test_binding_functions_to_the_calling_scope():
+    dysco = Dysco()
+    dysco.value = 1
+
+    def read():
+        assert dysco.value == 1
+        dysco.value = 2
+        dysco.worker_value = 3
+        return dysco.value
+
+    def submit(executor):
+        dysco.inner_value = 4
+        return executor.submit(dysco.bind(read))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert submit(executor).result() == 2
+        assert executor.submit(lambda: 'value' in dysco).result() is False
+
+    # Assignments in the bound function stay in its own scope.
+    assert dysco.value == 1
+    assert 'worker_value' not in dysco
+    assert dysco.bind(lambda: dysco.get_many(['value'])['value'])() == 1
+
+    with dysco.scope(block_value=5):
+        assert dysco.bind(lambda: dysco.block_value)() == 5
+
+
+def test_boundaries_hide_outer_scopes():
+    dysco = Dysco()
+    dysco.value = 1
+
+    def read():
+        return 'value' in dysco, dysco.get_many(['value', 'inner'], default=None), dict(dysco)
+
+    def handle():
+        dysco.inner = 2
+        assert read()[0]
+        dysco.boundary()
+        assert read() == (False, {'value': None, 'inner': 2}, {'inner': 2})
+        # Variables beyond the boundary are invisible to writes too.
+        dysco.value = 3
+        with dysco.scope(block=4):
+            variables = {'value': 3, 'inner': 2, 'block': 4}
+            assert dysco.bind(read)() == (True, {'value': 3, 'inner': 2}, variables)
+
+    handle()
+    assert dysco.value == 1
+
+    with pytest.raises(ValueError):
+        Dysco(engine='context').boundary()
+
+
+def test_bound_functions_only_see_their_snapshot():
+    dysco = Dysco()
+    dysco.value = 1
+    read = dysco.bind(lambda: dict(dysco))
+    dysco.later_value = 2
+    assert read() == {'value': 1}
+
+
+def test_cached_lookups_follow_writes():
+    g.value = 1
+
+    def read_and_write():
+        for _ in range(3):
+            assert g.value == 1
+        g(shadow=True).value = 2
+        for _ in range(3):
+            assert g.value == 2
+        del g.value
+        for _ in range(3):
+            assert g.value == 1
+        del g.value
+        assert 'value' not in g
+
+    read_and_write()
+    assert 'value' not in g
+
+
 def test_calling_dysco_as_a_decorator():
     g.value = 1
 
@@ -91,11 +205,62 @@ def test_contains():
     assert 'hi' in g
 
 
+def test_concurrent_attribute_access():
+    g.shared = 'shared'
+
+    def read_and_write(index):
+        g.index = index
+        for _ in range(1000):
+            assert g.index == index
+            assert 'index' in g
+        return index
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(read_and_write, range(32))) == list(range(32))
+    assert 'index' not in g
+
+
+def test_declaring_keys():
+    dysco = Dysco()
+    dysco.declare('declared', 'declared_lazily')
+    dysco.declare('declared')
+    assert isinstance(dysco, Dysco)
+    assert isinstance(vars(type(dysco))['declared'], property)
+    assert 'declared' not in vars(Dysco)
+    assert not hasattr(dysco, 'declared')
+    with pytest.raises(AttributeError, match='not found'):
+        dysco.declared
+
+    dysco.declared = 1
+    dysco.lazy('declared_lazily', lambda: 2)
+
+    def read_and_write():
+        assert (dysco.declared, dysco.declared_lazily) == (1, 2)
+        dysco(shadow=True).declared = 3
+        assert dysco.declared == dysco['declared'] == 3
+        del dysco.declared
+        assert dysco.declared == 1
+        with pytest.raises(AttributeError, match='read-only'):
+            del dysco(readonly=True).declared
+
+    read_and_write()
+    # The properties only belong to the declaring instance, and variants read through lookups.
+    assert not hasattr(Dysco(), 'declared')
+    assert type(dysco(readonly=True)) is Dysco
+    assert dysco(readonly=True).declared == 1
+
+    for key in ('get', 'scope', '_Dysco_value', '__len__', 'not valid'):
+        with pytest.raises(ValueError):
+            dysco.declare(key)
+
+
 def test_deleting_attributes():
     g.something = 1
     assert hasattr(g, 'something')
     delattr(g, 'something')
     assert not hasattr(g, 'something')
+    with pytest.raises(AttributeError, match='was not found'):
+        del g.something
 
 
 def test_deleting_items():
@@ -103,6 +268,8 @@ def test_deleting_items():
     assert 'something' in g
     del g['something']
     assert 'something' not in g
+    with pytest.raises(KeyError, match='was not found'):
+        del g['something']
 
 
 def test_deleting_items_in_readonly_mode():
@@ -145,12 +312,287 @@ def test_dict_conversion():
     test_inner()
 
 
+def test_explicit_scopes():
+    g.outer = 1
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        g.outer = 2
+        return g.get_many(['outer', 'user', 'request'])
+
+    with g.scope(user='user'):
+        g.request = 'request'
+        assert read(20) == {'outer': 2, 'user': 'user', 'request': 'request'}
+        assert dict(g) == {'user': 'user', 'request': 'request', 'outer': 2}
+        with g.scope({'user': 'other user'}):
+            assert g.user == 'other user'
+            g(shadow=True).request = 'other request'
+        assert g.get_many(['user', 'request']) == {'user': 'user', 'request': 'request'}
+
+        def overwrite():
+            g.user = 'overwritten'
+            with pytest.raises(AttributeError):
+                g(readonly=True).request = 'overwritten'
+
+        overwrite()
+        assert g.user == 'overwritten'
+    assert dict(g) == {'outer': 2}
+
+
+def test_explicit_scope_lookups_skip_inner_frames(monkeypatch):
+    g.value = 1
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        inspected_functions = []
+        find_existing_scope = dysco.scope.find_existing_scope
+
+        def record(frame, namespace):
+            inspected_functions.append(frame.f_code.co_name)
+            return find_existing_scope(frame, namespace)
+
+        monkeypatch.setattr(dysco.scope, 'find_existing_scope', record)
+        values = (g.value, g.other_value)
+        monkeypatch.undo()
+        # Only the frames outside of the block should be inspected, and only with pure Python.
+        assert 'read' not in inspected_functions
+        return values
+
+    with g.scope(other_value=2):
+        assert read(50) == (1, 2)
+
+
+def test_explicit_scope_lookups_ignore_writes_outside_of_the_block(monkeypatch):
+    instance = Dysco()
+
+    def write(depth):
+        if depth:
+            return write(depth - 1)
+        instance.value = 'other request'
+        return instance.value
+
+    def handle():
+        with instance.scope(other_value=2):
+            return write(5)
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        inspected_functions = []
+        find_existing_scope = dysco.scope.find_existing_scope
+
+        def record(frame, namespace):
+            inspected_functions.append(frame.f_code.co_name)
+            return find_existing_scope(frame, namespace)
+
+        monkeypatch.setattr(dysco.scope, 'find_existing_scope', record)
+        values = (instance.get('value'), instance.other_value)
+        monkeypatch.undo()
+        assert 'read' not in inspected_functions
+        return values
+
+    with instance.scope(other_value=1):
+        with ThreadPoolExecutor(1) as executor:
+            assert executor.submit(handle).result() == 'other request'
+        assert read(20) == (None, 1)
+
+
+def test_explicit_scope_bulk_lookups_walk_once(monkeypatch):
+    instance = Dysco()
+    keys = ['value', 'other_value', 'block_value', 'missing_value']
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        inspected_frames = []
+        find_existing_scope = dysco.scope.find_existing_scope
+
+        def record(frame, namespace):
+            if frame.f_code is read.__code__:
+                inspected_frames.append(frame)
+            return find_existing_scope(frame, namespace)
+
+        monkeypatch.setattr(dysco.scope, 'find_existing_scope', record)
+        instance.get('missing_value')
+        single_count = len(inspected_frames)
+        values = instance.get_many(keys, default=None)
+        monkeypatch.undo()
+        # The frames inside of the block are walked once for all of the keys, like for one key.
+        assert single_count == 21
+        assert len(inspected_frames) == 2 * single_count
+        return values
+
+    def handle():
+        instance.other_value = 2
+        return read(20)
+
+    instance.value = 1
+    with instance.scope(block_value=3):
+        assert handle() == {'value': 1, 'other_value': 2, 'block_value': 3, 'missing_value': None}
+
+
+def test_explicit_scope_lookups_see_resumed_generators():
+    dysco = Dysco()
+
+    def read():
+        return dysco.get('value')
+
+    def generate():
+        dysco.value = 1
+        while True:
+            yield dysco.get('value'), read()
+
+    generator = generate()
+    next(generator)
+    with dysco.scope({}):
+        assert next(generator) == (1, 1)
+        with dysco.scope(value=2):
+            assert next(generator) == (1, 1)
+
+
+def test_explicit_scopes_of_suspended_generators_stay_hidden():
+    dysco = Dysco()
+
+    def generate():
+        with dysco.scope(value=1):
+            yield dysco.get('value')
+            yield dysco.get('value'), dysco.get('outer')
+
+    def read():
+        return dysco.get('value'), 'value' in dysco, dict(dysco), dict(dysco.snapshot())
+
+    generator = generate()
+    assert next(generator) == 1
+    assert read() == (None, False, {}, {})
+    # Assignments go to the consumer's own scope rather than the generator's.
+    dysco.outer = 2
+    assert dict(dysco) == {'outer': 2}
+    assert next(generator) == (1, 2)
+
+    # Closing the generator from another context leaves this one's scope behind, but hidden.
+    contextvars.copy_context().run(generator.close)
+    assert read() == (None, False, {'outer': 2}, {'outer': 2})
+
+
+def test_generators_see_the_scopes_that_created_them():
+    dysco = Dysco()
+    log = []
+
+    @dysco.generator
+    def stage(count):
+        dysco.total = 0
+        try:
+            for _ in range(count):
+                try:
+                    dysco.total += (yield dysco.value, 'consumer' in dysco) or 0
+                except ValueError:
+                    log.append(('caught', dysco.value))
+            return dysco.total
+        finally:
+            log.append(('closed', dysco.value, dysco.total))
+
+    def create():
+        dysco.value = 'creator'
+        return stage(3)
+
+    def consume(depth, generator):
+        if depth:
+            return consume(depth - 1, generator)
+        dysco.value = 'consumer'
+        dysco.consumer = True
+        with dysco.scope(value='explicit', consumer=True):
+            items = [next(generator), generator.send(1)]
+        items.append(generator.throw(ValueError()))
+        with pytest.raises(StopIteration) as stop:
+            generator.send(2)
+        return items, stop.value.value
+
+    stats.reset()
+    stats.enable()
+    try:
+        items, total = consume(50, create())
+        walks = stats.snapshot()['frames_walked']
+    finally:
+        stats.disable()
+        stats.reset()
+    assert items == [('creator', False)] * 3 and total == 3
+    assert log == [('caught', 'creator'), ('closed', 'creator', 3)]
+    assert max(walks) <= 3 and 'total' not in dysco
+
+    # Closing a generator early runs its cleanup against its own scopes too.
+    log.clear()
+    generator = create()
+    next(generator)
+    generator.close()
+    assert log == [('closed', 'creator', 0)]
+
+    dysco.value = 'bound'
+    bound_stage = dysco.bind(stage)
+    dysco.value = 'later'
+    assert [value for value, _ in bound_stage(2)] == ['bound'] * 2
+    with pytest.raises(TypeError):
+        dysco.generator(create)
+
+
+def test_getting_values_with_defaults():
+    g.value = 1
+    g.lazy('computed', lambda: 2)
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        assert g.get('value') == 1 and g.get('computed') == 2
+        # Repeated misses are cached, so make sure that defining the key is still noticed.
+        for _ in range(3):
+            assert g.get('undefined') is None
+            assert g.get('undefined', 3) == 3
+        g.undefined = 4
+        assert g.get('undefined') == 4
+        del g.undefined
+        assert g.get('undefined', 5) == 5
+
+    read(20)
+
+
+def test_getting_many_values():
+    g.outer = 1
+
+    def read():
+        g.inner = 2
+        assert g.get_many(['inner', 'outer']) == {'inner': 2, 'outer': 1}
+        with pytest.raises(KeyError):
+            g.get_many(['inner', 'undefined'])
+        assert g.get_many(['undefined'], default=None) == {'undefined': None}
+
+    read()
+
+
 def test_hasattr():
     assert not hasattr(g, 'hi')
     g['hi'] = True
     assert hasattr(g, 'hi')
 
 
+def test_instances_share_one_scope_table_per_frame():
+    instances = [Dysco() for _ in range(3)]
+    for index, instance in enumerate(instances):
+        instance.value = index
+    instances[0](shadow=True).other_value = 3
+
+    frame = sys._getframe()
+    frame_scopes = dysco.scope.find_frame_scopes(frame)
+    # Every instance and variant keeps its scope in the frame's single table.
+    dysco_keys = [key for key in frame.f_locals if key.startswith('<dysco')]
+    assert dysco_keys == [dysco.scope.FRAME_SCOPES_KEY]
+    assert frame.f_locals[dysco.scope.FRAME_SCOPES_KEY] is frame_scopes
+    values = sorted(scope.variables['value'] for scope in frame_scopes.scopes.values())
+    assert values == [0, 1, 2]
+    assert [instance.value for instance in instances] == [0, 1, 2]
+    assert instances[0].other_value == 3
+
+
 def test_item_tuple_access():
     g[(1, 'hi')] = True
     assert g[(1, 'hi')] == True
@@ -171,6 +613,183 @@ def test_keyword_only_initialization():
         g(lambda: None, True)
 
 
+def test_lazy_values():
+    dysco = Dysco()
+    calls = []
+    torn_down = []
+
+    def open_session():
+        calls.append('session')
+        return 'session'
+
+    def define():
+        dysco.lazy('session', open_session, torn_down.append)
+        dysco.lazy('unused', lambda: calls.append('unused'), torn_down.append)
+        assert 'session' in dysco
+        assert calls == []
+
+        def read():
+            return dysco.session
+
+        assert read() == dysco['session'] == 'session'
+        assert dysco.get_many(['session']) == {'session': 'session'}
+        assert dysco.bind(read)() == 'session'
+        assert calls == ['session']
+
+    define()
+    gc.collect()
+    # Only the value that was computed is torn down once the scope is gone.
+    assert torn_down == ['session']
+
+
+def test_lazy_values_are_computed_in_snapshots():
+    dysco = Dysco()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'value': 1}
+
+    dysco.lazy('config', compute)
+    dysco.value = 2
+    read = dysco.bind(lambda: dysco.config)
+    assert calls == []
+    snapshot = dysco.snapshot()
+    assert dict(snapshot) == {'config': {'value': 1}, 'value': 2}
+    assert pickle.loads(pickle.dumps(snapshot)) == snapshot
+    # Bound functions and later reads share the value that the snapshot computed.
+    assert read() is dysco.config is snapshot['config']
+    assert calls == [1]
+
+
+def test_lazy_values_can_not_read_themselves():
+    dysco = Dysco()
+    dysco.lazy('value', lambda: dysco.value + 1)
+    with pytest.raises(RuntimeError, match='read the value'):
+        dysco.value
+    # The factory runs again on the next read after it failed.
+    with pytest.raises(RuntimeError, match='read the value'):
+        dysco.snapshot()
+
+
+def test_lazy_values_are_computed_once_across_threads():
+    dysco = Dysco()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.01)
+        return 'value'
+
+    def read():
+        barrier.wait()
+        return dysco.value
+
+    dysco.lazy('value', compute)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(dysco.bind(read)) for _ in range(8)]
+        assert [future.result() for future in futures] == ['value'] * 8
+    assert calls == [1]
+
+
+def test_lazy_values_follow_the_readonly_and_shadow_options():
+    dysco = Dysco()
+    torn_down = []
+    dysco.lazy('value', lambda: 'outer', torn_down.append)
+
+    def define_readonly():
+        with pytest.raises(KeyError):
+            dysco(readonly=True).lazy('value', lambda: 'readonly')
+
+    def define_shadow():
+        dysco(shadow=True).lazy('value', lambda: 'inner')
+        assert dysco.value == 'inner'
+
+    def define():
+        dysco.lazy('value', lambda: 'replaced', torn_down.append)
+
+    define_readonly()
+    define_shadow()
+    gc.collect()
+    assert torn_down == []
+    assert dysco.value == 'outer'
+    define()
+    gc.collect()
+    assert torn_down == ['outer']
+    assert dict(dysco) == {'value': 'replaced'}
+    del dysco.value
+    gc.collect()
+    assert torn_down == ['outer', 'replaced']
+
+
+def test_max_depth_option():
+    dysco = Dysco()
+    dysco.value = 1
+    shallow_dysco = dysco(max_depth=1)
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        return (
+            shallow_dysco.get_many(['value'], default=None)['value'],
+            'value' in shallow_dysco,
+            dysco.value,
+        )
+
+    assert read(0) == (1, True, 1)
+    assert read(5) == (None, False, 1)
+    # Reads through the unlimited instance cache the scope, which mustn't leak past the limit.
+    assert read(5) == (None, False, 1)
+
+    def write():
+        shallow_dysco.value = 2
+        shallow_dysco.other = 3
+        return dysco.value, dysco.other
+
+    assert write() == (2, 3)
+    assert dysco.value == 2
+
+    with pytest.raises(ValueError):
+        Dysco(max_depth=-1)
+    with pytest.raises(ValueError):
+        Dysco(engine='context', max_depth=1)
+
+
+def test_max_depth_counts_frames_inside_explicit_scopes():
+    dysco = Dysco()
+    shallow_dysco = dysco(max_depth=2)
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        return shallow_dysco.get('value'), 'value' in shallow_dysco
+
+    def write_elsewhere():
+        dysco.unrelated = True
+
+    with dysco.scope(value=1):
+        assert read(0) == (1, True)
+        assert read(5) == (None, False)
+        # Visibility mustn't depend on whether the version changed since the block was opened.
+        write_elsewhere()
+        assert read(5) == (None, False)
+        assert read(0) == (1, True)
+
+
+def test_new_instances_never_see_old_variables():
+    dyscos = []
+    for _ in range(100):
+        dysco = Dysco()
+        assert 'value' not in dysco
+        dysco.value = 1
+        # Drop every other instance so that their IDs can be reused by the next ones.
+        if len(dyscos) % 2:
+            del dysco
+        else:
+            dyscos.append(dysco)
+
+
 def test_pickling_fails():
     with pytest.raises(pickle.PickleError):
         pickle.dumps(g)
@@ -191,6 +810,26 @@ def test_readonly_option():
     assert 'inner_value' not in dysco
 
 
+def test_restoring_snapshots_in_other_threads():
+    g.outer = 1
+
+    def capture():
+        g.inner = 2
+        g.outer = 3
+        return g.snapshot()
+
+    snapshot = capture()
+    assert dict(snapshot) == {'inner': 2, 'outer': 3}
+
+    def restore():
+        assert 'inner' not in g
+        g.restore(snapshot)
+        return g.inner, g.outer
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(restore).result() == (2, 3)
+
+
 def test_scope_in_loops():
     g.hello = -1
     for i in range(20):
@@ -198,6 +837,15 @@ def test_scope_in_loops():
         g.hello = i
 
 
+def test_snapshots_are_frozen():
+    g.value = 1
+    snapshot = g.snapshot()
+    g.value = 2
+    g.other_value = 3
+    assert snapshot['value'] == 1
+    assert 'other_value' not in snapshot
+
+
 def test_scope_isolation():
     g.first = 1
     g.second = 2
@@ -227,6 +875,25 @@ def test_scope_isolation():
     assert g.second == 2
 
 
+def test_setting_many_values():
+    g.outer = 1
+
+    def write():
+        g.set_many({'outer': 2, 'inner': 3})
+        g.update([('other', 4)], another=5)
+        assert dict(g) == {'inner': 3, 'other': 4, 'another': 5, 'outer': 2}
+
+        with pytest.raises(KeyError):
+            g(readonly=True).set_many({'new': 6, 'outer': 7})
+        assert 'new' not in g
+
+        g(shadow=True).set_many({'outer': 8})
+        assert g.outer == 8
+
+    write()
+    assert dict(g) == {'outer': 2}
+
+
 def test_shadow_option():
     with pytest.raises(ValueError):
         dysco = Dysco(readonly=True, shadow=True)
@@ -266,3 +933,19 @@ def test_stacklevel_option():
     nested_set('b', 1)
     with pytest.raises(KeyError):
         get('b')
+
+
+def test_variants_are_reused():
+    dysco = Dysco()
+    readonly_dysco = dysco(readonly=True)
+    assert dysco(readonly=True) is readonly_dysco
+    assert dysco(readonly=True, stacklevel=1) is readonly_dysco
+    assert dysco(shadow=True) is not readonly_dysco
+    assert dysco(readonly=True, stacklevel=2) is not readonly_dysco
+    assert readonly_dysco(shadow=True) is readonly_dysco(shadow=True)
+
+    # The variants don't keep unused instances alive.
+    reference = weakref.ref(dysco)
+    del dysco, readonly_dysco
+    gc.collect()
+    assert reference() is None
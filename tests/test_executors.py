@@ -0,0 +1,89 @@
+import pickle
+
+import pytest
+
+from dysco import Dysco, g
+from dysco.executors import (
+    ScopedCall,
+    ScopedProcessPoolExecutor,
+    ScopedThreadPoolExecutor,
+    diff,
+    find_reference,
+)
+from dysco.persistent import PersistentMap
+
+context_dysco = Dysco(engine='context')
+
+
+def read_in_process(offset):
+    return g.value + offset, g.get_many(['inner'], default=None)['inner'], context_dysco.value
+
+
+def identify_large_value():
+    return id(g.large_value)
+
+
+def test_submitted_functions_see_the_submitting_scope():
+    g.value = 1
+
+    def read(offset):
+        return g.value + g.get_many(['inner'], default=0)['inner'] + offset
+
+    def submit(executor):
+        g.inner = 2
+        return executor.submit(read, 1), list(executor.map(read, [10, 20]))
+
+    with ScopedThreadPoolExecutor(max_workers=2) as executor:
+        future, mapped = submit(executor)
+        assert future.result() == 4
+        assert mapped == [13, 23]
+        assert executor.submit(read, 0).result() == 1
+
+
+def test_several_instances_can_be_propagated():
+    frame_dysco = Dysco()
+    context_dysco = Dysco(engine='context')
+    frame_dysco.value = 1
+    context_dysco.value = 2
+
+    def read():
+        return frame_dysco.value, context_dysco.value
+
+    with ScopedThreadPoolExecutor(max_workers=1, dysco=[frame_dysco, context_dysco]) as executor:
+        assert executor.submit(read).result() == (1, 2)
+
+
+def test_snapshots_are_sent_as_deltas():
+    large_value = list(range(1000))
+    base = PersistentMap({'large_value': large_value, 'removed': 1, 'value': 1})
+    snapshot = base.delete('removed').set('value', 2).set('large_value', large_value)
+    assert diff(base, base) == ({}, ())
+    assert diff(base, snapshot) == ({'value': 2}, ('removed',))
+
+    call = ScopedCall(read_in_process, ((find_reference(g), diff(base, snapshot)),))
+    assert len(pickle.dumps(call)) < len(pickle.dumps(large_value))
+
+
+def test_submitted_functions_see_the_submitting_scope_in_other_processes():
+    g.value = 1
+    g.large_value = list(range(1000))
+    context_dysco.value = 'context'
+
+    def submit(executor):
+        g.inner = 2
+        return executor.submit(read_in_process, 1), list(executor.map(read_in_process, [10, 20]))
+
+    with ScopedProcessPoolExecutor(max_workers=1, dysco=[g, context_dysco]) as executor:
+        future, mapped = submit(executor)
+        assert future.result() == (2, 2, 'context')
+        assert mapped == [(11, 2, 'context'), (21, 2, 'context')]
+        assert executor.submit(read_in_process, 0).result() == (1, None, 'context')
+        # The large value is only sent when the worker starts, so every task sees the same copy.
+        assert executor.submit(identify_large_value).result() == (
+            executor.submit(identify_large_value).result()
+        )
+
+
+def test_unimportable_instances_are_rejected():
+    with pytest.raises(ValueError):
+        ScopedProcessPoolExecutor(dysco=Dysco())
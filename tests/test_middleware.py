@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from dysco import Dysco, stats
+from dysco.middleware import ASGIMiddleware, ScopedResponse, WSGIMiddleware
+
+
+def call_at_depth(depth, function):
+    if depth:
+        return call_at_depth(depth - 1, function)
+    return function()
+
+
+def test_asgi_connections_see_their_variables():
+    dysco = Dysco()
+    sent = []
+
+    async def app(scope, receive, send):
+        async def read():
+            return dysco.request['path'], dysco.get('trace_id')
+
+        if scope['type'] == 'lifespan':
+            await send(dysco.get('request'))
+        else:
+            await send(await asyncio.gather(read(), asyncio.create_task(read())))
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = ASGIMiddleware(
+        app,
+        lambda scope: {'request': scope, 'trace_id': dict(scope['headers'])[b'x-trace-id']},
+        dysco=dysco,
+    )
+
+    async def serve():
+        await middleware({'type': 'lifespan'}, None, send)
+        await asyncio.gather(
+            middleware(
+                {'type': 'http', 'path': '/a', 'headers': [(b'x-trace-id', b'1')]}, None, send
+            ),
+            middleware(
+                {'type': 'http', 'path': '/b', 'headers': [(b'x-trace-id', b'2')]}, None, send
+            ),
+        )
+
+    asyncio.run(serve())
+    assert sent == [None, [('/a', b'1')] * 2, [('/b', b'2')] * 2]
+    assert 'request' not in dysco
+
+
+@pytest.mark.parametrize('engine', ['frame', 'context'])
+def test_wsgi_requests_see_their_variables(engine):
+    dysco = Dysco(engine=engine)
+    closed = []
+
+    def body():
+        try:
+            yield call_at_depth(20, lambda: dysco.request['PATH_INFO']).encode()
+            yield dysco.get('user', 'anonymous').encode()
+        finally:
+            closed.append(dysco.get('request'))
+
+    def app(environ, start_response):
+        start_response('200 OK', [])
+        assert call_at_depth(20, lambda: dysco.user) == 'user'
+        return body() if environ['PATH_INFO'] == '/stream' else [b'static']
+
+    middleware = WSGIMiddleware(
+        app, lambda environ: {'request': environ, 'user': 'user'}, dysco=dysco
+    )
+    environ = {'PATH_INFO': '/stream'}
+    response = middleware(environ, lambda status, headers: None)
+    assert isinstance(response, ScopedResponse)
+    assert list(response) == [b'/stream', b'user']
+    response.close()
+    assert closed == [environ]
+    assert middleware({'PATH_INFO': '/'}, lambda status, headers: None) == [b'static']
+    assert 'request' not in dysco
+
+
+def test_wsgi_reads_do_not_walk_the_stack():
+    dysco = Dysco()
+
+    def app(environ, start_response):
+        return [call_at_depth(50, lambda: dysco.request)]
+
+    stats.reset()
+    stats.enable()
+    try:
+        environ = {}
+        assert WSGIMiddleware(app, dysco=dysco)(environ, None) == [environ]
+        snapshot = stats.snapshot()
+    finally:
+        stats.disable()
+        stats.reset()
+    assert snapshot['frames_walked'] == {}
+    assert snapshot['operations']['get']['hits'] == 1
+
+
+@pytest.mark.parametrize('engine', ['frame', 'context'])
+def test_wsgi_bodies_can_assign_variables(engine):
+    dysco = Dysco(engine=engine)
+    closed = []
+
+    def body():
+        dysco.count = 0
+        try:
+            for _ in range(3):
+                dysco.count += 1
+                yield call_at_depth(
+                    20, lambda: f'{dysco.request["PATH_INFO"]}{dysco.count}'
+                ).encode()
+        finally:
+            closed.append(dysco.request)
+
+    class Closeable:
+        def __iter__(self):
+            return iter([b'closeable'])
+
+        def close(self):
+            closed.append(dysco.request)
+
+    def app(environ, start_response):
+        return Closeable() if environ['PATH_INFO'] == '/closeable' else body()
+
+    middleware = WSGIMiddleware(app, dysco=dysco)
+    response = middleware({'PATH_INFO': '/'}, None)
+    assert list(response) == [b'/1', b'/2', b'/3']
+    response.close()
+
+    response = middleware({'PATH_INFO': '/early'}, None)
+    assert next(response) == b'/early1'
+    response.close()
+
+    environ = {'PATH_INFO': '/closeable'}
+    middleware(environ, None).close()
+    assert closed == [{'PATH_INFO': '/'}, {'PATH_INFO': '/early'}, environ]
+    assert 'count' not in dysco and 'request' not in dysco
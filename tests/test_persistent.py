@@ -0,0 +1,65 @@
+import pickle
+import random
+
+import pytest
+
+from dysco.persistent import PersistentMap, small_map_size
+
+
+class CollidingKey:
+    """A key with a deliberately terrible hash function to force hash collisions."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, CollidingKey) and other.value == self.value
+
+    def __hash__(self):
+        return self.value % 3
+
+
+def test_deleting_missing_keys_raises_key_errors():
+    with pytest.raises(KeyError):
+        PersistentMap({'a': 1}).delete('b')
+    with pytest.raises(KeyError):
+        PersistentMap({index: index for index in range(100)}).delete('b')
+
+
+def test_maps_match_dicts_through_random_updates():
+    randomizer = random.Random(0)
+    expected = {}
+    persistent_map = PersistentMap()
+    history = []
+    for _ in range(2000):
+        if expected and randomizer.random() < 0.3:
+            key = randomizer.choice(list(expected))
+            del expected[key]
+            persistent_map = persistent_map.delete(key)
+        else:
+            key = randomizer.choice(
+                [randomizer.randrange(100), CollidingKey(randomizer.randrange(20))]
+            )
+            expected[key] = randomizer.random()
+            persistent_map = persistent_map.set(key, expected[key])
+        history.append((persistent_map, dict(expected)))
+
+    # Every intermediate version should still be intact.
+    for persistent_map, expected in history:
+        assert len(persistent_map) == len(expected)
+        assert dict(persistent_map.items()) == expected
+        assert all(key in persistent_map for key in expected)
+
+
+def test_maps_can_be_pickled():
+    persistent_map = PersistentMap({index: str(index) for index in range(small_map_size * 4)})
+    assert pickle.loads(pickle.dumps(persistent_map)) == persistent_map
+
+
+def test_updates_leave_the_original_untouched():
+    original = PersistentMap({'a': 1})
+    updated = original.set('b', 2).update({'c': 3}, d=4)
+    assert dict(original) == {'a': 1}
+    assert dict(updated) == {'a': 1, 'b': 2, 'c': 3, 'd': 4}
+    assert updated.delete('a').get('a') is None
+    assert original['a'] == 1
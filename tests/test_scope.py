@@ -1,7 +1,21 @@
 import gc
 import inspect
+import os
+import threading
+import tracemalloc
 
-from dysco.scope import Scope, find_parent_scope, scopes_by_name
+import dysco.scope
+from dysco import Dysco
+from dysco.persistent import empty
+from dysco.scope import (
+    FRAME_SCOPES_KEY,
+    ExplicitScope,
+    Scope,
+    find_frame_scopes,
+    find_parent_scope,
+    frame_scopes_by_frame_id,
+    iterate_scopes,
+)
 
 
 def test_f_local_keys_are_invalid_variable_names():
@@ -12,6 +26,194 @@ def test_f_local_keys_are_invalid_variable_names():
     assert name.startswith('<dysco.')
 
 
+def test_distant_lookups_are_cached():
+    outer_scope = Scope(inspect.currentframe())
+    outer_scope.variables = outer_scope.variables.set('value', 1)
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        frame = inspect.currentframe()
+        assert dysco.scope.find_cached_scope(frame, 'value') is outer_scope
+        return find_frame_scopes(frame)
+
+    assert read(0) is None
+    frame_scopes = read(dysco.scope.cache_distance)
+    assert frame_scopes.cache[('', 'value')][1] is outer_scope
+
+
+def test_limited_lookups_use_the_cache(monkeypatch):
+    outer_scope = Scope(inspect.currentframe())
+    outer_scope.variables = outer_scope.variables.set('value', 1)
+    distance = 2 * dysco.scope.cache_distance + 1
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        frame = inspect.currentframe()
+        assert dysco.scope.find_cached_scope(frame, 'value') is outer_scope
+        assert dysco.scope.find_cached_scope(frame, 'missing') is None
+
+        # Every one of these has to be answered from the cache without walking the stack.
+        monkeypatch.setattr(dysco.scope, 'locate_scope', None)
+        monkeypatch.setattr(dysco.scope, 'locate_scopes', None)
+        results = [
+            dysco.scope.find_cached_scope(frame, 'value', limit=distance),
+            dysco.scope.find_cached_scope(frame, 'value', limit=distance - 1),
+            dysco.scope.find_cached_scope(frame, 'missing', limit=distance - 1),
+            dysco.scope.find_cached_scopes(frame, ['value', 'missing'], limit=distance),
+            dysco.scope.find_cached_scopes(frame, ['value', 'missing'], limit=distance - 1),
+        ]
+        monkeypatch.undo()
+        return results
+
+    assert read(distance - 1) == [outer_scope, None, None, {'value': outer_scope}, {}]
+
+
+def test_coroutines_driven_from_different_callers_are_not_cached():
+    instance = Dysco()
+    results = []
+
+    class Suspend:
+        def __await__(self):
+            yield
+
+    async def read():
+        while True:
+            results.append(instance.value)
+            await Suspend()
+
+    coroutine = read()
+
+    def send(depth):
+        if depth:
+            return send(depth - 1)
+        coroutine.send(None)
+
+    def drive(value=None):
+        if value is not None:
+            instance(shadow=True).value = value
+        send(dysco.scope.cache_distance)
+
+    instance.value = 1
+    drive()
+    drive(2)
+    drive()
+    coroutine.close()
+    assert results == [1, 2, 1]
+
+
+def test_distant_misses_are_cached_until_the_key_is_defined():
+    def read(depth, keys):
+        if depth:
+            return read(depth - 1, keys)
+        frame = inspect.currentframe()
+        assert dysco.scope.find_cached_scope(frame, 'value', 'misses') is None
+        assert dysco.scope.find_cached_scope(frame, 'value', 'misses', limit=0) is None
+        version, scope, _ = find_frame_scopes(frame).cache[('misses', 'value')]
+        assert scope is None and version == dysco.scope.versions.get('misses', 0)
+
+        scope = Scope(frame, namespace='misses')
+        scope.variables = scope.variables.set('value', 1)
+        dysco.scope.bump_version('misses')
+        assert dysco.scope.find_cached_scope(frame, 'value', 'misses') is scope
+
+        for key in keys:
+            dysco.scope.find_cached_scope(frame, key, 'misses')
+        return find_frame_scopes(frame).cache
+
+    cache = read(dysco.scope.cache_distance, range(2 * dysco.scope.max_cached_misses))
+    assert len(cache) == dysco.scope.max_cached_misses
+
+
+def test_iterate_scopes_places_explicit_scopes_inside_their_anchors():
+    frame = inspect.currentframe()
+    outer_scope = Scope(frame)
+    explicit_scope = ExplicitScope(frame)
+
+    def iterate():
+        inner_scope = Scope(inspect.currentframe())
+        return inner_scope, list(iterate_scopes(inspect.currentframe(), '', explicit_scope))
+
+    inner_scope, scopes = iterate()
+    assert scopes[:3] == [inner_scope, explicit_scope, outer_scope]
+
+
+def test_locate_scope_counts_the_frames_and_scopes_walked():
+    outer_scope = Scope(inspect.currentframe())
+    outer_scope.variables = outer_scope.variables.set('value', 1)
+
+    def locate():
+        return dysco.scope.locate_scope(inspect.currentframe(), 'value')
+
+    assert locate() == (outer_scope, 1, 1)
+    assert dysco.scope.locate_scope(inspect.currentframe(), 'missing')[0] is None
+
+
+def test_locate_scope_stops_at_boundaries_and_limits():
+    outer_scope = Scope(inspect.currentframe())
+    outer_scope.variables = outer_scope.variables.set('value', 1)
+
+    def locate(boundary, limit):
+        boundary_scope = Scope(inspect.currentframe())
+        boundary_scope.boundary = boundary
+
+        def inner():
+            frame = inspect.currentframe()
+            return (
+                dysco.scope.locate_scope(frame, 'value', '', limit),
+                dysco.scope.locate_scopes(frame, ['value'], '', limit),
+                list(iterate_scopes(frame, '', None, limit)),
+            )
+
+        return boundary_scope, inner()
+
+    boundary_scope, (located, (scopes, *counts), iterated) = locate(True, None)
+    assert located == (None, 2, 1) and scopes == {} and counts == [2, 1]
+    assert iterated == [boundary_scope]
+
+    boundary_scope, (located, (scopes, *counts), iterated) = locate(False, 1)
+    assert located == (None, 2, 1) and scopes == {} and counts == [2, 1]
+    assert iterated == [boundary_scope]
+
+    boundary_scope, (located, (scopes, *counts), iterated) = locate(False, 2)
+    assert located == (outer_scope, 2, 2) and scopes == {'value': outer_scope}
+    assert counts == [2, 2]
+    assert iterated[:2] == [boundary_scope, outer_scope]
+
+
+def test_locate_scopes_finds_every_key_in_one_walk():
+    outer_scope = Scope(inspect.currentframe())
+    outer_scope.variables = outer_scope.variables.update(inner=1, outer=2)
+
+    def locate():
+        inner_scope = Scope(inspect.currentframe())
+        inner_scope.variables = inner_scope.variables.set('inner', 3)
+        scopes, distance, scope_count = dysco.scope.locate_scopes(
+            inspect.currentframe(), ['inner', 'outer', 'missing']
+        )
+        assert scopes == {'inner': inner_scope, 'outer': outer_scope}
+        return distance, scope_count
+
+    distance, scope_count = locate()
+    assert distance > 1 and scope_count == 2
+    assert dysco.scope.locate_scopes(inspect.currentframe(), ['inner']) == (
+        {'inner': outer_scope},
+        0,
+        1,
+    )
+
+
+def test_namespaces_share_a_frame_table():
+    frame = inspect.currentframe()
+    scope = Scope(frame)
+    other_scope = Scope(frame, 'something else')
+    frame_scopes = find_frame_scopes(frame)
+    assert frame_scopes.scopes[''] is scope
+    assert frame_scopes.scopes['something else'] is other_scope
+    assert frame.f_locals[FRAME_SCOPES_KEY] is frame_scopes
+
+
 def test_namespaces_produce_new_scopes():
     frame = inspect.stack()[0].frame
     old_scope = Scope(frame)
@@ -20,15 +222,43 @@ def test_namespaces_produce_new_scopes():
     assert old_scope is not new_scope
 
 
+def test_find_scope_returns_the_innermost_defining_scope():
+    outer_scope = Scope(inspect.currentframe())
+    outer_scope.variables = outer_scope.variables.update(outer=1, shared=1)
+
+    def find_scopes():
+        inner_scope = Scope(inspect.currentframe())
+        inner_scope.variables = inner_scope.variables.set('shared', 2)
+        frame = inspect.currentframe()
+        find_scope = dysco.scope.find_scope
+        assert find_scope(frame, 'outer') is outer_scope
+        assert find_scope(frame, 'shared') is inner_scope
+        assert find_scope(frame, 'missing') is None
+        assert find_scope(frame, 'outer', 'something else') is None
+
+    find_scopes()
+
+
+def test_iterate_scopes_yields_innermost_first():
+    outer_scope = Scope(inspect.currentframe())
+
+    def get_scopes():
+        inner_scope = Scope(inspect.currentframe())
+        scopes = iterate_scopes(inspect.currentframe())
+        assert next(scopes) is inner_scope
+        assert next(scopes) is outer_scope
+
+    get_scopes()
+
+
 def test_parent_stacks_can_be_found():
     frame = inspect.stack()[0].frame
     expected_parent_scope = Scope(frame)
 
     def get_parent_scope():
-        stack = inspect.stack()
-        frame = stack[0].frame
+        frame = inspect.currentframe()
         inner_scope = Scope(frame)
-        return find_parent_scope(inner_scope, stack)[0]
+        return find_parent_scope(inner_scope, frame)[0]
 
     parent_scope = get_parent_scope()
     assert parent_scope is expected_parent_scope
@@ -42,15 +272,149 @@ def test_scopes_are_successfully_retrieved():
     assert old_scope is new_scope
 
 
+def test_scopes_are_compact():
+    frame = inspect.currentframe()
+    scope = Scope(frame)
+    assert not hasattr(scope, '__dict__')
+    assert scope.variables is empty
+    assert find_frame_scopes(frame).cache is None
+
+
 def test_scopes_are_garbage_collected():
-    def get_scope_name():
-        frame = inspect.stack()[0].frame
-        scope = Scope(frame)
-        assert scope.name in scopes_by_name
+    def get_frame_id():
+        frame = inspect.currentframe()
+        Scope(frame)
+        assert id(frame) in frame_scopes_by_frame_id
+        return id(frame)
+
+    frame_id = get_frame_id()
+    gc.collect()
+    assert frame_id not in frame_scopes_by_frame_id
+
+
+def test_generator_scope_tables_are_tracked_until_collected():
+    def generate():
+        Scope(inspect.currentframe())
+        yield id(find_frame_scopes(inspect.currentframe()))
+
+    generator = generate()
+    table_id = next(generator)
+    assert table_id in dysco.scope.resumable_table_ids
+    generator.close()
+    del generator
+    gc.collect()
+    assert table_id not in dysco.scope.resumable_table_ids
+
+
+def test_concurrent_scope_churn_is_consistent():
+    # The `scope_churn` benchmark measures how the throughput of the same workload scales.
+    iterations = int(os.environ.get('DYSCO_STRESS_ITERATIONS', 1_000))
+    shared_dysco = Dysco()
+    errors = []
+
+    def define(dysco, depth, index):
+        dysco(shadow=True).value = index
+        if depth:
+            return define(dysco, depth - 1, index)
+        return shared_dysco.value, dysco.value, dysco.get('missing')
+
+    def churn(barrier, thread_index):
+        shared_dysco.value = thread_index
+        barrier.wait()
+        for index in range(iterations):
+            dysco = Dysco() if index % 10 == 0 else shared_dysco
+            result = define(dysco, 5, index)
+            expected = (index if dysco is shared_dysco else thread_index, index, None)
+            if result != expected:
+                errors.append((thread_index, result, expected))
+
+    def run_threads(thread_count):
+        barrier = threading.Barrier(thread_count, timeout=60)
+        threads = [
+            threading.Thread(target=churn, args=(barrier, index)) for index in range(thread_count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-    scope_name = get_scope_name()
     gc.collect()
-    assert scope_name not in scopes_by_name
+    registry_size = len(frame_scopes_by_frame_id)
+    for thread_count in (1, 2, 4, 8, 16):
+        run_threads(thread_count)
+    gc.collect()
+    assert errors == []
+    assert len(frame_scopes_by_frame_id) == registry_size
+
+
+def test_generators_resumed_in_other_threads_keep_their_scopes():
+    dysco = Dysco()
+
+    def generate():
+        dysco.value = 'generator'
+        while True:
+            yield dysco.value
+
+    generator = generate()
+    assert next(generator) == 'generator'
+    results = []
+    thread = threading.Thread(target=lambda: results.append(next(generator)))
+    thread.start()
+    thread.join()
+    assert results == ['generator']
+
+
+def test_scope_churn_leaves_memory_flat():
+    # Each iteration creates eleven scopes, so raise DYSCO_SOAK_ITERATIONS for a proper soak test.
+    iterations = int(os.environ.get('DYSCO_SOAK_ITERATIONS', 4_000))
+    thread_count = 4
+    shared_dysco = Dysco()
+    peak_registry_size = 0
+    finished_threads = []
+
+    def define(dysco, depth, index):
+        nonlocal peak_registry_size
+        dysco.value = index
+        if depth:
+            return define(dysco, depth - 1, index)
+        # Deep reads give the frames caches, and churning instances creates and drops namespaces.
+        peak_registry_size = max(peak_registry_size, len(frame_scopes_by_frame_id))
+        return shared_dysco.value + dysco.value
+
+    def churn(count):
+        shared_dysco.value = 0
+        for index in range(count):
+            dysco = Dysco() if index % 10 == 0 else shared_dysco
+            define(dysco, 10, index)
+        finished_threads.append(threading.current_thread())
+
+    def run_threads(count):
+        threads = [threading.Thread(target=churn, args=(count,)) for _ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(thread in finished_threads for thread in threads)
+        gc.collect()
+
+    # Warm up first so that interpreter and allocator caches don't count as growth.
+    run_threads(iterations // thread_count // 10)
+    registry_size = len(frame_scopes_by_frame_id)
+    version_count = len(dysco.scope.versions)
+    # Tracing allocations rather than measuring resident memory ignores the allocator's own caches.
+    tracemalloc.start()
+    try:
+        memory = tracemalloc.get_traced_memory()[0]
+        run_threads(iterations // thread_count)
+        growth = tracemalloc.get_traced_memory()[0] - memory
+    finally:
+        tracemalloc.stop()
+    assert len(frame_scopes_by_frame_id) == registry_size
+    assert len(dysco.scope.versions) == version_count
+    # Each thread has at most twelve live scopes at a time, with some slack for frames in cycles.
+    assert peak_registry_size <= registry_size + 2 * thread_count * 12
+    # Leaking even one small object per iteration would take several times as much.
+    assert growth < 64 * 1024
 
 
 test_namespaces_produce_new_scopes()
@@ -0,0 +1,152 @@
+import inspect
+import pstats
+
+import pytest
+
+from dysco import Dysco, stats
+
+
+@pytest.fixture
+def recording():
+    stats.reset()
+    stats.enable()
+    try:
+        yield
+    finally:
+        stats.disable()
+        stats.reset()
+
+
+def test_buckets_are_powers_of_two():
+    buckets = [stats.bucket(value) for value in (0, 1, 2, 3, 4, 7, 8, 100)]
+    assert buckets == [0, 1, 3, 3, 7, 7, 15, 127]
+
+
+def test_nothing_is_recorded_while_disabled():
+    stats.reset()
+    dysco = Dysco()
+    dysco.value = 1
+    assert dysco.value == 1
+    assert stats.snapshot() == stats.Stats().snapshot()
+
+
+def test_operations_are_counted(recording):
+    dysco = Dysco()
+    dysco.value = 1
+    dysco['value']
+    'value' in dysco
+    'missing' in dysco
+    with pytest.raises(AttributeError):
+        dysco.missing
+    with pytest.raises(KeyError):
+        del dysco['missing']
+    del dysco.value
+    list(dysco)
+
+    operations = stats.snapshot()['operations']
+    assert {operation: counts['calls'] for operation, counts in operations.items()} == {
+        'contains': 2,
+        'del': 2,
+        'get': 2,
+        'iter': 1,
+        'set': 1,
+    }
+    assert operations['get']['hits'] == 1 and operations['get']['misses'] == 1
+    assert operations['contains']['hits'] == 1 and operations['contains']['misses'] == 1
+    assert operations['del']['hits'] == 1 and operations['del']['misses'] == 1
+    assert operations['set']['hits'] == operations['set']['misses'] == 0
+    assert all(counts['time_ns'] > 0 for counts in operations.values())
+
+
+def test_profiles_are_bounded(recording):
+    stats.enable(profile=True, profile_size=2)
+    dysco = Dysco()
+    dysco.first = 1
+    dysco.second = 2
+    dysco.third = 3
+    dysco.fourth = 4
+    try:
+        entries = stats.call_site_profile.entries
+        assert len(entries) == 3
+        assert entries[stats.CallSiteProfile.overflow_key][0] == 2
+    finally:
+        stats.call_site_profile.size = 1000
+
+
+def test_profiles_attribute_costs_to_call_sites(recording, tmp_path):
+    stats.enable(profile=True)
+    dysco = Dysco()
+    dysco.value = 1
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        line_number = inspect.currentframe().f_lineno + 1
+        return line_number, dysco.value
+
+    line_number, _ = read(20)
+    entries = stats.call_site_profile.entries
+    calls, duration, frame_count, max_frame_count = entries[
+        (__file__, line_number, 'read', 'get', 'value')
+    ]
+    assert calls == 1 and duration > 0
+    assert frame_count == max_frame_count == 21
+    assert f'{__file__}:{line_number}(read) get \'value\'' in stats.report()
+
+    path = str(tmp_path / 'dysco.prof')
+    stats.call_site_profile.dump_stats(path)
+    functions = pstats.Stats(path).stats
+    assert (__file__, line_number, "read [dysco get 'value']") in functions
+    assert pstats.Stats(stats.call_site_profile).total_calls == 2
+
+
+def test_profiles_count_the_frames_of_bulk_lookups(recording):
+    stats.enable(profile=True)
+    dysco = Dysco()
+    dysco.update(value=1, other_value=2)
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        line_number = inspect.currentframe().f_lineno + 1
+        return line_number, dysco.get_many(['value', 'other_value'])
+
+    line_number, values = read(20)
+    assert values == {'value': 1, 'other_value': 2}
+    _, _, frame_count, max_frame_count = stats.call_site_profile.entries[
+        (__file__, line_number, 'read', 'get_many', '*')
+    ]
+    assert frame_count == max_frame_count == 21
+    assert stats.snapshot()['frames_walked'] == {31: 1}
+
+
+def test_scopes_are_counted(recording):
+    dysco = Dysco()
+
+    def define():
+        dysco.value = 1
+        with dysco.scope(other=2):
+            pass
+
+    define()
+    snapshot = stats.snapshot()
+    assert snapshot['scopes_created'] == 2
+    assert snapshot['scopes_destroyed'] == 2
+
+
+def test_stack_walks_are_recorded(recording):
+    dysco = Dysco()
+    dysco.value = 1
+
+    def read(depth):
+        if depth:
+            return read(depth - 1)
+        return dysco.value
+
+    read(5)
+    snapshot = stats.snapshot()
+    assert snapshot['frames_walked'] == {7: 1}
+    assert snapshot['scopes_traversed'] == {1: 1}
+
+    stats.reset()
+    assert stats.snapshot()['frames_walked'] == {}